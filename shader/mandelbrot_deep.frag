@@ -0,0 +1,83 @@
+#version 150
+
+// Zooms down to 1e-300 by perturbation around a reference orbit the
+// viewer computes exactly, see src/deepzoom.py. Pixels iterate their
+// distance delta to the reference Z; while it is too small for floats
+// it is kept scaled by 2^-(E + e) and only the linear term is iterated.
+
+in vec2 machuchu_pos;
+out vec4 fragColor;
+
+uniform sampler2D machuchu_orbit;
+uniform int machuchu_orbit_length;
+uniform int machuchu_deep_exponent;
+uniform vec4 machuchu_deep_offset;
+uniform vec2 machuchu_deep_scale;
+
+uniform int iterations = 1000;
+uniform float param = 64.;
+
+#include "color.h"
+
+const float BAILOUT = 256.;  // as in deepzoom.py
+const float RESCALE = 65536.;
+
+vec2 orbit(int n)
+{
+    return texelFetch(machuchu_orbit, ivec2(n & 1023, n >> 10), 0).xy;
+}
+
+vec2 cmul(vec2 a, vec2 b)
+{
+    return vec2(a.x * b.x - a.y * b.y, a.x * b.y + a.y * b.x);
+}
+
+float mandel()
+{
+    // the pixel's c - reference in units of 2^E
+    vec2 dc = machuchu_deep_offset.xy
+            + (machuchu_pos * 2. - 1.) * machuchu_deep_scale
+            + machuchu_deep_offset.zw;
+    int E = machuchu_deep_exponent;
+    int last = machuchu_orbit_length - 1;
+    int n = 0;  // index into the orbit
+    int i = 0;
+
+    // delta = d * 2^(E + e); delta^2 is negligible here
+    vec2 d = vec2(0);
+    int e = 0;
+    while (E + e < -100 && i < iterations && n < last) {
+        d = 2. * cmul(orbit(n), d) + dc * exp2(float(-e));
+        ++n;
+        ++i;
+        if (max(abs(d.x), abs(d.y)) > RESCALE) {
+            d /= RESCALE;
+            e += 16;
+        }
+    }
+
+    vec2 delta = d * exp2(float(E + e));
+    dc *= exp2(float(E));  // only underflows where it no longer matters
+    while (i < iterations) {
+        vec2 z = orbit(n) + delta;
+        if (dot(z, z) > BAILOUT)
+            return float(i) + 1. - log2(log2(dot(z, z)) / 2.);
+        // back to the start of the orbit when the pixel is closer to
+        // it than to the reference or the orbit ends
+        if (dot(z, z) < dot(delta, delta) || n == last) {
+            delta = z;
+            n = 0;
+        }
+        delta = cmul(2. * orbit(n) + delta, delta) + dc;
+        ++n;
+        ++i;
+    }
+    return -1.;
+}
+
+void main()
+{
+    float m = mandel();
+    vec3 c = m < 0. ? vec3(0) : hsv2rgb(m / param, 1., 1.);
+    fragColor = vec4(c, 1);
+}
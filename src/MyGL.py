@@ -1,4 +1,8 @@
 from OpenGL import GL
+from OpenGL.GL.ARB import parallel_shader_compile as arb
+from OpenGL.GL.KHR import parallel_shader_compile as khr
+from OpenGL.raw.GL.VERSION import GL_2_0
+from resources import tracker
 
 # Pyopengl shader compilation errors are unreadable, so we'll define our own
 # routine.
@@ -9,12 +13,130 @@ class ShaderCompilationError(Exception):
         super().__init__(f"Shader compile failure:\n{text}")
         self.text = text
 
+    def __reduce__(self) -> tuple:
+        # to come back from worker processes in one piece
+        return type(self), (self.text,)
 
-def compileShader(source: str, shaderType: GL.GLenum) -> GL.GLuint:
-    shader = GL.glCreateShader(shaderType)
+
+COMPLETION_STATUS = 0x91B1  # GL_COMPLETION_STATUS_KHR / _ARB
+
+
+def hasExtension(name: str) -> bool:
+    count = GL.glGetIntegerv(GL.GL_NUM_EXTENSIONS)
+    return any(
+        GL.glGetStringi(GL.GL_EXTENSIONS, i).decode() == name
+        for i in range(count)
+    )
+
+
+def parallelCompile() -> bool:
+    # Asks the driver to compile and link on its own threads. Returns
+    # whether COMPLETION_STATUS can be polled, otherwise the first status
+    # query after a compile or link blocks until it's done.
+    if hasExtension("GL_KHR_parallel_shader_compile"):
+        khr.glMaxShaderCompilerThreadsKHR(0xFFFFFFFF)
+        return True
+    if hasExtension("GL_ARB_parallel_shader_compile"):
+        arb.glMaxShaderCompilerThreadsARB(0xFFFFFFFF)
+        return True
+    return False
+
+
+def completed(program: GL.GLuint) -> bool:
+    # the wrapped glGetProgramiv doesn't know this enum's size
+    status = GL.GLint()
+    GL_2_0.glGetProgramiv(program, COMPLETION_STATUS, status)
+    return bool(status.value)
+
+
+def startShader(source: str, shaderType: GL.GLenum) -> GL.GLuint:
+    # Doesn't wait for the result, see checkShader().
+    shader = tracker.track("shader", GL.glCreateShader(shaderType))
     GL.glShaderSource(shader, [source.encode()])
     GL.glCompileShader(shader)
+    return shader
+
+
+def checkShader(shader: GL.GLuint) -> GL.GLuint:
     result = GL.glGetShaderiv(shader, GL.GL_COMPILE_STATUS)
     if not (result):
         raise ShaderCompilationError(GL.glGetShaderInfoLog(shader).decode())
     return shader
+
+
+def compileShader(source: str, shaderType: GL.GLenum) -> GL.GLuint:
+    shader = startShader(source, shaderType)
+    try:
+        return checkShader(shader)
+    except ShaderCompilationError:
+        tracker.delete("shader", shader)
+        raise
+
+
+def startLink(
+    *shaders: GL.GLuint,
+    attributes: dict[str, int] | None = None,
+    outputs: dict[str, int] | None = None,
+    retrievable: bool = False,
+) -> GL.GLuint:
+    # Doesn't wait for the result, see checkProgram().
+    program = tracker.track("program", GL.glCreateProgram())
+    if retrievable:  # for glGetProgramBinary
+        GL.glProgramParameteri(
+            program, GL.GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL.GL_TRUE
+        )
+    for shader in shaders:
+        GL.glAttachShader(program, shader)
+    for name, location in (attributes or {}).items():
+        GL.glBindAttribLocation(program, location, name)
+    for name, location in (outputs or {}).items():
+        GL.glBindFragDataLocation(program, location, name)
+    GL.glLinkProgram(program)
+    return program
+
+
+def checkProgram(program: GL.GLuint) -> GL.GLuint:
+    result = GL.glGetProgramiv(program, GL.GL_LINK_STATUS)
+    if not (result):
+        text = GL.glGetProgramInfoLog(program).decode()
+        tracker.delete("program", program)
+        raise ShaderCompilationError(text)
+    return program
+
+
+def linkProgram(
+    *shaders: GL.GLuint,
+    attributes: dict[str, int] | None = None,
+    outputs: dict[str, int] | None = None,
+    retrievable: bool = False,
+) -> GL.GLuint:
+    return checkProgram(
+        startLink(
+            *shaders,
+            attributes=attributes,
+            outputs=outputs,
+            retrievable=retrievable,
+        )
+    )
+
+
+def resample(
+    source: int,
+    sourceSize: tuple[int, int],
+    target: int,
+    targetSize: tuple[int, int],
+) -> None:
+    # Stretches one framebuffer's color onto another's, bilinearly.
+    GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, source)
+    GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, target)
+    GL.glBlitFramebuffer(
+        0,
+        0,
+        *sourceSize,
+        0,
+        0,
+        *targetSize,
+        GL.GL_COLOR_BUFFER_BIT,
+        GL.GL_LINEAR,
+    )
+    GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
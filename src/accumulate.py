@@ -0,0 +1,292 @@
+import numpy as np
+from OpenGL import GL
+from renderer import Renderer, buildPassProgram
+from resources import textureBytes, tracker
+
+# Progressive refinement for static shaders: every sample renders the
+# shader with `p` jittered inside the pixel and adds it to float targets,
+# so after N*N samples the image is N*N supersampled. Running sums of the
+# color and of its square give a per-pixel variance to stop early on.
+
+_accumulateShader = """
+    #version 150
+    uniform sampler2D machuchu_sample;
+    out vec4 machuchu_sum;
+    out vec4 machuchu_sumsq;
+    void main() {
+        vec4 c = texelFetch(machuchu_sample, ivec2(gl_FragCoord.xy), 0);
+        machuchu_sum = c;
+        machuchu_sumsq = c * c;
+    }
+"""
+
+_resolveShader = """
+    #version 150
+    uniform sampler2D machuchu_sum;
+    uniform float machuchu_samples;
+    out vec4 machuchu_FragColor;
+    void main() {
+        vec4 sum = texelFetch(machuchu_sum, ivec2(gl_FragCoord.xy), 0);
+        machuchu_FragColor = sum / machuchu_samples;
+    }
+"""
+
+_varianceShader = """
+    #version 150
+    uniform sampler2D machuchu_sum;
+    uniform sampler2D machuchu_sumsq;
+    uniform float machuchu_samples;
+    out float machuchu_variance;
+    void main() {
+        ivec2 xy = ivec2(gl_FragCoord.xy);
+        float n = machuchu_samples;
+        vec3 mean = texelFetch(machuchu_sum, xy, 0).rgb / n;
+        vec3 sq = texelFetch(machuchu_sumsq, xy, 0).rgb / n;
+        // variance of the mean estimate, averaged over channels
+        machuchu_variance = dot(max(sq - mean * mean, 0.) / n, vec3(1. / 3.));
+    }
+"""
+
+
+def _floatTexture(size: tuple[int, int], internalFormat: int) -> int:
+    mipmaps = internalFormat == GL.GL_R32F  # for the variance reduction
+    texture = tracker.track(
+        "texture",
+        GL.glGenTextures(1),
+        textureBytes(size, internalFormat, mipmaps),
+    )
+    GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
+    for param in (GL.GL_TEXTURE_MIN_FILTER, GL.GL_TEXTURE_MAG_FILTER):
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, param, GL.GL_NEAREST)
+    GL.glTexImage2D(
+        GL.GL_TEXTURE_2D,
+        0,
+        internalFormat,
+        size[0],
+        size[1],
+        0,
+        GL.GL_RGBA,
+        GL.GL_FLOAT,
+        None,
+    )
+    return texture
+
+
+def _framebuffer(*textures: int) -> int:
+    fbo = tracker.track("framebuffer", GL.glGenFramebuffers(1))
+    GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, fbo)
+    for i, texture in enumerate(textures):
+        GL.glFramebufferTexture2D(
+            GL.GL_FRAMEBUFFER,
+            GL.GL_COLOR_ATTACHMENT0 + i,
+            GL.GL_TEXTURE_2D,
+            texture,
+            0,
+        )
+    GL.glDrawBuffers(
+        len(textures),
+        [GL.GL_COLOR_ATTACHMENT0 + i for i in range(len(textures))],
+    )
+    return fbo
+
+
+class _Programs:
+    def __init__(self) -> None:
+        self.accumulate = buildPassProgram(
+            _accumulateShader, ["machuchu_sum", "machuchu_sumsq"]
+        )
+        self.resolve = buildPassProgram(_resolveShader, ["machuchu_FragColor"])
+        self.variance = buildPassProgram(
+            _varianceShader, ["machuchu_variance"]
+        )
+        for program, samplers in (
+            (self.accumulate, ["machuchu_sample"]),
+            (self.resolve, ["machuchu_sum"]),
+            (self.variance, ["machuchu_sum", "machuchu_sumsq"]),
+        ):
+            GL.glUseProgram(program)
+            for unit, name in enumerate(samplers):
+                loc = GL.glGetUniformLocation(program, name)
+                GL.glUniform1i(loc, unit)
+
+    def delete(self) -> None:
+        tracker.delete("program", self.accumulate, self.resolve, self.variance)
+
+
+class Accumulator:
+    def __init__(
+        self,
+        renderer: Renderer,
+        grid: int = 4,
+        samples: int | None = None,
+        variance: float | None = None,
+        checkEvery: int = 4,
+    ) -> None:
+        # Stops after `samples` (default grid * grid) samples, or earlier
+        # once the mean per-pixel variance drops below `variance`.
+        self.renderer = renderer
+        self.grid = grid
+        self.maxSamples = samples or grid * grid
+        self.threshold = variance
+        self.checkEvery = checkEvery
+        self.samples = 0
+        self.variance = float("inf")
+        self.size = (0, 0)
+        self._key: tuple | None = None
+        self._programs = _Programs()
+        self._textures: list[int] = []
+        self._fbos: list[int] = []
+        # stratified positions inside the pixel, visited in random order
+        # so that any prefix covers the pixel evenly
+        cells = np.random.RandomState(0).permutation(grid * grid)
+        self._cells = [divmod(int(c), grid) for c in cells]
+        self._rng = np.random.RandomState(1)
+
+    def _allocate(self, size: tuple[int, int]) -> None:
+        self._free()
+        self.size = size
+        self._sample = _floatTexture(size, GL.GL_RGBA32F)
+        self._sum = _floatTexture(size, GL.GL_RGBA32F)
+        self._sumsq = _floatTexture(size, GL.GL_RGBA32F)
+        self._variance = _floatTexture(size, GL.GL_R32F)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self._variance)
+        GL.glTexParameteri(
+            GL.GL_TEXTURE_2D,
+            GL.GL_TEXTURE_MIN_FILTER,
+            GL.GL_LINEAR_MIPMAP_LINEAR,
+        )
+        self._textures = [self._sample, self._sum, self._sumsq, self._variance]
+        self._sampleFbo = _framebuffer(self._sample)
+        self._sumFbo = _framebuffer(self._sum, self._sumsq)
+        self._varianceFbo = _framebuffer(self._variance)
+        self._fbos = [self._sampleFbo, self._sumFbo, self._varianceFbo]
+
+    def reset(self) -> None:
+        self.samples = 0
+        self.variance = float("inf")
+        self._key = None
+
+    def current(self) -> bool:
+        # True while nothing changed since the last sample.
+        return self._key is not None and self._key == self.renderer.stateKey()
+
+    def converged(self) -> bool:
+        if self.samples >= self.maxSamples:
+            return True
+        return self.threshold is not None and self.variance < self.threshold
+
+    def _jitter(self) -> tuple[float, float]:
+        # offset from the pixel center, in pixels
+        i, j = self._cells[self.samples % len(self._cells)]
+        if self.samples < len(self._cells):
+            u, v = 0.5, 0.5
+        else:
+            u, v = self._rng.random_sample(2)
+        return (i + u) / self.grid - 0.5, (j + v) / self.grid - 0.5
+
+    def sample(self) -> None:
+        # Adds one sample of the renderer's current state. Any change of
+        # uniforms, view or size starts over.
+        renderer = self.renderer
+        if renderer.size != self.size:
+            self._allocate(renderer.size)
+        key = renderer.stateKey()
+        if key != self._key:
+            self.reset()
+            self._key = key
+            GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self._sumFbo)
+            GL.glClearColor(0.0, 0.0, 0.0, 0.0)
+            GL.glClear(GL.GL_COLOR_BUFFER_BIT)
+
+        view = renderer.viewBlock
+        x, y = view.get("machuchu_x"), view.get("machuchu_y")
+        pixel = 2.0 / (self.size[1] * view.get("machuchu_z"))
+        dx, dy = self._jitter()
+        view.set("machuchu_x", x + dx * pixel)
+        view.set("machuchu_y", y + dy * pixel)
+        # deep zooms draw their view relative to the reference instead,
+        # in units of 2^E; the jitter goes into the low half of it
+        store = renderer.uniformStore
+        deep = renderer.deepZoom is not None and store is not None
+        if deep:
+            assert store is not None
+            offset = store.get("machuchu_deep_offset")
+            _, half = store.get("machuchu_deep_scale")  # type: ignore
+            deepPixel = 2.0 * half / self.size[1]
+            hx, hy, lx, ly = offset  # type: ignore
+            store.set(
+                "machuchu_deep_offset",
+                (hx, hy, lx + dx * deepPixel, ly + dy * deepPixel),
+            )
+        renderer.draw(self._sampleFbo)
+        view.set("machuchu_x", x)
+        view.set("machuchu_y", y)
+        if deep:
+            assert store is not None
+            store.set("machuchu_deep_offset", offset)
+
+        GL.glUseProgram(self._programs.accumulate)
+        GL.glActiveTexture(GL.GL_TEXTURE0)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self._sample)
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self._sumFbo)
+        GL.glEnable(GL.GL_BLEND)
+        GL.glBlendFunc(GL.GL_ONE, GL.GL_ONE)
+        renderer.drawQuad()
+        GL.glDisable(GL.GL_BLEND)
+        self.samples += 1
+
+        if self.threshold is not None and (
+            self.samples % self.checkEvery == 0
+        ):
+            self.variance = self._measure()
+
+    def _measure(self) -> float:
+        # Per-pixel variance, averaged on the GPU by the mipmap chain.
+        GL.glUseProgram(self._programs.variance)
+        loc = GL.glGetUniformLocation(
+            self._programs.variance, "machuchu_samples"
+        )
+        GL.glUniform1f(loc, self.samples)
+        GL.glActiveTexture(GL.GL_TEXTURE0)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self._sum)
+        GL.glActiveTexture(GL.GL_TEXTURE1)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self._sumsq)
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self._varianceFbo)
+        self.renderer.drawQuad()
+        GL.glActiveTexture(GL.GL_TEXTURE0)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self._variance)
+        GL.glGenerateMipmap(GL.GL_TEXTURE_2D)
+        top = max(self.size).bit_length() - 1
+        value = GL.glGetTexImage(GL.GL_TEXTURE_2D, top, GL.GL_RED, GL.GL_FLOAT)
+        return float(np.asarray(value, np.float32).flat[0])
+
+    def resolve(self, framebuffer: int) -> None:
+        # Writes the current average into `framebuffer`.
+        GL.glUseProgram(self._programs.resolve)
+        loc = GL.glGetUniformLocation(
+            self._programs.resolve, "machuchu_samples"
+        )
+        GL.glUniform1f(loc, max(self.samples, 1))
+        GL.glActiveTexture(GL.GL_TEXTURE0)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self._sum)
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, framebuffer)
+        GL.glViewport(0, 0, *self.size)
+        self.renderer.drawQuad()
+
+    def render(self, framebuffer: int) -> None:
+        # Converges the current state and resolves it, for offline use.
+        self.reset()
+        self.sample()
+        while not self.converged():
+            self.sample()
+        self.resolve(framebuffer)
+
+    def delete(self) -> None:
+        self._free()
+        self._programs.delete()
+
+    def _free(self) -> None:
+        tracker.delete("framebuffer", *self._fbos)
+        tracker.delete("texture", *self._textures)
+        self._fbos = []
+        self._textures = []
@@ -0,0 +1,127 @@
+import collections
+import math
+from OpenGL import GL
+from renderer import Renderer, Target
+from resources import tracker
+
+# Dynamic resolution for the viewer. While the picture changes, frames are
+# rendered at a fraction of the window size chosen to fit a frame time
+# budget and stretched with bilinear filtering; once nothing moves the
+# next frame is rendered at full size again. The view uniforms don't
+# depend on the pixel count, so `p` and machuchu_aspect are the same at
+# every scale. The feedback textures follow the scaled size, resampled
+# rather than cleared, so feedback shaders keep their state.
+
+
+class AdaptiveResolution:
+    def __init__(
+        self,
+        renderer: Renderer,
+        budget: float = 1000 / 60,
+        minScale: float = 0.25,
+        steps: int = 16,
+    ) -> None:
+        # `budget` is the GPU time per frame in ms. Scales are multiples
+        # of 1/`steps`, so that the targets aren't reallocated for every
+        # little fluctuation.
+        self.renderer = renderer
+        self.budget = budget
+        self.minScale = minScale
+        self.steps = steps
+        self.scale = 1.0  # used while moving
+        self.current = 1.0  # used for the last frame
+        self._target: Target | None = None
+        self._key: tuple | None = None
+        # GL_TIME_ELAPSED queries in flight, with the scale they measured
+        self._free: list[int] = []
+        self._pending: collections.deque[
+            tuple[int, float]
+        ] = collections.deque()
+
+    def _still(self) -> bool:
+        store = self.renderer.uniformStore
+        key = (
+            self.renderer.program,
+            self.renderer.viewBlock.key(),
+            store.key() if store is not None else None,
+        )
+        still = key == self._key
+        self._key = key
+        return still
+
+    def _scaled(self, size: tuple[int, int], scale: float) -> tuple[int, int]:
+        return (
+            max(1, round(size[0] * scale)),
+            max(1, round(size[1] * scale)),
+        )
+
+    def draw(self, framebuffer: int, size: tuple[int, int]) -> None:
+        self.current = 1.0 if self._still() else self.scale
+        scaled = self._scaled(size, self.current)
+        if self.renderer.size != scaled:
+            self.renderer.resize(*scaled, resample=True)
+
+        query = self._free.pop() if self._free else self._query()
+        GL.glBeginQuery(GL.GL_TIME_ELAPSED, query)
+        if scaled == size:
+            self.renderer.draw(framebuffer)
+        else:
+            target = self._targetFor(scaled)
+            self.renderer.draw(target.fbo)
+            GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, target.fbo)
+            GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, framebuffer)
+            GL.glBlitFramebuffer(
+                0,
+                0,
+                scaled[0],
+                scaled[1],
+                0,
+                0,
+                size[0],
+                size[1],
+                GL.GL_COLOR_BUFFER_BIT,
+                GL.GL_LINEAR,
+            )
+            GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, framebuffer)
+        GL.glEndQuery(GL.GL_TIME_ELAPSED)
+        self._pending.append((query, self.current))
+        self._adjust()
+
+    def _query(self) -> int:
+        return tracker.track("query", GL.glGenQueries(1)[0])
+
+    def _targetFor(self, size: tuple[int, int]) -> Target:
+        if self._target is None or self._target.size != size:
+            if self._target is not None:
+                self._target.delete()
+            self._target = Target(*size)
+        return self._target
+
+    def _adjust(self) -> None:
+        # Only frames rendered at the moving scale say anything about it;
+        # the cost is taken to be proportional to the pixel count.
+        while self._pending:
+            query, scale = self._pending[0]
+            if not GL.glGetQueryObjectiv(query, GL.GL_QUERY_RESULT_AVAILABLE):
+                break
+            self._pending.popleft()
+            elapsed = GL.glGetQueryObjectiv(query, GL.GL_QUERY_RESULT) / 1e6
+            self._free.append(query)
+            if scale != self.scale or elapsed <= 0:
+                continue
+            if 0.7 * self.budget < elapsed < 1.05 * self.budget:
+                continue
+            wanted = scale * math.sqrt(self.budget / elapsed)
+            wanted = min(wanted, scale * 1.25)  # grow carefully
+            wanted = math.floor(wanted * self.steps) / self.steps
+            self.scale = max(self.minScale, min(1.0, wanted))
+
+    def delete(self) -> None:
+        if self._target is not None:
+            self._target.delete()
+            self._target = None
+        tracker.delete(
+            "query", *self._free, *(query for query, _ in self._pending)
+        )
+        self._free = []
+        self._pending.clear()
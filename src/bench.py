@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+
+import headless  # must come before anything that imports OpenGL.GL
+
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+from OpenGL import GL
+import MyGL
+from coord import CoordUniform
+from preprocessor import IncludeCache, Preprocessor
+from render import parse_assignment, parse_size
+from renderer import Renderer, Target
+from uniforms import UniformValue
+
+# Benchmarks of the shader library: preprocessing, compile/link and GPU
+# time per frame for every shader at a few sizes and uniform presets. The
+# results are JSON files that `compare` checks against each other, e.g.
+# before and after a change to lib.h. GPU times come from the renderer's
+# profiler, so they are the timestamp query sections of Renderer.draw.
+
+FORMAT_VERSION = 1
+SHADER_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "shader"
+)
+
+Preset = tuple[str, list[tuple[str, UniformValue]]]
+
+
+def parse_sizes(text: str) -> list[tuple[int, int]]:
+    return [parse_size(size) for size in text.split(",")]
+
+
+def parse_preset(text: str) -> Preset:
+    # NAME or NAME:U=V;U=V...
+    name, _, assignments = text.partition(":")
+    if not name:
+        raise argparse.ArgumentTypeError(f"preset without a name: {text!r}")
+    return name, [parse_assignment(a) for a in assignments.split(";") if a]
+
+
+def shader_name(path: str) -> str:
+    path = os.path.abspath(path)
+    if os.path.dirname(path) == SHADER_DIR:
+        return os.path.basename(path)
+    return os.path.relpath(path)
+
+
+def revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=SHADER_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def preprocess(path: str, repeat: int) -> tuple[Preprocessor, float]:
+    # A fresh include cache each time, the best of `repeat` runs.
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        prep = Preprocessor(path, IncludeCache())
+        best = min(best, (time.perf_counter_ns() - start) / 1e6)
+    return prep, best
+
+
+def compile_shader(
+    renderer: Renderer, prep: Preprocessor, repeat: int
+) -> float:
+    # Compile and link, the best of `repeat` runs; the first compile in a
+    # process also pays for initializing the compiler.
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        renderer.setFragmentShader(
+            prep.text, prep.version, os.path.dirname(prep.fnames[0])
+        )
+        GL.glFinish()
+        best = min(best, (time.perf_counter_ns() - start) / 1e6)
+    return best
+
+
+def measure(
+    renderer: Renderer, target: Target, frames: int, warmup: int, fps: float
+) -> list[float]:
+    # GPU ms of each frame after `warmup` frames. The profiler has to
+    # wait for every frame, none may be given up on.
+    profiler = renderer.profiler
+    profiler.depth = frames + 1
+    lost = profiler.lost
+    try:
+        for frame in range(warmup + frames):
+            if frame == warmup:
+                profiler.start(trace=True)
+            renderer.setUniform("time", frame * 1000.0 / fps)
+            renderer.draw(target.fbo)
+            profiler.frame()
+        profiler.flush()
+        assert profiler.lost == lost
+        return [
+            sum(v for k, v in record.items() if k.startswith("gpu."))
+            for record in profiler.records()
+        ]
+    finally:
+        profiler.stop()
+
+
+def bench_shader(
+    args: argparse.Namespace, renderer: Renderer, path: str
+) -> dict:
+    prep, preprocess_ms = preprocess(path, args.repeat)
+    result: dict = {
+        "includes": sorted(shader_name(f) for f in prep.fnames[1:]),
+        "preprocess_ms": preprocess_ms,
+    }
+    try:
+        result["compile_ms"] = compile_shader(renderer, prep, args.repeat)
+    except MyGL.ShaderCompilationError as e:
+        result["error"] = e.text
+        return result
+
+    runs = result["runs"] = {}
+    assert renderer.uniformStore is not None
+    defaults = {
+        uniform: slot.value
+        for uniform, slot in renderer.uniformStore.slots.items()
+    }
+    coord = CoordUniform()
+    for size in args.sizes:
+        renderer.resize(*size)
+        coord.size = size
+        target = Target(*size)
+        try:
+            for name, assignments in args.presets:
+                for uniform, value in defaults.items():
+                    renderer.setUniform(uniform, value)
+                renderer.setView(coord)
+                for uniform, value in assignments:
+                    renderer.setUniform(uniform, value)
+                times = measure(
+                    renderer, target, args.frames, args.warmup, args.fps
+                )
+                runs[f"{size[0]}x{size[1]}/{name}"] = {
+                    "median_ms": float(np.median(times)),
+                    "p95_ms": float(np.percentile(times, 95)),
+                    "frames": len(times),
+                }
+        finally:
+            target.delete()
+    return result
+
+
+def run(args: argparse.Namespace) -> None:
+    files = args.files or sorted(glob.glob(os.path.join(SHADER_DIR, "*.frag")))
+    presets = [name for name, _ in args.presets]
+    if len(set(presets)) != len(presets):
+        sys.exit("preset names must be unique")
+    # Mesa keeps compiled shaders on disk, which would turn compile times
+    # into cache lookups; read when the display is initialized.
+    os.environ.setdefault("MESA_SHADER_CACHE_DISABLE", "true")
+    context = headless.HeadlessContext()
+    print(context.describe(), file=sys.stderr)
+    try:
+        renderer = Renderer()
+        driver = {
+            key: GL.glGetString(name).decode()
+            for key, name in (
+                ("vendor", GL.GL_VENDOR),
+                ("renderer", GL.GL_RENDERER),
+                ("version", GL.GL_VERSION),
+            )
+        }
+        shaders = {}
+        for index, path in enumerate(files):
+            name = shader_name(path)
+            print(f"[{index + 1}/{len(files)}] {name}", file=sys.stderr)
+            shaders[name] = bench_shader(args, renderer, path)
+            print(format_result(shaders[name]), file=sys.stderr)
+        renderer.delete()
+    finally:
+        context.destroy()
+
+    data = {
+        "version": FORMAT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "revision": revision(),
+        "driver": driver,
+        "settings": {
+            "frames": args.frames,
+            "warmup": args.warmup,
+            "fps": args.fps,
+            "presets": {name: dict(a) for name, a in args.presets},
+        },
+        "shaders": shaders,
+    }
+    with open(args.output, "w") as f:
+        json.dump(data, f, indent=1)
+    print(f"results written to {args.output}", file=sys.stderr)
+
+
+def format_result(result: dict) -> str:
+    if "error" in result:
+        return "    compile error"
+    lines = [
+        f"    preprocess {result['preprocess_ms']:.2f} ms, "
+        f"compile {result['compile_ms']:.1f} ms"
+    ]
+    for run, stats in result["runs"].items():
+        lines.append(
+            f"    {run:24} {stats['median_ms']:8.3f} ms median "
+            f"{stats['p95_ms']:8.3f} ms p95"
+        )
+    return "\n".join(lines)
+
+
+def load_results(fname: str) -> dict:
+    with open(fname) as f:
+        data = json.load(f)
+    if data.get("version") != FORMAT_VERSION:
+        sys.exit(f"{fname}: unsupported format {data.get('version')!r}")
+    return data
+
+
+def metrics(result: dict) -> dict[str, float]:
+    values = {}
+    for key in ("preprocess_ms", "compile_ms"):
+        if key in result:
+            values[key.removesuffix("_ms")] = result[key]
+    for run, stats in result.get("runs", {}).items():
+        values[run] = stats["median_ms"]
+    return values
+
+
+def compare(args: argparse.Namespace) -> None:
+    # Exits with 1 if anything got slower than the threshold allows;
+    # differences below --min-ms are noise either way.
+    old, new = load_results(args.old), load_results(args.new)
+    if old["driver"] != new["driver"]:
+        print("warning: the results are from different drivers")
+    slower = 0
+    for name in sorted(set(old["shaders"]) | set(new["shaders"])):
+        a = old["shaders"].get(name)
+        b = new["shaders"].get(name)
+        if a is None or b is None:
+            print(f"{name}: only in {args.old if b is None else args.new}")
+            continue
+        if "error" in a or "error" in b:
+            if ("error" in a) != ("error" in b):
+                print(f"{name}: {'fixed' if 'error' in a else 'broken'}")
+                slower += "error" in b
+            continue
+        before, after = metrics(a), metrics(b)
+        lines = []
+        for key in before.keys() & after.keys():
+            x, y = before[key], after[key]
+            if abs(y - x) < args.min_ms or x <= 0:
+                continue
+            change = y / x - 1
+            if abs(change) < args.threshold:
+                continue
+            lines.append(
+                f"    {key:24} {x:9.3f} -> {y:9.3f} ms {change:+7.1%}"
+            )
+            slower += change > 0
+        if lines:
+            includes = ", ".join(b["includes"]) or "no includes"
+            print(f"{name} ({includes})")
+            print("\n".join(sorted(lines)))
+    print(f"{slower} regressions beyond {args.threshold:.0%}")
+    sys.exit(1 if slower else 0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="machuchu bench",
+        description="Benchmark shaders without a window and compare runs.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="benchmark shaders")
+    run_parser.add_argument(
+        "files", nargs="*", help="fragment shaders (default: shader/*.frag)"
+    )
+    run_parser.add_argument(
+        "--sizes",
+        type=parse_sizes,
+        default=[(640, 360), (1920, 1080)],
+        metavar="WxH,...",
+        help="render sizes (default: 640x360,1920x1080)",
+    )
+    run_parser.add_argument(
+        "--preset",
+        type=parse_preset,
+        action="append",
+        dest="presets",
+        metavar="NAME[:U=V;...]",
+        help="uniform values to benchmark with, repeatable; vectors are "
+        "comma-separated (default: the shader's own values)",
+    )
+    run_parser.add_argument(
+        "--frames", type=int, default=60, help="measured frames"
+    )
+    run_parser.add_argument(
+        "--warmup", type=int, default=10, help="frames before measuring"
+    )
+    run_parser.add_argument(
+        "--fps", type=float, default=30.0, help="time step of animations"
+    )
+    run_parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="preprocessor and compiler runs, the fastest counts",
+    )
+    run_parser.add_argument(
+        "-o", "--output", default="bench.json", metavar="FILE"
+    )
+
+    compare_parser = commands.add_parser(
+        "compare", help="flag regressions between two runs"
+    )
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative slowdown to report (default: 0.1)",
+    )
+    compare_parser.add_argument(
+        "--min-ms",
+        type=float,
+        default=0.05,
+        help="ignore differences below this (default: 0.05)",
+    )
+
+    args = parser.parse_args()
+    if args.command == "run":
+        args.presets = args.presets or [("default", [])]
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == "__main__":
+    main()
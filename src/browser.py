@@ -0,0 +1,203 @@
+import os
+import typing
+import Qt
+from preprocessor import requestedFiles
+from thumbnails import ThumbnailCache, ThumbnailWorkers
+from updater import Updater
+
+# A dock listing the shaders of a directory tree with thumbnails. Only
+# the items scrolled into view get keyed and looked up in the thumbnail
+# cache; missing thumbnails are rendered in the background. The files
+# behind every keyed shader are watched, a change to one of them re-keys
+# the shaders depending on it, found through the include graph, so an
+# edited header brings fresh thumbnails of everything including it.
+
+_PATH = Qt.Qt.UserRole
+_KEY = Qt.Qt.UserRole + 1
+_KEYED = Qt.Qt.UserRole + 2  # cleared when a file it depends on changes
+
+
+def _stamp(fname: str) -> tuple[int, int] | None:
+    try:
+        st = os.stat(fname)
+    except OSError:
+        return None
+    return st.st_ino, st.st_ctime_ns
+
+
+class ShaderBrowser(Qt.QDockWidget):
+    def __init__(
+        self, directory: str, load: typing.Callable[[str], None]
+    ) -> None:
+        super().__init__("Shaders")
+        self.directory = directory
+        self.cache = ThumbnailCache()
+        self.workers = ThumbnailWorkers(
+            self.cache, max(1, (os.cpu_count() or 2) // 2)
+        )
+        self.updater: Updater | None = None
+        self._stamps: dict[str, tuple[int, int] | None] = {}  # watched
+        # file -> shaders, for what the include graph doesn't know:
+        # textures, and the files of shaders that failed to preprocess
+        self._users: dict[str, set[str]] = {}
+        self._items: dict[str, Qt.QListWidgetItem] = {}  # by path
+
+        widget = Qt.QWidget()
+        layout = Qt.QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        widget.setLayout(layout)
+        self.filter = Qt.QLineEdit()
+        self.filter.setPlaceholderText("Filter")
+        self.filter.textChanged.connect(self.applyFilter)
+        layout.addWidget(self.filter)
+        self.list = Qt.QListWidget()
+        self.list.setViewMode(Qt.QListView.IconMode)
+        self.list.setIconSize(Qt.QSize(*self.cache.size))
+        self.list.setResizeMode(Qt.QListView.Adjust)
+        self.list.setMovement(Qt.QListView.Static)
+        self.list.setUniformItemSizes(True)
+        self.list.setWordWrap(True)
+        self.list.itemActivated.connect(lambda item: load(item.data(_PATH)))
+        self.list.verticalScrollBar().valueChanged.connect(self.loadVisible)
+        layout.addWidget(self.list)
+        self.setWidget(widget)
+
+        pending = Qt.QPixmap(*self.cache.size)
+        pending.fill(Qt.Qt.darkGray)
+        self.pendingIcon = Qt.QIcon(pending)
+        self.errorIcon = self.style().standardIcon(
+            Qt.QStyle.SP_MessageBoxWarning
+        )
+
+        # polls for finished thumbnails and changed files while shown
+        self.timer = Qt.QTimer(self)
+        self.timer.setInterval(100)
+        self.timer.timeout.connect(self.poll)
+
+    def showEvent(self, e: Qt.QtGui.QShowEvent) -> None:
+        super().showEvent(e)
+        self.scan()  # for new files, thumbnails are keyed lazily anyway
+        self.timer.start()
+        Qt.QTimer.singleShot(0, self.loadVisible)  # after the layout
+
+    def hideEvent(self, e: Qt.QtGui.QHideEvent) -> None:
+        super().hideEvent(e)
+        self.timer.stop()
+
+    def resizeEvent(self, e: Qt.QtGui.QResizeEvent) -> None:
+        super().resizeEvent(e)
+        Qt.QTimer.singleShot(0, self.loadVisible)
+
+    def scan(self) -> None:
+        self.list.clear()
+        self._items = {}
+        paths = []
+        for root, dirs, files in os.walk(self.directory):
+            dirs.sort()
+            paths += [
+                os.path.join(root, f) for f in files if f.endswith(".frag")
+            ]
+        for path in sorted(paths):
+            name = os.path.relpath(path, self.directory)
+            item = Qt.QListWidgetItem(self.pendingIcon, name[:-5])
+            item.setData(_PATH, path)
+            item.setToolTip(path)
+            self.list.addItem(item)
+            self._items[path] = item
+        self.applyFilter(self.filter.text())
+
+    def applyFilter(self, text: str) -> None:
+        for item in self._items.values():
+            item.setHidden(text.lower() not in item.text().lower())
+        Qt.QTimer.singleShot(0, self.loadVisible)
+
+    def visibleItems(self) -> list[Qt.QListWidgetItem]:
+        viewport = self.list.viewport().rect()
+        return [
+            item
+            for item in self._items.values()
+            if not item.isHidden()
+            and viewport.intersects(self.list.visualItemRect(item))
+        ]
+
+    def loadVisible(self) -> None:
+        if not self.isVisible():
+            return
+        for item in self.visibleItems():
+            if item.data(_KEYED):
+                continue
+            item.setData(_KEYED, True)
+            path = item.data(_PATH)
+            try:
+                key, includes, textures = self.cache.key(path)
+            except Exception as e:
+                self.setError(item, str(e))
+                # e.g. a missing include, its creation re-keys
+                files = requestedFiles(path, self.cache.includeCache)
+                self.depend(path, files, files)
+                continue
+            self.depend(path, includes + textures, textures)
+            if key == item.data(_KEY):
+                continue  # nothing it depends on changed
+            item.setData(_KEY, key)
+            png, error = self.cache.lookup(key)
+            if png is not None:
+                item.setIcon(Qt.QIcon(png))
+                item.setToolTip(path)
+            elif error is not None:
+                self.setError(item, error)
+            else:
+                item.setIcon(self.pendingIcon)
+                self.workers.request(path, key)
+        if self.updater is None:
+            self.updater = Updater(sorted(self._stamps))
+        else:
+            self.updater.set_files(sorted(self._stamps))
+
+    def depend(self, path: str, files: list[str], users: list[str]) -> None:
+        # Watches `files` for the shader `path`; of those, `users` are
+        # mapped back to it here.
+        for f in files:
+            if f not in self._stamps:
+                self._stamps[f] = _stamp(f)
+        for f in users:
+            self._users.setdefault(f, set()).add(path)
+
+    def rekey(self) -> None:
+        # Finds the watched files that changed and re-keys the shaders
+        # depending on them.
+        includes = self.cache.includeCache
+        stale: set[str] = set()
+        for f, old in self._stamps.items():
+            new = _stamp(f)
+            if new == old:
+                continue
+            self._stamps[f] = new
+            stale |= includes.invalidate(f)
+            stale |= self._users.pop(f, set())
+        for path in stale:
+            item = self._items.get(path)
+            if item is not None:
+                item.setData(_KEYED, False)
+        self.loadVisible()
+
+    def setError(self, item: Qt.QListWidgetItem, error: str) -> None:
+        item.setIcon(self.errorIcon)
+        item.setToolTip(f"{item.data(_PATH)}\n\n{error.strip()}")
+
+    def poll(self) -> None:
+        for path, key, png, error in self.workers.poll():
+            item = self._items.get(path)
+            if item is None or item.data(_KEY) != key:
+                continue  # changed again meanwhile
+            if png is not None:
+                item.setIcon(Qt.QIcon(png))
+            else:
+                self.setError(item, error or "")
+        if self.updater is not None and self.updater.check():
+            self.rekey()
+
+    def shutdown(self) -> None:
+        self.workers.close()
+        if self.updater is not None:
+            self.updater.close()
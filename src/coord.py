@@ -0,0 +1,153 @@
+import copy
+import math
+import typing
+from decimal import Decimal, localcontext
+import numpy as np
+from uniforms import UniformValue
+
+_DIGITS_PER_STEP = math.log10(1.1)  # of zoom, z[0] counts steps of 1.1
+_MAX_Z = float(np.finfo(np.float32).max)  # deep zooms go past it
+# z[0] stays within 1e-300..1e300, 1.1 ** z[0] overflows soon after
+_MAX_STEPS = int(300 / _DIGITS_PER_STEP)
+
+
+class CoordUniform:
+    _Fun = typing.Callable[
+        [tuple[float, float, float], float], tuple[float, float, float]
+    ]
+
+    def __init__(self) -> None:
+        self.x = self.y = self.z = (0.0, 0.0, 0.0)
+        # The center is center() = origin + x[0], y[0]: movements add up
+        # in the floats and are folded into the exact origin, so deep
+        # zooms keep the digits floats lose.
+        self.center_origin = (Decimal(0), Decimal(0))
+        self.mouse_pressed = False
+        self.mouse_i: None | tuple[int, int] = None
+        self.mouse_f = self.mouse_f_start = (float("nan"), float("nan"))
+        self.size: tuple[int, int] = (1, 1)
+
+    def origin(self) -> None:
+        self.center_origin = (Decimal(0), Decimal(0))
+        self.x = (0.0, 0.0, self.x[2])
+        self.y = (0.0, 0.0, self.y[2])
+
+    def zoom_reset(self) -> None:
+        self.z = (0.0, 0.0, 0.0)
+
+    def add(self, x: float = 0.0, y: float = 0.0, z: float = 0.0) -> None:
+        f: CoordUniform._Fun = lambda v, d: (v[0], v[1], v[2] + d)
+        self.x = f(self.x, x)
+        self.y = f(self.y, y)
+        self.z = f(self.z, z)
+
+    def move(self, x: float, y: float) -> None:
+        z = 2.0 / (1.1 ** self.z[0]) / self.size[1]
+        f: CoordUniform._Fun = lambda v, d: (v[0] + d * z, v[1], v[2])
+        self.x = f(self.x, x)
+        self.y = f(self.y, y)
+        self._fold()
+
+    def precision(self) -> int:
+        # Decimal digits that still resolve pixels at the current zoom.
+        return max(28, int(self.z[0] * _DIGITS_PER_STEP) + 20)
+
+    def center(self) -> tuple[Decimal, Decimal]:
+        with localcontext() as ctx:
+            ctx.prec = self.precision()
+            return (
+                self.center_origin[0] + Decimal(self.x[0]),
+                self.center_origin[1] + Decimal(self.y[0]),
+            )
+
+    def _clampZoom(self) -> None:
+        z = min(max(self.z[0], -_MAX_STEPS), _MAX_STEPS)
+        self.z = (z, self.z[1], self.z[2])
+
+    def _fold(self) -> None:
+        if self.x[0] == 0.0 and self.y[0] == 0.0:
+            return
+        self.center_origin = self.center()
+        self.x = (0.0, self.x[1], self.x[2])
+        self.y = (0.0, self.y[1], self.y[2])
+
+    def zoom(
+        self, z: float, origin: None | tuple[float, float] = None
+    ) -> None:
+        if origin:
+            sx, sy = (
+                origin[0] - self.size[0] / 2.0,
+                origin[1] - self.size[1] / 2.0,
+            )
+        else:
+            sx, sy = (0, 0)
+        self.move(sx, -sy)
+        self.z = (self.z[0] + z, self.z[1], self.z[2])
+        self._clampZoom()
+        self.move(-sx, sy)
+
+    def translate(self, x: float, y: float) -> tuple[float, float]:
+        z = 2.0 / (1.1 ** self.z[0]) / self.size[1]
+        sx = (
+            float(self.center_origin[0])
+            + self.x[0]
+            + (x - self.size[0] / 2.0) * z
+        )
+        sy = (
+            float(self.center_origin[1])
+            + self.y[0]
+            - (y - self.size[1] / 2.0) * z
+        )
+        return sx, sy
+
+    def mouse_down(self, x: int, y: int) -> None:
+        self.mouse_pressed = True
+        self.mouse_i = (x, y)
+        self.mouse_f = self.mouse_f_start = self.translate(x, y)
+
+    def mouse_move(self, x: int, y: int) -> None:
+        self.mouse_pressed = True
+        self.mouse_i = (x, y)
+        self.mouse_f = self.translate(x, y)
+
+    def mouse_up(self) -> None:
+        self.mouse_pressed = False
+
+    def update(self) -> None:
+        f: CoordUniform._Fun = lambda v, s: (
+            v[0] + v[1] / s,
+            (v[1] * 15 + v[2]) / 16,
+            v[2],
+        )
+        z = 25 * 1.1 ** self.z[0]
+        self.x = f(self.x, z)
+        self.y = f(self.y, z)
+        self.z = f(self.z, 2)
+        self._clampZoom()
+        self._fold()
+        if self.mouse_i is not None and self.mouse_pressed:
+            self.mouse_f = self.translate(*self.mouse_i)
+
+    def ahead(self, fraction: float) -> "CoordUniform":
+        # A copy moved `fraction` of the next update() on, for drawing
+        # between updates without touching the state they advance.
+        coord = copy.copy(self)
+        z = 25 * 1.1 ** self.z[0]
+        coord.x = (self.x[0] + fraction * self.x[1] / z, *self.x[1:])
+        coord.y = (self.y[0] + fraction * self.y[1] / z, *self.y[1:])
+        coord.z = (self.z[0] + fraction * self.z[1] / 2, *self.z[1:])
+        return coord
+
+    def moving(self) -> bool:
+        # True while a key is held or momentum hasn't died down yet.
+        return any(
+            v[2] != 0 or abs(v[1]) > 1e-12 for v in (self.x, self.y, self.z)
+        )
+
+    def items(self) -> typing.Iterator[tuple[str, UniformValue]]:
+        yield "machuchu_x", float(self.center_origin[0]) + self.x[0]
+        yield "machuchu_y", float(self.center_origin[1]) + self.y[0]
+        yield "machuchu_z", min(1.1 ** self.z[0], _MAX_Z)
+        yield "machuchu_aspect", self.size[0] / self.size[1]
+        yield "machuchu_click", self.mouse_pressed
+        yield "machuchu_mouse", (*self.mouse_f, *self.mouse_f_start)
@@ -0,0 +1,195 @@
+import math
+from concurrent.futures import Future, ThreadPoolExecutor
+from decimal import Decimal, localcontext
+import numpy as np
+from OpenGL import GL
+from coord import CoordUniform
+from resources import textureBytes, tracker
+from uniforms import UniformStore
+
+# Deep zooms into the Mandelbrot set by perturbation. Floats run out of
+# digits around 1e-5, so shaders declaring
+#
+#     uniform sampler2D machuchu_orbit;
+#
+# get the orbit Z_n of z -> z^2 + c for one reference point instead,
+# computed exactly on the CPU with as many digits as the zoom needs, and
+# only iterate how far their pixels stray from it, which fits in floats.
+# The view is described relative to the reference, in units of 2^E close
+# to half the view height:
+#
+#     int machuchu_orbit_length     orbit texels, Z_0 = 0 included
+#     int machuchu_deep_exponent    E
+#     vec4 machuchu_deep_offset     view center - reference as a float
+#                                   pair: high x, y then low x, y
+#     vec2 machuchu_deep_scale      half the view size
+#
+# The orbit is a RG32F texture ORBIT_WIDTH texels wide, Z_n at
+# (n % ORBIT_WIDTH, n / ORBIT_WIDTH). It is as long as the `iterations`
+# uniform asks, if the shader has one, unless the reference escapes
+# first. See shader/mandelbrot_deep.frag.
+
+ORBIT_WIDTH = 1024
+BAILOUT = 256.0  # |Z|^2 past which the orbit ends
+DEFAULT_ITERATIONS = 1000
+MAX_OFFSET = 1024.0  # in 2^E, a view further away gets a new reference
+MAX_DEPTH = 32  # binary digits the view may zoom past its reference
+_LOG2_STEP = math.log2(1.1)  # of zoom, z[0] counts steps of 1.1
+_DIGITS_PER_BIT = math.log10(2)
+
+
+def referenceOrbit(
+    x: Decimal, y: Decimal, iterations: int, digits: int
+) -> np.ndarray:
+    # Z_0 to Z_n as float32 (n + 1, 2), n = `iterations` unless the
+    # orbit escapes before. Each step depends on the previous one, so
+    # this is a plain loop; with the Decimal module's C implementation
+    # a few thousand iterations at a hundred digits take milliseconds.
+    orbit = [(0.0, 0.0)]
+    with localcontext() as ctx:
+        ctx.prec = digits
+        zx = zy = Decimal(0)
+        for _ in range(iterations):
+            xx = zx * zx
+            yy = zy * zy
+            zy = 2 * zx * zy + y
+            zx = xx - yy + x
+            orbit.append((float(zx), float(zy)))
+            if zx * zx + zy * zy > BAILOUT:
+                break
+    return np.array(orbit, np.float32)
+
+
+class _Reference:
+    def __init__(
+        self, x: Decimal, y: Decimal, log2Half: float, iterations: int
+    ) -> None:
+        self.x = x
+        self.y = y
+        self.log2Half = log2Half  # of the view it was made for
+        self.iterations = iterations
+        self.length = 0
+
+    def digits(self) -> int:
+        return int((MAX_DEPTH - self.log2Half) * _DIGITS_PER_BIT) + 20
+
+    def escaped(self) -> bool:
+        return 0 < self.length <= self.iterations
+
+    def covers(
+        self, x: Decimal, y: Decimal, log2Half: float, iterations: int
+    ) -> bool:
+        if iterations > self.iterations and not self.escaped():
+            return False
+        if log2Half < self.log2Half - MAX_DEPTH:
+            return False
+        distance = float(max(abs(x - self.x), abs(y - self.y)))
+        return distance <= MAX_OFFSET * 2.0**log2Half
+
+
+class DeepZoom:
+    # Keeps a reference near the view. New references are computed on a
+    # thread; unless asked to wait, the old one is used until the new
+    # one is done, it is only less precise or ends sooner.
+
+    def __init__(self) -> None:
+        self.texture = tracker.track("texture", GL.glGenTextures(1))
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture)
+        for param in (GL.GL_TEXTURE_MIN_FILTER, GL.GL_TEXTURE_MAG_FILTER):
+            GL.glTexParameteri(GL.GL_TEXTURE_2D, param, GL.GL_NEAREST)
+        for param in (GL.GL_TEXTURE_WRAP_S, GL.GL_TEXTURE_WRAP_T):
+            GL.glTexParameteri(GL.GL_TEXTURE_2D, param, GL.GL_CLAMP_TO_EDGE)
+        self.unit = 0
+        self.reference: _Reference | None = None
+        self._pending: tuple[_Reference, Future] | None = None
+        self._pool = ThreadPoolExecutor(1, "deep-zoom")
+
+    def setView(
+        self, coord: CoordUniform, store: UniformStore, wait: bool = True
+    ) -> None:
+        x, y = coord.center()
+        log2Half = -coord.z[0] * _LOG2_STEP
+        iterations = DEFAULT_ITERATIONS
+        if "iterations" in store:
+            iterations = max(1, int(store.get("iterations")))  # type: ignore
+        self._update(x, y, log2Half, iterations, wait)
+        reference = self.reference
+        assert reference is not None
+
+        exponent = math.floor(log2Half)
+        mantissa = 2.0 ** (log2Half - exponent)
+        with localcontext() as ctx:
+            ctx.prec = coord.precision()
+            scale = Decimal(2) ** -exponent
+            offset = np.array(
+                [
+                    float((x - reference.x) * scale),
+                    float((y - reference.y) * scale),
+                ]
+            )
+        high = offset.astype(np.float32)
+        low = (offset - high).astype(np.float32)
+        aspect = coord.size[0] / coord.size[1]
+        store.set("machuchu_orbit_length", reference.length)
+        store.set("machuchu_deep_exponent", exponent)
+        store.set(
+            "machuchu_deep_offset", (*map(float, high), *map(float, low))
+        )
+        store.set("machuchu_deep_scale", (aspect * mantissa, mantissa))
+
+    def _update(
+        self,
+        x: Decimal,
+        y: Decimal,
+        log2Half: float,
+        iterations: int,
+        wait: bool,
+    ) -> None:
+        if self._pending is not None:
+            if wait or self.reference is None or self._pending[1].done():
+                self._upload(*self._pending)
+                self._pending = None
+        latest = self._pending[0] if self._pending else self.reference
+        if latest is not None and latest.covers(x, y, log2Half, iterations):
+            return
+        if self._pending is not None:
+            self._pending[1].cancel()
+        reference = _Reference(x, y, log2Half, iterations)
+        future = self._pool.submit(
+            referenceOrbit, x, y, iterations, reference.digits()
+        )
+        self._pending = (reference, future)
+        if wait or self.reference is None:
+            self._upload(*self._pending)
+            self._pending = None
+
+    def _upload(self, reference: _Reference, future: Future) -> None:
+        orbit = future.result()
+        reference.length = len(orbit)
+        rows = -(-len(orbit) // ORBIT_WIDTH)
+        texels = np.zeros((rows * ORBIT_WIDTH, 2), np.float32)
+        texels[: len(orbit)] = orbit
+        nbytes = textureBytes((ORBIT_WIDTH, rows), GL.GL_RG32F)
+        tracker.track("texture", self.texture, nbytes)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture)
+        GL.glTexImage2D(
+            GL.GL_TEXTURE_2D,
+            0,
+            GL.GL_RG32F,
+            ORBIT_WIDTH,
+            rows,
+            0,
+            GL.GL_RG,
+            GL.GL_FLOAT,
+            texels,
+        )
+        self.reference = reference
+
+    def bind(self) -> None:
+        GL.glActiveTexture(GL.GL_TEXTURE0 + self.unit)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture)
+        GL.glActiveTexture(GL.GL_TEXTURE0)
+
+    def delete(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        tracker.delete("texture", self.texture)
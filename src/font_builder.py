@@ -1,5 +1,17 @@
 #!/usr/bin/env python3
 
+# The digit font of shader/text.h. Also used by sweep.py for labels.
+
+FONT = """
+..... ..... ..... .###. ..#.. .###. .###. #...# ##### .###. ##### .###. .###.
+..#.. ..... ..... #...# .##.. #...# #...# #...# #.... #.... ....# #...# #...#
+.###. .###. ..... #...# ..#.. ...#. ..##. #...# ####. ####. ...#. .###. #...#
+..#.. ..... ..... #...# ..#.. ..#.. ....# ##### ....# #...# ..#.. #...# .####
+..... ..... ..... #...# ..#.. .#... #...# ....# #...# #...# .#... #...# ....#
+..... ..... ..#.. .###. .###. ##### .###. ....# .###. .###. #.... .###. .###.
+"""
+CHARS = "+-.0123456789"  # in FONT's order
+
 
 def print_font(f):
     lines = f.strip("\n").split("\n")
@@ -20,13 +32,13 @@ def print_font(f):
     )
 
 
-print_font(
-    """
-..... ..... ..... .###. ..#.. .###. .###. #...# ##### .###. ##### .###. .###.
-..#.. ..... ..... #...# .##.. #...# #...# #...# #.... #.... ....# #...# #...#
-.###. .###. ..... #...# ..#.. ...#. ..##. #...# ####. ####. ...#. .###. #...#
-..#.. ..... ..... #...# ..#.. ..#.. ....# ##### ....# #...# ..#.. #...# .####
-..... ..... ..... #...# ..#.. .#... #...# ....# #...# #...# .#... #...# ....#
-..... ..... ..#.. .###. .###. ##### .###. ....# .###. .###. #.... .###. .###.
-"""
-)
+def glyph_rows(f: str = FONT) -> dict[str, list[str]]:
+    lines = f.strip("\n").split("\n")
+    return {
+        char: [line[i * 6 : i * 6 + 5] for line in lines]
+        for i, char in enumerate(CHARS)
+    }
+
+
+if __name__ == "__main__":
+    print_font(FONT)
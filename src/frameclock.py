@@ -0,0 +1,82 @@
+import time
+
+# Frame pacing for the viewer: ticks follow buffer swaps instead of a
+# timer, so they line up with the display's vblanks.
+
+
+class FrameClock:
+    # Counts vblanks missed between consecutive swaps. A late frame whose
+    # paint started more than a refresh period after the previous swap was
+    # held up by scheduling (event loop, timers, Python); one that started
+    # in time but still missed was held up by rendering.
+
+    def __init__(self, refreshRate: float = 60.0) -> None:
+        self.period = int(1e9 / (refreshRate or 60.0))  # ns
+        self.missed = 0
+        self.lateStart = 0
+        self.lateRender = 0
+        self._lastSwap: int | None = None
+        self._paintStart: int | None = None
+
+    def paintStarted(self) -> None:
+        if self._paintStart is None:
+            self._paintStart = time.perf_counter_ns()
+
+    def swapped(self) -> int:
+        # Returns the vblanks missed before this swap.
+        now = time.perf_counter_ns()
+        missed = 0
+        if self._lastSwap is not None and self._paintStart is not None:
+            missed = max(0, round((now - self._lastSwap) / self.period) - 1)
+            if missed:
+                self.missed += missed
+                if self._paintStart - self._lastSwap > self.period:
+                    self.lateStart += 1
+                else:
+                    self.lateRender += 1
+        self._lastSwap = now
+        self._paintStart = None
+        return missed
+
+    def idle(self) -> None:
+        # Nothing is being drawn, the next frame can't be late.
+        self._lastSwap = None
+
+    def __str__(self) -> str:
+        return (
+            f"{self.missed} missed vblanks ({self.lateStart} scheduling, "
+            f"{self.lateRender} rendering)"
+        )
+
+
+class FixedStep:
+    # Turns elapsed time into a whole number of fixed steps, keeping the
+    # remainder, so that simulations run at the same speed at any frame
+    # rate. The default matches the viewer's old 15 ms timer. Frames are
+    # drawn fraction() of a step ahead, or a 60 Hz display would see one
+    # step most frames and two every ninth.
+
+    def __init__(self, step: int = 15_000_000, maxSteps: int = 8) -> None:
+        self.step = step  # ns
+        self.maxSteps = maxSteps
+        self._last: int | None = None
+        self._left = 0
+
+    def steps(self) -> int:
+        now = time.perf_counter_ns()
+        if self._last is None:
+            self._last = now
+            return 1
+        self._left += now - self._last
+        self._last = now
+        n = self._left // self.step
+        self._left -= n * self.step
+        return min(n, self.maxSteps)
+
+    def fraction(self) -> float:
+        # Of a step, elapsed since the last one steps() counted.
+        return self._left / self.step
+
+    def reset(self) -> None:
+        self._last = None
+        self._left = 0
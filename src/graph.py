@@ -0,0 +1,320 @@
+import re
+import typing
+from OpenGL import GL
+import MyGL
+from profiler import Profiler
+from progcache import LinkedPrograms
+from resources import textureBytes, tracker
+from uniforms import UniformStore, UniformValue, ViewBlock
+
+# Multi-pass shaders, like Shadertoy's Buffer A-D. A shader file declares
+# its passes with pragmas:
+#
+#     ...code common to all passes...
+#     #pragma machuchu pass blur scale=0.5 format=rgba16f filter=linear
+#     #pragma machuchu bind iChannel0 blur
+#     ...code of the pass "blur", reading its own previous frame...
+#     #pragma machuchu pass image
+#     #pragma machuchu bind iChannel0 blur
+#     ...code of the output pass...
+#
+# Every pass is compiled from the common code plus its own section, with
+# the other sections blanked out so that line numbers in compiler errors
+# stay right. The last pass is the output and is drawn by the Renderer
+# like a single-pass shader; the others render into their own textures,
+# scaled relative to the output size. `bind UNIFORM PASS` makes a sampler
+# read PASS's latest output: from this frame if PASS runs earlier, from
+# the previous one if it is the pass itself or runs later. Passes are
+# ordered so that what they read is rendered first where possible, and a
+# pass whose uniforms and inputs didn't change since it last ran is
+# skipped.
+
+FORMATS = {
+    "rgba8": GL.GL_RGBA8,
+    "rgba16f": GL.GL_RGBA16F,
+    "rgba32f": GL.GL_RGBA32F,
+}
+FILTERS = {"nearest": GL.GL_NEAREST, "linear": GL.GL_LINEAR}
+
+_PRAGMA = re.compile(r"^\s*#\s*pragma\s+machuchu\s+(pass|bind)\b(.*)$")
+_KEEP = re.compile(r"^\s*#\s*(version|line)\b")
+
+
+class PassSpec:
+    def __init__(self, line: str, params: list[str]) -> None:
+        if not params or "=" in params[0]:
+            raise ValueError(f"pass without a name: {line}")
+        self.name = params[0]
+        self.scale = 1.0
+        self.format = GL.GL_RGBA8
+        self.filter = GL.GL_NEAREST
+        self.bindings: list[tuple[str, str]] = []  # uniform, pass
+        self.source = ""
+        for param in params[1:]:
+            key, _, value = param.partition("=")
+            if key == "scale":
+                try:
+                    self.scale = float(value)
+                except ValueError:
+                    self.scale = 0.0
+                if not 0 < self.scale <= 4:
+                    raise ValueError(f"bad scale: {line}")
+            elif key == "format" and value in FORMATS:
+                self.format = FORMATS[value]
+            elif key == "filter" and value in FILTERS:
+                self.filter = FILTERS[value]
+            else:
+                raise ValueError(f"bad pass option {param!r}: {line}")
+
+
+def parseGraph(shader: str) -> list[PassSpec]:
+    # The passes in declaration order, the output last; empty for
+    # single-pass shaders.
+    lines = shader.split("\n")
+    specs: list[PassSpec] = []
+    starts: list[int] = []
+    for i, line in enumerate(lines):
+        m = _PRAGMA.match(line)
+        if m is None:
+            continue
+        params = m[2].split()
+        if m[1] == "pass":
+            specs.append(PassSpec(line.strip(), params))
+            starts.append(i)
+        elif not specs:
+            raise ValueError(f"bind outside of a pass: {line.strip()}")
+        elif len(params) != 2:
+            raise ValueError(f"expected UNIFORM PASS: {line.strip()}")
+        else:
+            specs[-1].bindings.append((params[0], params[1]))
+    if not specs:
+        return []
+
+    names = [spec.name for spec in specs]
+    if len(set(names)) != len(names):
+        raise ValueError("pass names must be unique")
+    for spec in specs:
+        for uniform, source in spec.bindings:
+            if source not in names:
+                raise ValueError(f"{spec.name}: no pass named {source}")
+            if source == names[-1]:
+                raise ValueError(
+                    f"{spec.name}: the output pass {source} can't be read, "
+                    "use machuchu_tex for its previous frame"
+                )
+
+    ends = starts[1:] + [len(lines)]
+    for spec, start, end in zip(specs, starts, ends):
+        spec.source = "\n".join(
+            line
+            if i < starts[0] or start < i < end or _KEEP.match(line)
+            else ""
+            for i, line in enumerate(lines)
+        )
+    return specs
+
+
+class _Pass:
+    def __init__(self, spec: PassSpec, program: int, source: str) -> None:
+        self.spec = spec
+        self.program = program
+        self.source = source  # see LinkedPrograms
+        self.store = UniformStore(program)
+        ViewBlock.attach(program)
+        self.inputs: list[tuple[int, "_Pass"]] = []  # texture unit, source
+        self.size = (0, 0)
+        self.textures: list[int] = []
+        self.fbos: list[int] = []
+        self.latest = 0  # the texture last rendered into
+        self.version = 0  # bumped whenever the output changes
+        self.key: tuple | None = None
+
+    def allocate(
+        self, size: tuple[int, int], count: int, resample: bool = False
+    ) -> None:
+        # `count` textures: passes reading themselves ping-pong between
+        # two, the others need just one. They start black, or with the
+        # old ones stretched to `size` if `resample`.
+        oldSize, oldFbos, oldTextures = self.size, self.fbos, self.textures
+        self.size = size
+        self.fbos = [
+            tracker.track("framebuffer", GL.glGenFramebuffers(1))
+            for _ in range(count)
+        ]
+        self.textures = []
+        float_ = self.spec.format != GL.GL_RGBA8
+        for fbo in self.fbos:
+            texture = tracker.track(
+                "texture",
+                GL.glGenTextures(1),
+                textureBytes(size, self.spec.format),
+            )
+            GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
+            for param in (GL.GL_TEXTURE_MIN_FILTER, GL.GL_TEXTURE_MAG_FILTER):
+                GL.glTexParameteri(GL.GL_TEXTURE_2D, param, self.spec.filter)
+            for param in (GL.GL_TEXTURE_WRAP_S, GL.GL_TEXTURE_WRAP_T):
+                GL.glTexParameteri(
+                    GL.GL_TEXTURE_2D, param, GL.GL_CLAMP_TO_EDGE
+                )
+            GL.glTexImage2D(
+                GL.GL_TEXTURE_2D,
+                0,
+                self.spec.format,
+                *size,
+                0,
+                GL.GL_RGBA,
+                GL.GL_FLOAT if float_ else GL.GL_UNSIGNED_BYTE,
+                None,
+            )
+            GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, fbo)
+            GL.glFramebufferTexture2D(
+                GL.GL_FRAMEBUFFER,
+                GL.GL_COLOR_ATTACHMENT0,
+                GL.GL_TEXTURE_2D,
+                texture,
+                0,
+            )
+            GL.glClearColor(0.0, 0.0, 0.0, 0.0)
+            GL.glClear(GL.GL_COLOR_BUFFER_BIT)
+            self.textures.append(texture)
+        if resample and len(oldFbos) == count:
+            for source, target in zip(oldFbos, self.fbos):
+                MyGL.resample(source, oldSize, target, size)
+        else:
+            self.latest = 0
+        tracker.delete("framebuffer", *oldFbos)
+        tracker.delete("texture", *oldTextures)
+        self.version += 1
+        self.key = None
+
+    def free(self) -> None:
+        tracker.delete("framebuffer", *self.fbos)
+        tracker.delete("texture", *self.textures)
+        self.fbos = []
+        self.textures = []
+
+
+class RenderGraph:
+    def __init__(
+        self,
+        specs: list[PassSpec],
+        programs: list[int],
+        sources: list[str] | None = None,
+    ) -> None:
+        # `programs` are those of specs[:-1], the graph owns them; the
+        # output pass's program belongs to the Renderer. `sources` are
+        # their sourceKey()s, if they should outlive the graph.
+        sources = sources or [""] * len(programs)
+        self.passes = [_Pass(*args) for args in zip(specs, programs, sources)]
+        byName = {p.spec.name: p for p in self.passes}
+        for p in self.passes:
+            for unit, (uniform, source) in enumerate(p.spec.bindings, 1):
+                p.inputs.append((unit, byName[source]))
+                p.store.set(uniform, unit)
+        self.outputBindings = [
+            (uniform, unit, byName[source])
+            for unit, (uniform, source) in enumerate(specs[-1].bindings, 1)
+        ]
+        self.order = _schedule(self.passes)
+        position = {p: i for i, p in enumerate(self.order)}
+        # whether any pass reads an earlier frame
+        self.feedback = any(
+            position[source] >= position[p]
+            for p in self.passes
+            for _, source in p.inputs
+        )
+        self.skipped = 0
+
+    def bindOutput(self, store: UniformStore) -> None:
+        for uniform, unit, _ in self.outputBindings:
+            store.set(uniform, unit)
+
+    def resize(self, size: tuple[int, int], resample: bool = False) -> None:
+        for p in self.passes:
+            scaled = (
+                max(1, round(size[0] * p.spec.scale)),
+                max(1, round(size[1] * p.spec.scale)),
+            )
+            if scaled != p.size:
+                selfRead = any(source is p for _, source in p.inputs)
+                p.allocate(scaled, 2 if selfRead else 1, resample)
+
+    def setUniform(self, name: str, value: UniformValue) -> None:
+        for p in self.passes:
+            p.store.set(name, value)
+
+    def stores(self) -> list[UniformStore]:
+        return [p.store for p in self.passes]
+
+    def key(self) -> tuple:
+        return tuple(p.store.key() for p in self.passes)
+
+    def animated(self) -> bool:
+        return self.feedback or any("time" in p.store for p in self.passes)
+
+    def run(
+        self,
+        view: ViewBlock,
+        drawQuad: typing.Callable[[], None],
+        profiler: Profiler,
+    ) -> None:
+        # Renders the passes that need it and binds what the output pass
+        # reads. The view block must be flushed already.
+        for p in self.order:
+            key = (
+                p.store.key(),
+                view.key(),
+                tuple(source.version for _, source in p.inputs),
+            )
+            if key == p.key:
+                self.skipped += 1
+                continue
+            GL.glUseProgram(p.program)
+            p.store.flush()
+            for unit, source in p.inputs:
+                GL.glActiveTexture(GL.GL_TEXTURE0 + unit)
+                GL.glBindTexture(
+                    GL.GL_TEXTURE_2D, source.textures[source.latest]
+                )
+            target = (p.latest + 1) % len(p.textures)
+            GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, p.fbos[target])
+            GL.glViewport(0, 0, *p.size)
+            with profiler.gpu("pass." + p.spec.name):
+                drawQuad()
+            p.latest = target
+            p.version += 1
+            p.key = key
+        for _, unit, source in self.outputBindings:
+            GL.glActiveTexture(GL.GL_TEXTURE0 + unit)
+            GL.glBindTexture(GL.GL_TEXTURE_2D, source.textures[source.latest])
+        GL.glActiveTexture(GL.GL_TEXTURE0)
+
+    def delete(self, linked: LinkedPrograms | None = None) -> None:
+        # Programs with a source key go to `linked` if given.
+        for p in self.passes:
+            p.free()
+            if linked is not None and p.source:
+                linked.put(p.source, p.program)
+            else:
+                tracker.delete("program", p.program)
+        self.passes = []
+        self.order = []
+
+
+def _schedule(passes: list[_Pass]) -> list[_Pass]:
+    # Topological order of the reads between different passes, ties
+    # broken by declaration order. A cycle is broken at its first
+    # declared pass, which then reads the others' previous frames.
+    waiting = {
+        p: {source for _, source in p.inputs if source is not p}
+        for p in passes
+    }
+    order: list[_Pass] = []
+    while waiting:
+        ready = [p for p in passes if p in waiting and not waiting[p]]
+        p = ready[0] if ready else next(p for p in passes if p in waiting)
+        order.append(p)
+        del waiting[p]
+        for sources in waiting.values():
+            sources.discard(p)
+    return order
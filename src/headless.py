@@ -0,0 +1,88 @@
+import ctypes
+import os
+
+# PyOpenGL picks its platform on first import, so this has to happen before
+# anything imports OpenGL.GL. Without a display server, Mesa's surfaceless
+# platform gives us a context backed by the GPU or by llvmpipe.
+os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+if not os.environ.get("DISPLAY") and not os.environ.get("WAYLAND_DISPLAY"):
+    os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+
+from OpenGL import EGL  # noqa: E402
+from OpenGL import GL  # noqa: E402
+
+
+class HeadlessContext:
+    # A GL context without any window. Everything is rendered into
+    # framebuffer objects, so there is no default framebuffer to speak of.
+
+    def __init__(self, version: tuple[int, int] = (3, 3)) -> None:
+        self.display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        if not EGL.eglInitialize(self.display, None, None):
+            raise RuntimeError("Can't initialize EGL display")
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+
+        attrs = (EGL.EGLint * 5)(
+            EGL.EGL_SURFACE_TYPE,
+            EGL.EGL_PBUFFER_BIT,
+            EGL.EGL_RENDERABLE_TYPE,
+            EGL.EGL_OPENGL_BIT,
+            EGL.EGL_NONE,
+        )
+        config = EGL.EGLConfig()
+        count = EGL.EGLint()
+        EGL.eglChooseConfig(
+            self.display, attrs, ctypes.pointer(config), 1, count
+        )
+        if count.value == 0:
+            raise RuntimeError("No EGL config supports desktop OpenGL")
+
+        attrs = (EGL.EGLint * 7)(
+            EGL.EGL_CONTEXT_MAJOR_VERSION,
+            version[0],
+            EGL.EGL_CONTEXT_MINOR_VERSION,
+            version[1],
+            EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK,
+            EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT,
+            EGL.EGL_NONE,
+        )
+        self.context = EGL.eglCreateContext(
+            self.display, config, EGL.EGL_NO_CONTEXT, attrs
+        )
+        if not self.context:
+            raise RuntimeError(f"Can't create OpenGL {version} context")
+
+        self.surface = EGL.EGL_NO_SURFACE
+        extensions = EGL.eglQueryString(self.display, EGL.EGL_EXTENSIONS)
+        if b"EGL_KHR_surfaceless_context" not in extensions.split():
+            attrs = (EGL.EGLint * 5)(
+                EGL.EGL_WIDTH, 1, EGL.EGL_HEIGHT, 1, EGL.EGL_NONE
+            )
+            self.surface = EGL.eglCreatePbufferSurface(
+                self.display, config, attrs
+            )
+        self.makeCurrent()
+
+    def makeCurrent(self) -> None:
+        if not EGL.eglMakeCurrent(
+            self.display, self.surface, self.surface, self.context
+        ):
+            raise RuntimeError("Can't make EGL context current")
+
+    def describe(self) -> str:
+        return " / ".join(
+            GL.glGetString(name).decode()
+            for name in (GL.GL_VENDOR, GL.GL_RENDERER, GL.GL_VERSION)
+        )
+
+    def destroy(self) -> None:
+        EGL.eglMakeCurrent(
+            self.display,
+            EGL.EGL_NO_SURFACE,
+            EGL.EGL_NO_SURFACE,
+            EGL.EGL_NO_CONTEXT,
+        )
+        if self.surface != EGL.EGL_NO_SURFACE:
+            EGL.eglDestroySurface(self.display, self.surface)
+        EGL.eglDestroyContext(self.display, self.context)
+        EGL.eglTerminate(self.display)
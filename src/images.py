@@ -0,0 +1,31 @@
+import struct
+import zlib
+import numpy as np
+
+
+def _chunk(kind: bytes, data: bytes) -> bytes:
+    crc = zlib.crc32(data, zlib.crc32(kind))
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", crc)
+
+
+def encode_png(image: np.ndarray, level: int = 6) -> bytes:
+    # image: top-down rows of 8-bit RGBA (or RGB) pixels
+    height, width, channels = image.shape
+    color_type = {3: 2, 4: 6}[channels]
+    rows = np.empty((height, width * channels + 1), np.uint8)
+    rows[:, 0] = 0  # no filter
+    rows[:, 1:] = image.reshape(height, width * channels)
+    header = struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)
+    return b"".join(
+        (
+            b"\x89PNG\r\n\x1a\n",
+            _chunk(b"IHDR", header),
+            _chunk(b"IDAT", zlib.compress(rows.tobytes(), level)),
+            _chunk(b"IEND", b""),
+        )
+    )
+
+
+def write_png(fname: str, image: np.ndarray, level: int = 6) -> None:
+    with open(fname, "wb") as f:
+        f.write(encode_png(image, level))
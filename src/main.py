@@ -2,17 +2,32 @@
 
 from html import escape
 import collections
-import typing
+import copy
+import os
 import re
-import ctypes
+import typing
 import traceback
 import signal
 import sys
 import time
+import numpy as np
 from OpenGL import GL
-from OpenGL.GL import shaders as GL_shaders
 import MyGL
-from preprocessor import Preprocessor
+import resources
+from accumulate import Accumulator
+from adaptive import AdaptiveResolution
+from browser import ShaderBrowser
+from coord import CoordUniform
+from frameclock import FixedStep, FrameClock
+from output import FileWriter, FrameWriter
+from preprocessor import Preprocessor, freezableUniforms, requestedFiles
+from profiler import Profiler
+from progcache import ProgramCache
+from renderer import PendingProgram, Renderer, Target, renderFrames
+from session import Replayer, Session
+from sweep import Axis, gridSamples, renderSweep, writeSheet
+from textures import parseTextures
+from uniforms import UniformValue
 from updater import Updater
 import Qt
 import qtpy
@@ -21,9 +36,6 @@ import qtpy
 #              advanced GUI generation (from comments)
 
 
-_UniformValue = int | bool | float | tuple[float, float, float, float]
-
-
 class GentleLineEdit(Qt.QLineEdit):
     def __init__(
         self, label: str = "", parent: Qt.QWidget | None = None
@@ -38,299 +50,358 @@ class GentleLineEdit(Qt.QLineEdit):
         self.grabKeyboard()
 
 
-class CoordUniform:
-    _Fun = typing.Callable[
-        [tuple[float, float, float], float], tuple[float, float, float]
-    ]
-
-    def __init__(self) -> None:
-        self.x = self.y = self.z = (0.0, 0.0, 0.0)
-        self.mouse_pressed = False
-        self.mouse_i: None | tuple[int, int] = None
-        self.mouse_f = self.mouse_f_start = (float("nan"), float("nan"))
-        self.size: tuple[int, int] = (1, 1)
-
-    def origin(self) -> None:
-        self.x = (0.0, 0.0, self.x[2])
-        self.y = (0.0, 0.0, self.y[2])
-
-    def zoom_reset(self) -> None:
-        self.z = (0.0, 0.0, 0.0)
-
-    def add(self, x: float = 0.0, y: float = 0.0, z: float = 0.0) -> None:
-        f: CoordUniform._Fun = lambda v, d: (v[0], v[1], v[2] + d)
-        self.x = f(self.x, x)
-        self.y = f(self.y, y)
-        self.z = f(self.z, z)
-
-    def move(self, x: float, y: float) -> None:
-        z = 2.0 / (1.1 ** self.z[0]) / self.size[1]
-        f: CoordUniform._Fun = lambda v, d: (v[0] + d * z, v[1], v[2])
-        self.x = f(self.x, x)
-        self.y = f(self.y, y)
-
-    def zoom(
-        self, z: float, origin: None | tuple[float, float] = None
-    ) -> None:
-        if origin:
-            sx, sy = (
-                origin[0] - self.size[0] / 2.0,
-                origin[1] - self.size[1] / 2.0,
-            )
-        else:
-            sx, sy = (0, 0)
-        self.move(sx, -sy)
-        self.z = (self.z[0] + z, self.z[1], self.z[2])
-        self.move(-sx, sy)
-
-    def translate(self, x: float, y: float) -> tuple[float, float]:
-        z = 2.0 / (1.1 ** self.z[0]) / self.size[1]
-        sx = self.x[0] + (x - self.size[0] / 2.0) * z
-        sy = self.y[0] - (y - self.size[1] / 2.0) * z
-        return sx, sy
-
-    def mouse_down(self, x: int, y: int) -> None:
-        self.mouse_pressed = True
-        self.mouse_i = (x, y)
-        self.mouse_f = self.mouse_f_start = self.translate(x, y)
-
-    def mouse_move(self, x: int, y: int) -> None:
-        self.mouse_pressed = True
-        self.mouse_i = (x, y)
-        self.mouse_f = self.translate(x, y)
-
-    def mouse_up(self) -> None:
-        self.mouse_pressed = False
-
-    def update(self) -> None:
-        f: CoordUniform._Fun = lambda v, s: (
-            v[0] + v[1] / s,
-            (v[1] * 15 + v[2]) / 16,
-            v[2],
-        )
-        z = 25 * 1.1 ** self.z[0]
-        self.x = f(self.x, z)
-        self.y = f(self.y, z)
-        self.z = f(self.z, 2)
-        if self.mouse_i is not None and self.mouse_pressed:
-            self.mouse_f = self.translate(*self.mouse_i)
-
-    def items(self) -> typing.Iterator[tuple[str, _UniformValue]]:
-        yield "machuchu_x", self.x[0]
-        yield "machuchu_y", self.y[0]
-        yield "machuchu_z", 1.1 ** self.z[0]
-        yield "machuchu_aspect", self.size[0] / self.size[1]
-        yield "machuchu_click", self.mouse_pressed
-        yield "machuchu_mouse", (*self.mouse_f, *self.mouse_f_start)
-
-
 class GLWidget(Qt.QOpenGLWidget):
-    vertexShaderData = """
-        // #version 150 / #version 300 es
-        in vec2 machuchu_position;
-        out vec2 p;
-        out vec2 machuchu_pos;
-
-        uniform float machuchu_aspect;
-        uniform float machuchu_x;
-        uniform float machuchu_y;
-        uniform float machuchu_z;
-
-        void main() {
-            gl_Position = vec4(machuchu_position, 0., 1.);
-            machuchu_pos = machuchu_position * 0.5 + vec2(0.5);
-
-            p = machuchu_position;
-            p.x *= machuchu_aspect;
-            p /= machuchu_z;
-            p.x += machuchu_x;
-            p.y += machuchu_y;
-        }
-    """
-
     def __init__(self, parent: Qt.QWidget | None = None) -> None:
         super().__init__(parent)
-        self.program = None
-
-        self._flip = 0
-        self._fbo = None
-        self._texture = None
-
-        self.times = collections.deque([0.0], maxlen=10)
+        self.renderer: Renderer | None = None
+        self._renderJob: typing.Iterator[int] | None = None
+        self._renderTarget: Target | None = None
+        self.renderWriter: FrameWriter | None = None
+        self.accumulator: Accumulator | None = None
+        self.adaptive: AdaptiveResolution | None = None
+        self.pendingProgram: PendingProgram | None = None
+
+        self.times = collections.deque([0], maxlen=10)
+        self.idle = False
+        self._drawnKey: tuple | None = None
         self.coord = CoordUniform()
+        # Ticks follow buffer swaps; view motion advances in fixed steps
+        # so that panning is as fast at 144 Hz as at 60 Hz.
+        self.clock = FrameClock()
+        self.step = FixedStep()
+        self.fixedStep = True
+        self.frameSwapped.connect(lambda: self.clock.swapped())
+        # inputs go through the session to be recordable
+        self.session = Session(self.coord, self.setUniform, self.step.step)
+        self.replayer: Replayer | None = None
+        self._replayTarget: Target | None = None
+        self.windowSize = (1, 1)
 
     def initializeGL(self) -> None:
-        self._fbo = GL.glGenFramebuffers(1)
-        self._texture = GL.glGenTextures(1)
-
-        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self._fbo)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self._texture)
-        GL.glTexParameteri(
-            GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_NEAREST
-        )
-        GL.glTexParameteri(
-            GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST
-        )
-        GL.glTexParameteri(
-            GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_REPEAT
-        )
-        GL.glTexParameteri(
-            GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_REPEAT
-        )
-        GL.glFramebufferTexture2D(
-            GL.GL_FRAMEBUFFER,
-            GL.GL_COLOR_ATTACHMENT0,
-            GL.GL_TEXTURE_2D,
-            self._texture,
-            0,
-        )
+        self.renderer = Renderer(ProgramCache())
+        self.clock = FrameClock(self.screen().refreshRate())
 
     def resizeGL(self, width: int, height: int) -> None:
-        GL.glViewport(0, 0, width, height)
-        self.coord.size = (width, height)
+        assert self.renderer is not None
+        self.windowSize = (width, height)
+        if self.replayer is not None:
+            return  # replays keep the recorded size, see drawReplay()
+        self.session.resize(width, height)
+        self.renderer.resize(width, height)
 
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self._texture)
-        GL.glTexImage2D(
-            GL.GL_TEXTURE_2D,
+    def paintGL(self) -> None:
+        assert self.renderer is not None
+        if self.rendering():
+            return  # the renderer is sized for the job's target
+        self.clock.paintStarted()
+        profiler = self.renderer.profiler
+        if self.replayer is not None:
+            self.drawReplay()
+        elif self.refining():
+            assert self.accumulator is not None
+            if self.renderer.size != self.coord.size:  # left by adaptive
+                self.renderer.resize(*self.coord.size, resample=True)
+            with profiler.gpu("refine"):
+                if not self.accumulator.converged():
+                    self.accumulator.sample()
+                self.accumulator.resolve(self.defaultFramebufferObject())
+        elif self.adaptive is not None:
+            self.adaptive.draw(
+                self.defaultFramebufferObject(), self.coord.size
+            )
+        else:
+            self.renderer.draw(self.defaultFramebufferObject())
+        profiler.frame()
+        self._drawnKey = self.renderer.stateKey()
+        self.times.append(time.perf_counter_ns())
+
+    def drawReplay(self) -> None:
+        # At the recorded window size, fitted into this one, so that the
+        # picture isn't stretched and the replay doesn't depend on it.
+        assert self.renderer is not None
+        size = self.coord.size
+        if self.renderer.size != size:
+            self.renderer.resize(*size)
+        if self._replayTarget is None or self._replayTarget.size != size:
+            if self._replayTarget is not None:
+                self._replayTarget.delete()
+            self._replayTarget = Target(*size)
+        self.renderer.draw(self._replayTarget.fbo)
+        window = self.windowSize
+        scale = min(window[0] / size[0], window[1] / size[1])
+        width, height = round(size[0] * scale), round(size[1] * scale)
+        x, y = (window[0] - width) // 2, (window[1] - height) // 2
+        framebuffer = self.defaultFramebufferObject()
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, framebuffer)
+        GL.glClearColor(0.0, 0.0, 0.0, 1.0)
+        GL.glClear(GL.GL_COLOR_BUFFER_BIT)
+        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, self._replayTarget.fbo)
+        GL.glBlitFramebuffer(
             0,
-            GL.GL_RGBA,
-            width,
-            height,
             0,
-            GL.GL_RGBA,
-            GL.GL_UNSIGNED_BYTE,
-            None,
+            size[0],
+            size[1],
+            x,
+            y,
+            x + width,
+            y + height,
+            GL.GL_COLOR_BUFFER_BIT,
+            GL.GL_LINEAR,
         )
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, framebuffer)
 
-    def paintGL(self) -> None:
-        if self.program is None:
+    def startReplay(self, replayer: Replayer) -> None:
+        # The shader must be loaded already.
+        self.stopReplay()
+        replayer.start(self.session)
+        self.replayer = replayer
+        self.update()
+
+    def stopReplay(self) -> None:
+        # Back to the window's size.
+        if self.replayer is None:
             return
+        self.replayer = None
+        self.makeCurrent()
+        if self._replayTarget is not None:
+            self._replayTarget.delete()
+            self._replayTarget = None
+        assert self.renderer is not None
+        self.session.resize(*self.windowSize)
+        self.renderer.resize(*self.windowSize)
+        self.update()
+
+    def setAdaptive(self, on: bool, budget: float) -> None:
+        # Lowers the resolution while moving to keep frames in `budget`
+        # milliseconds.
+        self.makeCurrent()
+        assert self.renderer is not None
+        if on and self.adaptive is None:
+            self.adaptive = AdaptiveResolution(self.renderer, budget)
+        elif not on and self.adaptive is not None:
+            self.adaptive.delete()
+            self.adaptive = None
+            self.renderer.resize(*self.coord.size, resample=True)
+        if self.adaptive is not None:
+            self.adaptive.budget = budget
+        self.update()
+
+    def setRefine(self, on: bool) -> None:
+        # Progressive supersampling: one jittered sample per frame while
+        # nothing moves, then no more redraws once converged.
+        self.makeCurrent()
+        if on and self.accumulator is None and self.renderer is not None:
+            self.accumulator = Accumulator(self.renderer, grid=4)
+        elif not on and self.accumulator is not None:
+            self.accumulator.delete()
+            self.accumulator = None
+        self.update()
 
-        GL.glBindFramebuffer(
-            GL.GL_FRAMEBUFFER, self.defaultFramebufferObject()
+    def supersampling(self) -> bool:
+        # Feedback shaders depend on the previous frame, averaging them
+        # makes no sense.
+        return (
+            self.accumulator is not None
+            and self.renderer is not None
+            and not self.renderer.usesFeedback()
         )
-        GL.glDrawArrays(GL.GL_TRIANGLE_STRIP, 0, 4)
-
-        if GL.glGetUniformLocation(self.program, "machuchu_tex") != -1:
-            GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, self._fbo)
-            GL.glBlitFramebuffer(
-                0,
-                0,
-                self.coord.size[0],
-                self.coord.size[1],
-                0,
-                0,
-                self.coord.size[0],
-                self.coord.size[1],
-                GL.GL_COLOR_BUFFER_BIT,
-                GL.GL_NEAREST,
-            )
+
+    def refining(self) -> bool:
+        # Averaging frames of a running animation would smear them.
+        if not self.supersampling():
+            return False
+        assert self.renderer is not None
+        return self.session.paused or not self.renderer.animated()
 
     def getFps(self) -> float:
-        return (len(self.times) - 1) / (self.times[-1] - self.times[0])
+        elapsed = self.times[-1] - self.times[0]
+        return (len(self.times) - 1) * 1e9 / elapsed if elapsed else 0.0
 
     def getUniforms(
         self,
     ) -> tuple[dict[str, int | float], dict[str, GL.Constant]]:
-        self.makeCurrent()
+        # Those of every pass of multi-pass shaders.
+        assert self.renderer is not None
         uniforms: dict[str, int | float] = {}
         types = {}
-        count = GL.glGetProgramiv(self.program, GL.GL_ACTIVE_UNIFORMS)
-        iparams = ctypes.c_int()
-        fparams = ctypes.c_float()
-        for i in range(count):
-            name, _, type_ = GL.glGetActiveUniform(self.program, i)
-            loc = GL.glGetUniformLocation(self.program, name)
-            if name.startswith(b"machuchu_"):
+        bound = self.renderer.boundSamplers()
+        slots = [
+            item
+            for store in self.renderer.stores()
+            for item in store.slots.items()
+        ]
+        for name, slot in slots:
+            if name.startswith("machuchu_") or name in uniforms:
+                continue
+            if name in bound:
                 continue
-            name = name.decode("utf-8")  # TODO: remove?
-            if type_ == GL.GL_INT:
-                GL.glGetUniformiv(self.program, loc, iparams)
-                uniforms[name] = iparams.value
-            elif type_ == GL.GL_FLOAT:
-                GL.glGetUniformfv(self.program, loc, fparams)
-                uniforms[name] = fparams.value
-            elif type_ == GL.GL_BOOL:
-                GL.glGetUniformiv(self.program, loc, iparams)
-                uniforms[name] = iparams.value
-            elif type_ == GL.GL_SAMPLER_2D:
-                GL.glGetUniformiv(self.program, loc, iparams)
-                uniforms[name] = iparams.value
-            types[name] = type_
+            if slot.type not in (
+                GL.GL_INT,
+                GL.GL_FLOAT,
+                GL.GL_BOOL,
+                GL.GL_SAMPLER_2D,
+            ):
+                continue
+            assert isinstance(slot.value, (int, float))
+            uniforms[name] = slot.value
+            types[name] = slot.type
         return uniforms, types
 
-    def setFragmentShader(self, shader: str, version: list[str]) -> None:
+    def startFragmentShader(
+        self, shader: str, version: list[str], directory: str = ""
+    ) -> None:
+        # Compiles and decodes textures in the background where possible,
+        # the current program keeps running until finishFragmentShader().
         self.makeCurrent()
-
-        fragmentShader = MyGL.compileShader(shader, GL.GL_FRAGMENT_SHADER)
-        if version[1:2] == ["es"]:
-            vertexShader = "#version 300 es\n" + self.vertexShaderData
-        else:
-            vertexShader = "#version 150\n" + self.vertexShaderData
-        vertexShader = MyGL.compileShader(vertexShader, GL.GL_VERTEX_SHADER)
-
-        program = GL_shaders.compileProgram(
-            vertexShader, fragmentShader, validate=False
+        assert self.renderer is not None
+        if self.pendingProgram is not None:
+            self.pendingProgram.delete()  # superseded before it finished
+        self.pendingProgram = self.renderer.startFragmentShader(
+            shader, version, directory
         )
 
-        GL.glUseProgram(program)
-        self.program = program
+    def finishFragmentShader(self) -> bool:
+        # False while still compiling. Compile errors are raised, leaving
+        # the previous program in place.
+        if self.pendingProgram is None:
+            return True
+        self.makeCurrent()
+        if not self.pendingProgram.ready():
+            return False
+        assert self.renderer is not None
+        pending, self.pendingProgram = self.pendingProgram, None
+        self.renderer.finishProgram(pending)
         self.coord.size = (self.width(), self.height())
-        for name, value in self.coord.items():
-            self.setUniform(name, value)
-
-        vertices = (ctypes.c_float * 8)(
-            -1.0,
-            -1.0,
-            1.0,
-            -1.0,
-            -1.0,
-            1.0,
-            1.0,
-            1.0,
-        )
-        vao = GL.glGenVertexArrays(1)
-        GL.glBindVertexArray(vao)
-        vertex_buffer = GL.glGenBuffers(1)
-        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, vertex_buffer)
-        attribute_pos = GL.glGetAttribLocation(
-            self.program, "machuchu_position"
-        )
-        GL.glEnableVertexAttribArray(attribute_pos)
-        GL.glVertexAttribPointer(
-            attribute_pos, 2, GL.GL_FLOAT, GL.GL_FALSE, 0, vertices
+        self.setView()
+        return True
+
+    def setView(self) -> None:
+        if self.renderer is None:
+            return
+        coord = self.coord
+        if self.fixedStep and self.replayer is None:
+            coord = coord.ahead(self.step.fraction())
+        self.renderer.setView(coord, wait=False)
+
+    def setUniform(self, name: str, value: UniformValue) -> None:
+        if self.renderer is not None:
+            self.renderer.setUniform(name, value)
+
+    def startRender(
+        self,
+        size: tuple[int, int],
+        offset: tuple[int, int],
+        frames: range,
+        fps: float,
+        writer: FrameWriter,
+    ) -> None:
+        assert self.renderer is not None
+        self.makeCurrent()
+        coord = copy.copy(self.coord)
+        coord.move(offset[0], -offset[1])
+        self._renderTarget = Target(*size)
+        self.renderWriter = writer
+        self._renderJob = renderFrames(
+            self.renderer,
+            self._renderTarget,
+            coord,
+            frames,
+            fps,
+            writer,
+            self.accumulator.render if self.supersampling() else None,
         )
 
-        loc = GL.glGetUniformLocation(self.program, "machuchu_tex")
-        if loc != -1:
-            GL.glActiveTexture(GL.GL_TEXTURE0)
-            GL.glBindTexture(GL.GL_TEXTURE_2D, self._texture)
-            GL.glUniform1i(loc, 0)
+    def renderSweep(
+        self, axes: list[Axis], steps: int, cell: tuple[int, int]
+    ) -> tuple[np.ndarray, list[dict]]:
+        assert self.renderer is not None
+        self.makeCurrent()
+        times = [s.get("time") for s in self.renderer.stores() if "time" in s]
+        try:
+            return renderSweep(
+                self.renderer,
+                copy.copy(self.coord),
+                gridSamples(axes, steps),
+                cell,
+                time=float(times[0]) if times else 0.0,  # type: ignore
+            )
+        finally:
+            self.update()
+
+    def rendering(self) -> bool:
+        return self._renderJob is not None
 
-    def setUniform(self, name: str, value: _UniformValue) -> None:
+    def stepRender(self) -> int | None:
+        # Renders one more frame of the current job; None when it's over.
+        assert self._renderJob is not None
         self.makeCurrent()
-        if self.program is not None:
-            loc = GL.glGetUniformLocation(self.program, name)
-            # TODO: coerce value to appropriate type
-            if isinstance(value, float):
-                GL.glUniform1f(loc, value)
-            if isinstance(value, (bool, int)):
-                GL.glUniform1i(loc, value)
-            if isinstance(value, tuple) and len(value) == 4:
-                GL.glUniform4f(loc, *value)
+        try:
+            frame = next(self._renderJob, None)
+        except BaseException:
+            self.stopRender()
+            raise
+        if frame is None:
+            self.stopRender()
+        return frame
+
+    def stopRender(self) -> None:
+        if self._renderJob is None:
+            return
+        self.makeCurrent()
+        self._renderJob.close()
+        self._renderJob = None
+        assert self._renderTarget is not None
+        self._renderTarget.delete()
+        self._renderTarget = None
+        assert self.renderWriter is not None
+        writer, self.renderWriter = self.renderWriter, None
+        writer.close()
+
+    def needsRedraw(self) -> bool:
+        renderer = self.renderer
+        if renderer is None or renderer.program is None:
+            return False
+        # while paused only feedback shaders change on their own
+        if self.session.paused:
+            animated = renderer.usesFeedback()
+        else:
+            animated = renderer.animated()
+        if animated or self.coord.moving():
+            return True
+        if self.refining():
+            assert self.accumulator is not None
+            return not (
+                self.accumulator.current() and self.accumulator.converged()
+            )
+        if self.adaptive is not None and self.adaptive.current < 1:
+            return True  # the last frame was a reduced one
+        return renderer.stateKey() != self._drawnKey
 
     def tick(self) -> None:
-        self.coord.update()
-        for name, value in self.coord.items():
-            self.setUniform(name, value)
-        self.update()
-        self.times.append(time.time())
+        # Redraws only when something changed; Qt still repaints on its
+        # own after exposes and resizes.
+        if self.replayer is not None:
+            # one step per frame, like the offline replay
+            self.replayer.step(self.session)
+            if self.replayer.done(self.session):
+                self.stopReplay()
+                print("replay done")
+        else:
+            for _ in range(self.step.steps() if self.fixedStep else 1):
+                self.session.update()
+        self.setView()
+        self.idle = not self.needsRedraw()
+        if self.idle:
+            self.step.reset()
+            self.clock.idle()
+        else:
+            self.update()
 
 
 # TODO: UniformBase should inherit QWidget
 class UniformBase:
     def __init__(
-        self, parent: Qt.QWidget, name: str, value: _UniformValue
+        self, parent: Qt.QWidget, name: str, value: UniformValue
     ) -> None:
         self.parent = parent
         self.name = name
@@ -342,10 +413,11 @@ class UniformBase:
         for w in widgets:
             self.parent.shaderLayout.addWidget(w)
 
-    def _set_value(self, value: _UniformValue) -> None:
+    def _set_value(self, value: UniformValue) -> None:
         self.value = value
         assert isinstance(self.parent, MainWindow)
-        self.parent.glWidget.setUniform(self.name, self.value)
+        self.parent.glWidget.session.uniform(self.name, self.value)
+        self.parent.uniformEdited(self.name, self.value)
 
     def hide(self) -> None:
         for w in self.widgets:
@@ -482,6 +554,15 @@ def format_error(prep: Preprocessor, err_text: str) -> str:
 # sys.exit(0)
 
 
+SHADER_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "shader"
+)
+IDLE_INTERVAL = 15  # ms
+STALL_INTERVAL = 100
+TRACE_FRAMES = 36_000  # profiled frames F4 writes, 10 minutes at 60 Hz
+THAW_DELAY = 400  # ms a frozen value has to stay put before it's compiled in
+
+
 class MainWindow(Qt.QMainWindow):
     def __init__(self) -> None:
         super().__init__()
@@ -492,9 +573,14 @@ class MainWindow(Qt.QMainWindow):
         self.shaderDock, self.shaderLayout = self.initShaderDock()
         self.addDockWidget(Qt.Qt.RightDockWidgetArea, self.shaderDock)
 
+        self.renderDir: str | None = None
         self.renderDock, self.renderLayout = self.initRenderDock()
         self.addDockWidget(Qt.Qt.LeftDockWidgetArea, self.renderDock)
 
+        self.browserDock = ShaderBrowser(SHADER_DIR, self.loadFile)
+        self.addDockWidget(Qt.Qt.LeftDockWidgetArea, self.browserDock)
+        self.browserDock.hide()
+
         self.label = Qt.QLabel()
         self.label.setParent(self.centralWidget())
         self.label.setStyleSheet(
@@ -511,6 +597,21 @@ class MainWindow(Qt.QMainWindow):
         self.label.setWordWrap(True)
         self.label.hide()
 
+        self.statsLabel = Qt.QLabel()
+        self.statsLabel.setParent(self.centralWidget())
+        self.statsLabel.setStyleSheet(
+            """
+            QLabel {
+                color: white;
+                font-family: monospace;
+                background-color: rgba(0, 0, 0, 127);
+            }
+            """
+        )
+        self.statsLabel.hide()
+        self.statsTime = 0.0
+        self._idleProfiler = Profiler()  # until GL is initialized
+
         # call a function on resize
         self.glWidget.resized.connect(
             lambda: self.label.resize(
@@ -520,16 +621,34 @@ class MainWindow(Qt.QMainWindow):
         )
 
         self.uniforms: dict[str, UniformBase] = {}
+        # values compiled into the shader as constants, see setFrozen()
+        self.frozen: dict[str, UniformValue] | None = None
+        # while a frozen value is being edited the generic program draws
+        self.thawed = False
+        self.thawTimer = Qt.QTimer(self)
+        self.thawTimer.setSingleShot(True)
+        self.thawTimer.setInterval(THAW_DELAY)
+        self.thawTimer.timeout.connect(self.refreeze)
         self.filename: str | None = None
         self.updater: Updater | None = None
+        self.loading: Preprocessor | None = None  # compiling in background
 
+        # While drawing, every swap ticks the next frame (vsync paces the
+        # loop); the timer only polls for changes while idle and restarts
+        # the loop if swaps stop coming, e.g. while minimized.
         self.timer = Qt.QTimer(self)
-        self.timer.setInterval(15)
+        self.timer.setInterval(IDLE_INTERVAL)
         self.timer.timeout.connect(self.tick)
         self.timer.start()
-        self.time = time.time()
-        self.time_uniform = 0.0
-        self.timeron = True  # FIXME
+        self.glWidget.frameSwapped.connect(self.tick)
+        self.renderTimer = Qt.QTimer(self)
+        self.renderTimer.setInterval(0)
+        self.renderTimer.timeout.connect(self.renderStep)
+        self.renderFrames = range(0)
+        self.time = time.perf_counter_ns()
+        self.replaying: Replayer | None = None  # waiting for its shader
+        self.showResources = False
+        self.frameBudget = 16.0  # ms, for adaptive resolution
         self.cursorLocPos = Qt.QPoint(0, 0)
 
     def initShaderDock(self) -> tuple[Qt.QDockWidget, Qt.QVBoxLayout]:
@@ -548,6 +667,15 @@ class MainWindow(Qt.QMainWindow):
         loadButton.clicked.connect(self.load)
         shaderLayout.addWidget(loadButton)
 
+        freezeButton = self.freezeButton = Qt.QPushButton("Freeze")
+        freezeButton.setCheckable(True)
+        freezeButton.setToolTip(
+            "Compile the current values in as constants, so the driver can "
+            "unroll loops and drop branches over them"
+        )
+        freezeButton.toggled.connect(self.setFrozen)
+        shaderLayout.addWidget(freezeButton)
+
         shaderLayout.addStretch(0)
         shaderLayout.setContentsMargins(0, 0, 0, 0)
         shaderLayout.setSpacing(1)
@@ -571,9 +699,9 @@ class MainWindow(Qt.QMainWindow):
         lPos = Qt.QVBoxLayout()
         wPos.setLayout(lPos)
         lPos.setContentsMargins(0, 0, 0, 0)
-        posX = GentleLineEdit()
+        posX = self.renderPosX = GentleLineEdit("0")
         posX.setValidator(Qt.QIntValidator())
-        posY = GentleLineEdit()
+        posY = self.renderPosY = GentleLineEdit("0")
         posY.setValidator(Qt.QIntValidator())
         lPos.addWidget(Qt.QLabel("Position"))
         lPos.addWidget(posX)
@@ -585,10 +713,10 @@ class MainWindow(Qt.QMainWindow):
         lSize = Qt.QVBoxLayout()
         wSize.setLayout(lSize)
         lSize.setContentsMargins(0, 0, 0, 0)
-        sizeX = GentleLineEdit()
-        sizeX.setValidator(Qt.QIntValidator())
-        sizeY = GentleLineEdit()
-        sizeY.setValidator(Qt.QIntValidator())
+        sizeX = self.renderSizeX = GentleLineEdit()
+        sizeX.setValidator(Qt.QIntValidator(1, 1 << 16))
+        sizeY = self.renderSizeY = GentleLineEdit()
+        sizeY.setValidator(Qt.QIntValidator(1, 1 << 16))
         lSize.addWidget(Qt.QLabel("Size"))
         lSize.addWidget(sizeX)
         lSize.addWidget(sizeY)
@@ -600,22 +728,162 @@ class MainWindow(Qt.QMainWindow):
         wFPS.setLayout(lFPS)
         lFPS.setContentsMargins(0, 0, 0, 0)
         lFPS.addWidget(Qt.QLabel("FPS"))
-        fps = GentleLineEdit()
-        fps.setValidator(Qt.QIntValidator())
+        fps = self.renderFps = GentleLineEdit("30")
+        fps.setValidator(Qt.QIntValidator(1, 1000))
         lFPS.addWidget(fps)
 
         renderLayout.addWidget(wFPS)
 
+        wFrames = Qt.QWidget()
+        lFrames = Qt.QHBoxLayout()
+        wFrames.setLayout(lFrames)
+        lFrames.setContentsMargins(0, 0, 0, 0)
+        lFrames.addWidget(Qt.QLabel("Frames"))
+        frameA = self.renderFrameA = GentleLineEdit("0")
+        frameA.setValidator(Qt.QIntValidator(0, 1 << 30))
+        frameB = self.renderFrameB = GentleLineEdit("1")
+        frameB.setValidator(Qt.QIntValidator(1, 1 << 30))
+        lFrames.addWidget(frameA)
+        lFrames.addWidget(frameB)
+
+        renderLayout.addWidget(wFrames)
+
         saveButton = Qt.QPushButton("Set output directory...")
+        saveButton.clicked.connect(self.setRenderDirectory)
         renderLayout.addWidget(saveButton)
+        self.renderDirLabel = Qt.QLabel()
+        self.renderDirLabel.setWordWrap(True)
+        renderLayout.addWidget(self.renderDirLabel)
 
-        renderButton = Qt.QPushButton("Render")
+        renderButton = self.renderButton = Qt.QPushButton("Render")
+        renderButton.clicked.connect(self.renderToFiles)
         renderLayout.addWidget(renderButton)
 
+        sweepButton = Qt.QPushButton("Sweep sliders")
+        sweepButton.clicked.connect(self.sweepSliders)
+        renderLayout.addWidget(sweepButton)
+
         renderLayout.addStretch(0)
         renderDock.hide()
         return renderDock, renderLayout
 
+    def setRenderDirectory(self) -> None:
+        directory = Qt.QFileDialog.getExistingDirectory(self)
+        if directory != "":
+            self.renderDir = directory
+            self.renderDirLabel.setText(directory)
+
+    def renderToFiles(self) -> None:
+        if self.glWidget.rendering():
+            self.renderTimer.stop()
+            self.glWidget.stopRender()
+            self.renderButton.setText("Render")
+            return
+        if self.renderDir is None:
+            self.setRenderDirectory()
+        if self.renderDir is None or self.glWidget.renderer is None:
+            return
+
+        def value(edit: Qt.QLineEdit, default: int) -> int:
+            try:
+                return int(edit.text())
+            except ValueError:
+                return default
+
+        size = (
+            value(self.renderSizeX, self.glWidget.width()),
+            value(self.renderSizeY, self.glWidget.height()),
+        )
+        offset = (value(self.renderPosX, 0), value(self.renderPosY, 0))
+        start = value(self.renderFrameA, 0)
+        frames = range(start, max(start + 1, value(self.renderFrameB, 1)))
+        try:
+            self.glWidget.startRender(
+                size,
+                offset,
+                frames,
+                value(self.renderFps, 30),
+                FileWriter(self.renderDir),
+            )
+        except Exception:
+            self.showException()
+            return
+        self.renderFrames = frames
+        self.renderButton.setText("Cancel")
+        self.renderTimer.start()
+
+    def sweepSliders(self) -> None:
+        # A contact sheet over the ranges of the current shader's sliders,
+        # at most 64 cells.
+        if self.glWidget.renderer is None or self.filename is None:
+            return
+        if self.renderDir is None:
+            self.setRenderDirectory()
+        if self.renderDir is None:
+            return
+        active, _ = self.glWidget.getUniforms()
+        axes: list[Axis] = [
+            (name, uni.slider.minimum(), uni.slider.maximum())
+            for name, uni in self.uniforms.items()
+            if isinstance(uni, SliderUniform) and name in active
+        ]
+        if not axes:
+            return
+        steps = max(2, min(8, int(64 ** (1 / len(axes)))))
+        cell = (
+            256,
+            max(1, 256 * self.glWidget.height() // self.glWidget.width()),
+        )
+        fname = os.path.join(
+            self.renderDir, time.strftime("sweep-%Y%m%d-%H%M%S.png")
+        )
+        try:
+            image, index = self.glWidget.renderSweep(axes, steps, cell)
+            writeSheet(
+                fname,
+                image,
+                index,
+                {
+                    "shader": self.filename,
+                    "axes": [list(axis) for axis in axes],
+                    "sampling": f"grid {steps}",
+                    "cell": list(cell),
+                },
+            )
+        except Exception:
+            self.showException()
+            return
+        self.renderDirLabel.setText(f"{self.renderDir}\n{fname}")
+
+    def renderStep(self) -> None:
+        # One frame per event loop iteration keeps the GUI responsive,
+        # encoding runs in the writer's threads meanwhile.
+        writer = self.glWidget.renderWriter
+        try:
+            frame = self.glWidget.stepRender()
+        except Exception:
+            frame = None
+            self.showException()
+        if frame is None:
+            self.renderTimer.stop()
+            self.renderButton.setText("Render")
+            if writer is not None:
+                self.renderDirLabel.setText(
+                    f"{self.renderDir}\n{writer.stats}"
+                )
+            return
+        assert writer is not None
+        done = frame - self.renderFrames.start + 1
+        self.setWindowTitle(
+            f"rendering {done}/{len(self.renderFrames)} ({writer.stats})"
+        )
+
+    def showException(self) -> None:
+        self.label.setTextFormat(Qt.Qt.PlainText)
+        self.label.setText(traceback.format_exc())
+        print(traceback.format_exc())
+        self.label.show()
+
     def updateUniforms(
         self,
         data: str,
@@ -673,44 +941,237 @@ class MainWindow(Qt.QMainWindow):
         if filename[0] != "":
             self.loadFile(filename[0])
 
+    def setFrozen(self, on: bool) -> None:
+        # Recompiles the shader with the values of its widgets baked in,
+        # or back to the generic one. The renderer keeps replaced programs
+        # linked, so going back and forth doesn't compile again.
+        self.frozen = None
+        self.thawed = False
+        self.thawTimer.stop()
+        if on and self.filename is not None:
+            try:
+                declared = freezableUniforms(Preprocessor(self.filename).text)
+            except OSError:
+                declared = {}
+            # those with a widget shown, samplers and time have none
+            self.frozen = {
+                name: uni.value
+                for name, uni in self.uniforms.items()
+                if name in declared and not uni.widgets[0].isHidden()
+            }
+        self.reload()
+
+    def uniformEdited(self, name: str, value: UniformValue) -> None:
+        # Dragging a frozen value would compile a variant per step: the
+        # generic program takes the values until they settle, then the
+        # variant of the last one is compiled.
+        if self.frozen is not None and name in self.frozen:
+            if self.frozen[name] != value:
+                self.frozen[name] = value
+                self.thawTimer.start()
+                if not self.thawed:
+                    self.thawed = True
+                    self.reload()
+
+    def refreeze(self) -> None:
+        if self.thawed:
+            self.thawed = False
+            self.reload()
+
     def reload(self) -> None:
         if self.filename:
-            self.loadFile(self.filename)
+            with self.profiler().cpu("reload"):
+                self.loadFile(self.filename)
+
+    def profiler(self) -> Profiler:
+        if self.glWidget.renderer is None:
+            return self._idleProfiler
+        return self.glWidget.renderer.profiler
+
+    def toggleProfiler(self) -> None:
+        self.glWidget.makeCurrent()
+        profiler = self.profiler()
+        if profiler.enabled:
+            profiler.stop()
+            self.statsLabel.hide()
+        else:
+            # the overlay may stay open for hours
+            profiler.start(trace=True, limit=TRACE_FRAMES)
+            self.statsLabel.show()
+
+    def dumpProfile(self) -> None:
+        profiler = self.profiler()
+        if not profiler.enabled:
+            return
+        fname = time.strftime("machuchu-profile-%Y%m%d-%H%M%S.json")
+        profiler.dump(fname)
+        print(f"profile written to {fname}")
+
+    def updateStats(self) -> None:
+        profiler = self.profiler()
+        now = time.time()
+        if not profiler.enabled or now - self.statsTime < 0.25:
+            return
+        self.statsTime = now
+        self.statsLabel.setText(profiler.summary())
+        self.statsLabel.adjustSize()
+        self.statsLabel.move(
+            self.glWidget.width() - self.statsLabel.width() - 16, 16
+        )
 
     def loadFile(self, filename: str) -> None:
+        if filename != self.filename and self.frozen is not None:
+            self.frozen = None  # the values were another shader's
+            self.thawed = False
+            self.thawTimer.stop()
+            self.freezeButton.blockSignals(True)
+            self.freezeButton.setChecked(False)
+            self.freezeButton.blockSignals(False)
         self.filename = filename
-        self.label.hide()
+        self.loading = None
         prep = None
         try:
-            prep = Preprocessor(filename)
-            self.updater = Updater(prep.fnames)
-            self.glWidget.setFragmentShader(prep.text, prep.version)
+            try:
+                prep = Preprocessor(filename)
+            except Exception:
+                # e.g. an #include of a file yet to be written, its
+                # creation reloads
+                self.watch(requestedFiles(filename))
+                raise
+            directory = os.path.dirname(filename)
+            # edited images reload the shader too
+            self.watch(
+                prep.fnames
+                + [t.path for t in parseTextures(prep.text, directory)]
+            )
+            text = prep.text
+            if self.frozen and not self.thawed:
+                declared = freezableUniforms(text)
+                text = prep.freeze(
+                    {n: v for n, v in self.frozen.items() if n in declared}
+                )
+            self.glWidget.startFragmentShader(text, prep.version, directory)
+            self.loading = prep
+        except Exception as e:
+            self.showLoadError(prep, e)
+            return
+        self.finishLoad()  # done already on a cache hit
+
+    def watch(self, files: list[str]) -> None:
+        if self.updater is None:
+            self.updater = Updater(files)
+        else:
+            self.updater.set_files(files)
+
+    def finishLoad(self) -> None:
+        # Called every tick while a shader compiles; the old one keeps
+        # animating until the new one is linked.
+        prep = self.loading
+        if prep is None:
+            return
+        try:
+            if not self.glWidget.finishFragmentShader():
+                return
+            self.loading = None
             uniforms, types = self.glWidget.getUniforms()
+            if self.frozen and not self.thawed:  # constants, widgets stay
+                declared = freezableUniforms(prep.text)
+                for name, value in self.frozen.items():
+                    if name in declared:
+                        uniforms[name] = value  # type: ignore
+                        types[name] = (
+                            GL.GL_BOOL
+                            if isinstance(self.uniforms[name], CheckBoxUniform)
+                            else GL.GL_FLOAT
+                        )
             self.updateUniforms(prep.text, uniforms, types)
+            self.label.hide()
         except Exception as e:
-            if prep is not None and isinstance(e, MyGL.ShaderCompilationError):
-                self.label.setTextFormat(Qt.Qt.RichText)
-                self.label.setText(format_error(prep, e.text))
-                print(e.text)
-            else:
-                self.label.setTextFormat(Qt.Qt.PlainText)
-                self.label.setText(traceback.format_exc())
-                print(traceback.format_exc())
-            self.label.show()
+            self.loading = None
+            self.showLoadError(prep, e)
+
+    def showLoadError(self, prep: Preprocessor | None, e: Exception) -> None:
+        # Must be called from an except block.
+        if prep is not None and isinstance(e, MyGL.ShaderCompilationError):
+            self.label.setTextFormat(Qt.Qt.RichText)
+            self.label.setText(format_error(prep, e.text))
+            print(e.text)
+        else:
+            self.label.setTextFormat(Qt.Qt.PlainText)
+            self.label.setText(traceback.format_exc())
+            print(traceback.format_exc())
+        self.label.show()
 
     def tick(self) -> None:
+        if self.glWidget.rendering():
+            return
+        self.finishLoad()
         if self.updater and self.updater.check():
             self.reload()
-        if self.timeron:
-            self.time_uniform += (time.time() - self.time) * 1000
-        self.glWidget.setUniform("time", self.time_uniform)
-        self.time = time.time()
-        self.glWidget.tick()
-        self.setWindowTitle(f"{int(round(self.glWidget.getFps()))} fps")
+        if self.replaying is not None and self.loading is None:
+            self.glWidget.startReplay(self.replaying)
+            self.replaying = None
+        now = time.perf_counter_ns()
+        if self.glWidget.replayer is None:  # replays step the time
+            self.glWidget.session.advance(now - self.time)
+        self.time = now
+        with self.profiler().cpu("tick"):
+            self.glWidget.tick()
+        self.timer.start(
+            IDLE_INTERVAL if self.glWidget.idle else STALL_INTERVAL
+        )
+        self.updateStats()
+        if self.glWidget.idle:
+            title = "idle"
+        else:
+            title = f"{int(round(self.glWidget.getFps()))} fps"
+        if self.glWidget.clock.missed:
+            title += f" | {self.glWidget.clock}"
+        adaptive = self.glWidget.adaptive
+        if adaptive is not None:
+            title += f" | {adaptive.current:.0%} of {self.frameBudget:.0f} ms"
+        if self.showResources:
+            title += f" | GL: {resources.tracker}"
+        self.setWindowTitle(title)
 
     def timer_reset(self) -> None:
-        self.time_uniform = 0.0
-        self.glWidget.setUniform("time", self.time_uniform)
+        self.glWidget.session.resetTime()
+
+    def toggleRecording(self) -> None:
+        # Starts writing inputs to machuchu-session-*.jsonl, or stops.
+        session = self.glWidget.session
+        if session.recording is not None:
+            print(f"session written to {session.recording.name}")
+            session.stopRecording()
+            return
+        if self.filename is None or self.glWidget.renderer is None:
+            return
+        if self.glWidget.replayer is not None:
+            return  # its inputs aren't the user's
+        fname = time.strftime("machuchu-session-%Y%m%d-%H%M%S.jsonl")
+        uniforms, _ = self.glWidget.getUniforms()
+        uniforms.pop("time", None)
+        session.startRecording(
+            fname, os.path.abspath(self.filename), uniforms  # type: ignore
+        )
+        print(f"recording to {fname}")
+
+    def replaySession(self) -> None:
+        # Loads the session's shader and replays it once that's done.
+        fname, _ = Qt.QFileDialog.getOpenFileName(
+            self, filter="Session (*.jsonl)"
+        )
+        if fname == "":
+            return
+        try:
+            replayer = Replayer(fname)
+        except (OSError, ValueError):
+            self.showException()
+            return
+        self.glWidget.session.stopRecording()
+        self.glWidget.stopReplay()
+        self.loadFile(replayer.header["shader"])
+        self.replaying = replayer
 
     def toggleShaderDock(self) -> None:
         if self.shaderDock.isVisible():
@@ -724,58 +1185,95 @@ class MainWindow(Qt.QMainWindow):
         else:
             self.renderDock.show()
 
+    def toggleBrowserDock(self) -> None:
+        if self.browserDock.isVisible():
+            self.browserDock.hide()
+        else:
+            self.browserDock.show()
+
+    def closeEvent(self, e: Qt.QtGui.QCloseEvent) -> None:
+        self.glWidget.session.stopRecording()
+        self.browserDock.shutdown()
+        super().closeEvent(e)
+
     def keyPressEvent(self, e: Qt.QtGui.QKeyEvent) -> None:
         if not e.isAutoRepeat() and not self.keyboardGrabber():
             if e.key() == Qt.Qt.Key_W:
-                self.glWidget.coord.add(y=+1)
+                self.glWidget.session.add(y=+1)
             if e.key() == Qt.Qt.Key_S:
-                self.glWidget.coord.add(y=-1)
+                self.glWidget.session.add(y=-1)
             if e.key() == Qt.Qt.Key_A:
-                self.glWidget.coord.add(x=-1)
+                self.glWidget.session.add(x=-1)
             if e.key() == Qt.Qt.Key_D:
-                self.glWidget.coord.add(x=+1)
+                self.glWidget.session.add(x=+1)
             if e.key() == Qt.Qt.Key_Period:
-                self.glWidget.coord.add(z=+1)
+                self.glWidget.session.add(z=+1)
             if e.key() == Qt.Qt.Key_Comma:
-                self.glWidget.coord.add(z=-1)
+                self.glWidget.session.add(z=-1)
+        if e.key() == Qt.Qt.Key_F3:
+            self.toggleProfiler()
+        if e.key() == Qt.Qt.Key_F4:
+            self.dumpProfile()
         if e.key() == Qt.Qt.Key_F10:
             self.timer_reset()
         if e.key() == Qt.Qt.Key_Escape:
             self.close()
         if e.key() == Qt.Qt.Key_P:
-            self.timeron = not self.timeron
+            session = self.glWidget.session
+            session.pause(not session.paused)
+        if e.key() == Qt.Qt.Key_F5:
+            self.toggleRecording()
+        if e.key() == Qt.Qt.Key_F6:
+            self.replaySession()
         if e.key() == Qt.Qt.Key_F:
             self.toggleShaderDock()
+        if e.key() == Qt.Qt.Key_T:
+            self.glWidget.fixedStep = not self.glWidget.fixedStep
         if e.key() == Qt.Qt.Key_R:
             self.toggleRenderDock()
+        if e.key() == Qt.Qt.Key_B:
+            self.toggleBrowserDock()
+        if e.key() == Qt.Qt.Key_X:
+            self.glWidget.setAdaptive(
+                self.glWidget.adaptive is None, self.frameBudget
+            )
+        if e.key() in (Qt.Qt.Key_BracketLeft, Qt.Qt.Key_BracketRight):
+            step = 2.0 if e.key() == Qt.Qt.Key_BracketRight else -2.0
+            self.frameBudget = max(2.0, self.frameBudget + step)
+            if self.glWidget.adaptive is not None:
+                self.glWidget.setAdaptive(True, self.frameBudget)
+        if e.key() == Qt.Qt.Key_G:
+            self.showResources = not self.showResources
+        if e.key() == Qt.Qt.Key_Q:
+            self.glWidget.setRefine(self.glWidget.accumulator is None)
         if e.key() == Qt.Qt.Key_C:
-            self.glWidget.coord.origin()
+            self.glWidget.session.origin()
         if e.key() == Qt.Qt.Key_V:
-            self.glWidget.coord.zoom_reset()
+            self.glWidget.session.zoomReset()
         if e.modifiers() == Qt.Qt.ControlModifier and e.key() == Qt.Qt.Key_O:
             self.load()
 
     def keyReleaseEvent(self, e: Qt.QtGui.QKeyEvent) -> None:
         if not e.isAutoRepeat() and not self.keyboardGrabber():
             if e.key() == Qt.Qt.Key_W:
-                self.glWidget.coord.add(y=-1)
+                self.glWidget.session.add(y=-1)
             if e.key() == Qt.Qt.Key_S:
-                self.glWidget.coord.add(y=+1)
+                self.glWidget.session.add(y=+1)
             if e.key() == Qt.Qt.Key_A:
-                self.glWidget.coord.add(x=+1)
+                self.glWidget.session.add(x=+1)
             if e.key() == Qt.Qt.Key_D:
-                self.glWidget.coord.add(x=-1)
+                self.glWidget.session.add(x=-1)
             if e.key() == Qt.Qt.Key_Period:
-                self.glWidget.coord.add(z=-1)
+                self.glWidget.session.add(z=-1)
             if e.key() == Qt.Qt.Key_Comma:
-                self.glWidget.coord.add(z=+1)
+                self.glWidget.session.add(z=+1)
 
     def wheelEvent(self, e: Qt.QtGui.QWheelEvent) -> None:
         d = e.angleDelta()
         if Qt.QApplication.keyboardModifiers() & Qt.Qt.ControlModifier:
-            self.glWidget.coord.zoom(d.y() / 100, (e.pos().x(), e.pos().y()))
+            self.glWidget.session.zoom(d.y() / 100, (e.pos().x(), e.pos().y()))
         else:
-            self.glWidget.coord.move(x=-d.x(), y=d.y())
+            self.glWidget.session.move(x=-d.x(), y=d.y())
 
     def warpCursor(self) -> None:
         cursor = Qt.QCursor()
@@ -793,7 +1291,7 @@ class MainWindow(Qt.QMainWindow):
 
     def mousePressEvent(self, e: Qt.QtGui.QMouseEvent) -> None:
         if e.buttons() == Qt.Qt.LeftButton:
-            self.glWidget.coord.mouse_down(e.pos().x(), e.pos().y())
+            self.glWidget.session.mouseDown(e.pos().x(), e.pos().y())
         if e.button() == Qt.Qt.MiddleButton or e.button() == Qt.Qt.RightButton:
             self.cursorLocPos = e.pos()
         grabber = self.keyboardGrabber()
@@ -802,11 +1300,11 @@ class MainWindow(Qt.QMainWindow):
             grabber.clearFocus()
 
     def mouseReleaseEvent(self, e: Qt.QtGui.QMouseEvent) -> None:
-        self.glWidget.coord.mouse_up()
+        self.glWidget.session.mouseUp()
 
     def mouseMoveEvent(self, e: Qt.QtGui.QMouseEvent) -> None:
         if e.buttons() == Qt.Qt.LeftButton:
-            self.glWidget.coord.mouse_move(e.pos().x(), e.pos().y())
+            self.glWidget.session.mouseMove(e.pos().x(), e.pos().y())
         if (
             e.buttons() == Qt.Qt.MiddleButton
             or e.buttons() == Qt.Qt.RightButton
@@ -814,12 +1312,13 @@ class MainWindow(Qt.QMainWindow):
             d = self.cursorLocPos - e.pos()
             self.cursorLocPos = e.pos()
             self.warpCursor()
-            self.glWidget.coord.move(d.x(), -d.y())
+            self.glWidget.session.move(d.x(), -d.y())
 
 
 format = Qt.QSurfaceFormat()
-format.setVersion(3, 2)
+format.setVersion(3, 3)  # sampler objects
 format.setProfile(Qt.QSurfaceFormat.CoreProfile)
+format.setSwapInterval(1)  # vsync, frameSwapped paces the frame loop
 Qt.QSurfaceFormat.setDefaultFormat(format)
 
 signal.signal(signal.SIGINT, signal.SIG_DFL)
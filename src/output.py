@@ -0,0 +1,202 @@
+import abc
+import os
+import shlex
+import subprocess
+import threading
+import time
+import typing
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+from images import encode_png
+
+# Frames arrive here as read-only views into mapped pixel buffers (see
+# readback.py). Encoders must be done with the view when they return, the
+# memory is unmapped right after.
+
+FORMATS = ("png", "raw", "exr")
+
+_Encoder = typing.Callable[[str, np.ndarray], None]
+
+
+def _to_uint8(image: np.ndarray) -> np.ndarray:
+    if image.dtype == np.uint8:
+        return image
+    return (np.clip(image, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+
+
+def _write_png(fname: str, image: np.ndarray) -> None:
+    data = encode_png(_to_uint8(image))
+    with open(fname, "wb") as f:
+        f.write(data)
+
+
+def _write_raw(fname: str, image: np.ndarray) -> None:
+    with open(fname, "wb") as f:
+        f.write(np.ascontiguousarray(image).data)
+
+
+def _write_exr(fname: str, image: np.ndarray) -> None:
+    try:
+        import OpenEXR
+        import Imath
+    except ImportError:
+        raise RuntimeError("EXR output needs the OpenEXR python module")
+    if image.dtype == np.uint8:
+        image = image / np.float32(255.0)
+    height, width, _ = image.shape
+    half = Imath.Channel(Imath.PixelType(Imath.PixelType.HALF))
+    header = OpenEXR.Header(width, height)
+    header["channels"] = {c: half for c in "RGBA"}
+    out = OpenEXR.OutputFile(fname, header)
+    channels = image.astype(np.float16)
+    out.writePixels(
+        {c: channels[:, :, i].tobytes() for i, c in enumerate("RGBA")}
+    )
+    out.close()
+
+
+_ENCODERS: dict[str, _Encoder] = {
+    "png": _write_png,
+    "raw": _write_raw,
+    "exr": _write_exr,
+}
+
+
+class WriterStats:
+    def __init__(self) -> None:
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.backpressure = 0  # submits that had to wait for a free slot
+        self.waited = 0.0
+        self.depth = 0
+        self.max_depth = 0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.written} written, {self.dropped} dropped, "
+            f"{self.backpressure} stalls ({self.waited:.2f}s), "
+            f"queue {self.depth}/{self.max_depth} max"
+        )
+
+
+class FrameWriter(abc.ABC):
+    # Runs write() on a bounded thread pool. When `queue` frames are in
+    # flight, submit() either blocks (backpressure) or drops the frame.
+
+    def __init__(
+        self,
+        threads: int | None = None,
+        queue: int | None = None,
+        drop: bool = False,
+    ) -> None:
+        threads = threads or min(8, os.cpu_count() or 1)
+        self.drop = drop
+        self.queue = queue or threads * 2
+        self.stats = WriterStats()
+        self._pool = ThreadPoolExecutor(threads, "machuchu-writer")
+        self._slots = threading.BoundedSemaphore(self.queue)
+        self._lock = threading.Lock()
+        self._error: BaseException | None = None
+
+    @abc.abstractmethod
+    def write(self, frame: int, image: np.ndarray) -> None:
+        pass
+
+    def _acquire(self) -> bool:
+        if self._slots.acquire(blocking=False):
+            return True
+        if self.drop:
+            self.stats.dropped += 1
+            return False
+        self.stats.backpressure += 1
+        start = time.perf_counter()
+        self._slots.acquire()
+        self.stats.waited += time.perf_counter() - start
+        return True
+
+    def _run(self, frame: int, image: np.ndarray) -> None:
+        try:
+            self.write(frame, image)
+            with self._lock:
+                self.stats.written += 1
+        except BaseException as e:
+            self._error = e
+            raise
+        finally:
+            with self._lock:
+                self.stats.depth -= 1
+            self._slots.release()
+
+    def submit(self, frame: int, image: np.ndarray) -> Future | None:
+        if self._error is not None:
+            raise self._error
+        if not self._acquire():
+            return None
+        with self._lock:
+            self.stats.submitted += 1
+            self.stats.depth += 1
+            self.stats.max_depth = max(self.stats.max_depth, self.stats.depth)
+        return self._pool.submit(self._run, frame, image)
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=True)
+        if self._error is not None:
+            raise self._error
+
+
+class FileWriter(FrameWriter):
+    def __init__(
+        self,
+        outdir: str,
+        format: str = "png",
+        threads: int | None = None,
+        queue: int | None = None,
+        drop: bool = False,
+    ) -> None:
+        if format not in _ENCODERS:
+            raise ValueError(f"unknown format {format!r}")
+        super().__init__(threads, queue, drop)
+        self.outdir = outdir
+        self.format = format
+        self._encode = _ENCODERS[format]
+
+    def filename(self, frame: int) -> str:
+        return os.path.join(self.outdir, f"{frame:06d}.{self.format}")
+
+    def write(self, frame: int, image: np.ndarray) -> None:
+        self._encode(self.filename(frame), image)
+
+
+class PipeWriter(FrameWriter):
+    # Streams raw RGBA frames, in order, into an encoder's stdin, e.g.
+    # "ffmpeg -f rawvideo -pix_fmt rgba -s {width}x{height} -r {fps}
+    # -i - out.mp4". Ordering means a single writer thread.
+
+    def __init__(
+        self,
+        command: str,
+        size: tuple[int, int],
+        fps: float,
+        queue: int | None = None,
+    ) -> None:
+        super().__init__(threads=1, queue=queue)
+        args = shlex.split(
+            command.format(width=size[0], height=size[1], fps=fps)
+        )
+        self._process = subprocess.Popen(args, stdin=subprocess.PIPE)
+
+    def write(self, frame: int, image: np.ndarray) -> None:
+        assert self._process.stdin is not None
+        self._process.stdin.write(np.ascontiguousarray(_to_uint8(image)).data)
+
+    def close(self) -> None:
+        try:
+            super().close()
+        finally:
+            assert self._process.stdin is not None
+            self._process.stdin.close()
+            if self._process.wait() != 0:
+                raise RuntimeError(
+                    f"encoder exited with code {self._process.returncode}"
+                )
@@ -0,0 +1,119 @@
+import multiprocessing
+import os
+import sys
+import typing
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor
+from concurrent.futures import wait
+from concurrent.futures.process import BrokenProcessPool
+
+# Frame ranges rendered by a pool of worker processes. Every worker sets
+# up its own offscreen context once and then renders whole chunks of
+# frames. Frames must only depend on their index, so that any worker can
+# render any chunk and a failed chunk can simply be rendered again;
+# feedback shaders, whose frames depend on earlier ones, can't be split.
+
+Job = typing.Callable[[range], int]  # renders a chunk, returns frames done
+Setup = typing.Callable[[], Job]  # runs once per worker, must be picklable
+
+_job: Job | None = None
+_setupError: Exception | None = None
+
+
+def _init(setup: Setup) -> None:
+    global _job, _setupError
+    # llvmpipe starts a thread per core in every context, the workers
+    # already keep the cores busy.
+    os.environ.setdefault("LP_NUM_THREADS", "1")
+    try:
+        _job = setup()
+    except Exception as e:
+        # raised from every chunk instead, an initializer raising breaks
+        # the pool and says nothing about why
+        _setupError = e
+
+
+def _run(frames: range) -> int:
+    if _setupError is not None:
+        raise _setupError
+    assert _job is not None
+    return _job(frames)
+
+
+def chunks(frames: range, size: int) -> list[range]:
+    return [
+        range(start, min(start + size, frames.stop))
+        for start in range(frames.start, frames.stop, size)
+    ]
+
+
+def renderParallel(
+    setup: Setup,
+    frames: range,
+    jobs: int,
+    chunk: int | None = None,
+    retries: int = 2,
+    progress: typing.Callable[[int, int], None] | None = None,
+    fatal: tuple[type[Exception], ...] = (),
+) -> int:
+    # Returns the number of frames written. A chunk whose worker raised or
+    # died is handed out again up to `retries` times; a dead worker takes
+    # the pool down with it, so the pool is restarted in that case.
+    # `progress` gets the frames done so far and the total. Exceptions of
+    # the `fatal` types, which retries won't fix, are raised right away.
+    chunk = chunk or max(1, min(32, len(frames) // (jobs * 4)))
+    todo = chunks(frames, chunk)
+    attempts = {r: 0 for r in todo}
+    done = written = 0
+    context = multiprocessing.get_context("spawn")  # no GL state forked
+    while todo:
+        with ProcessPoolExecutor(
+            jobs, mp_context=context, initializer=_init, initargs=(setup,)
+        ) as pool:
+            running: dict[Future, range] = {}
+            while todo or running:
+                while todo and len(running) < jobs * 2:
+                    r = todo.pop(0)
+                    running[pool.submit(_run, r)] = r
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                broken = False
+                for future in finished:
+                    r = running.pop(future)
+                    try:
+                        written += future.result()
+                    except BrokenProcessPool as e:
+                        broken = True
+                        _retry(r, e, attempts, retries, todo)
+                        continue
+                    except fatal:
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        raise
+                    except Exception as e:
+                        _retry(r, e, attempts, retries, todo)
+                        continue
+                    done += len(r)
+                    if progress is not None:
+                        progress(done, len(frames))
+                if broken:
+                    # there's no telling which chunk killed the worker
+                    for r in running.values():
+                        _retry(r, None, attempts, retries, todo)
+                    break
+    return written
+
+
+def _retry(
+    r: range,
+    error: BaseException | None,
+    attempts: dict[range, int],
+    retries: int,
+    todo: list[range],
+) -> None:
+    attempts[r] += 1
+    frames = f"frames {r.start}-{r.stop - 1}"
+    if attempts[r] > retries:
+        raise RuntimeError(f"{frames} failed {attempts[r]} times") from error
+    print(
+        f"\n{frames} failed ({error or 'worker lost'}), retrying",
+        file=sys.stderr,
+    )
+    todo.append(r)
@@ -1,66 +1,274 @@
 #!/usr/bin/env python3
 
-import re
+import hashlib
+import math
 import os
+import re
+import typing
 
 INCLUDE_RE = re.compile(r'^\s*#\s*include\s+"([^"]+)"\s*$')
 ONCE_RE = re.compile(r"^\s*#\s*pragma\s+once\s*$")
 VERSION_RE = re.compile(r"^\s*#\s*version\s+(.*)$")
+# single declarations only, `uniform float a, b;` isn't matched
+UNIFORM_RE = re.compile(
+    r"^[ \t]*uniform\s+(?:(?:lowp|mediump|highp)\s+)?(\w+)\s+(\w+)"
+    r"\s*(?:=[^;]*)?;",
+    re.M,
+)
+FREEZABLE_TYPES = {"float", "int", "uint", "bool", "vec2", "vec3", "vec4"}
+
+FrozenValue = int | bool | float | tuple[float, ...]
+
+
+class _Source:
+    # One file, split into lines and pre-parsed into runs of plain text
+    # and directives, so that re-expanding it costs a few list operations.
+
+    def __init__(self, stamp: tuple[int, int, int], data: bytes) -> None:
+        self.stamp = stamp
+        self.digest = hashlib.sha1(data).digest()
+        text = data.decode().replace("\r\n", "\n").replace("\r", "\n")
+        self.lines = text.split("\n")
+        self.segments: list[tuple[str, int, typing.Any]] = []
+        run: list[str] = []
+        for n, line in enumerate(self.lines):
+            directive = None
+            if ONCE_RE.match(line):
+                directive = ("once", n, line)
+            elif match := INCLUDE_RE.match(line):
+                directive = ("include", n, match.groups()[0])
+            elif match := VERSION_RE.match(line):
+                directive = ("version", n, (line, match.groups()[0]))
+            if directive is None:
+                run.append(line)
+                continue
+            if run:
+                self.segments.append(("text", 0, run))
+                run = []
+            self.segments.append(directive)
+        if run:
+            self.segments.append(("text", 0, run))
+
+
+class IncludeCache:
+    # Parsed sources keyed by path, revalidated by stat() and, when that
+    # changed, by content hash. Also remembers the expanded text of each
+    # root shader together with the digests of everything it included,
+    # and the include graph between files.
+
+    def __init__(self) -> None:
+        self._sources: dict[str, _Source] = {}
+        # root -> (digest of every file it used, result)
+        self._results: dict[str, tuple[list[tuple[str, bytes]], Preprocessor]]
+        self._results = {}
+        self._includes: dict[str, set[str]] = {}
+
+    def load(self, fname: str) -> _Source:
+        st = os.stat(fname)
+        stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+        source = self._sources.get(fname)
+        if source is not None and source.stamp == stamp:
+            return source
+        with open(fname, "rb") as f:
+            data = f.read()
+        if source is not None and source.digest == hashlib.sha1(data).digest():
+            source.stamp = stamp  # touched, not changed
+            return source
+        source = self._sources[fname] = _Source(stamp, data)
+        return source
+
+    def dependents(self, fname: str) -> set[str]:
+        # Every file that includes `fname`, directly or not.
+        reverse: dict[str, set[str]] = {}
+        for parent, children in self._includes.items():
+            for child in children:
+                reverse.setdefault(child, set()).add(parent)
+        result: set[str] = set()
+        stack = [fname]
+        while stack:
+            for parent in reverse.get(stack.pop(), ()):
+                if parent not in result:
+                    result.add(parent)
+                    stack.append(parent)
+        return result
+
+    def invalidate(self, fname: str) -> set[str]:
+        # Forgets `fname` and the results of shaders depending on it,
+        # returns those shaders.
+        affected = self.dependents(fname) | {fname}
+        self._sources.pop(fname, None)
+        roots = {f for f in affected if f in self._results}
+        for root in roots:
+            del self._results[root]
+        return roots
+
+    def _cached(self, fname: str) -> "Preprocessor | None":
+        entry = self._results.get(fname)
+        if entry is None:
+            return None
+        deps, result = entry
+        try:
+            if all(self.load(f).digest == d for f, d in deps):
+                return result
+        except OSError:
+            pass
+        return None
+
+    def _store(self, fname: str, prep: "Preprocessor") -> None:
+        for f in prep.fnames:
+            self._includes[f] = set(prep.includes[f])
+        deps = [(f, self._sources[f].digest) for f in prep.fnames]
+        self._results[fname] = deps, prep
+
+
+_cache = IncludeCache()
 
 
 class Preprocessor:
-    def __init__(self, fname: str) -> None:
+    def __init__(self, fname: str, cache: IncludeCache | None = None) -> None:
+        cache = cache or _cache
         self.version: None | list[str] = None
         self._shift = 0
         self.text_lines: list[str] = []
         self.fnames: list[str] = []
         self.fcontents: list[list[str]] = []
+        self.includes: dict[str, list[str]] = {}  # file -> files it includes
+        self._findex: dict[str, int] = {}
         self._once: set[str] = set()
+        self._cache = cache
 
+        cached = cache._cached(fname)
+        if cached is not None:
+            self.version = cached.version
+            self.text = cached.text
+            self.text_lines = cached.text_lines
+            self.fnames = cached.fnames
+            self.fcontents = cached.fcontents
+            self.includes = cached.includes
+            return
         self._one(fname)
         self.text = "\n".join(self.text_lines)
+        cache._store(fname, self)
+
+    def freeze(self, values: dict[str, FrozenValue]) -> str:
+        # The text of a variant, see freeze() below.
+        return freeze(self.text, values)
 
     def _one(self, fname: str) -> None:
         if fname in self._once:
             return
-        contents = open(fname, "r").read().split("\n")
+        source = self._cache.load(fname)
 
-        if fname not in self.fnames:
+        findex = self._findex.get(fname)
+        if findex is None:
+            findex = self._findex[fname] = len(self.fnames)
             self.fnames.append(fname)
-            self.fcontents.append(contents)
-        findex = self.fnames.index(fname)
+            self.fcontents.append(source.lines)
+            self.includes[fname] = []
 
         if findex != 0:
             self.text_lines.append(
                 f"#line {self._shift} {findex} /* {fname} */"
             )
 
-        for n, line in enumerate(contents):
-            match = ONCE_RE.match(line)
-            if match:
-                self.text_lines.append(f"/* {line} */")
+        for kind, n, payload in source.segments:
+            if kind == "text":
+                self.text_lines.extend(payload)
+            elif kind == "once":
+                self.text_lines.append(f"/* {payload} */")
                 self._once.add(fname)
-                continue
-            match = INCLUDE_RE.match(line)
-            if match:
+            elif kind == "include":
                 path = os.path.dirname(fname)
                 if path != "":
                     path += "/"
-                self._one(path + match.groups()[0])
+                self.includes[fname].append(path + payload)
+                self._one(path + payload)
                 self.text_lines.append(
                     f"#line {self._shift + n + 1} {findex} "
                     f"/* {fname}:{n + 1} */"
                 )
-                continue
-            match = VERSION_RE.match(line)
-            if match:
-                self.version = re.split(r" +", match.groups()[0])
+            elif kind == "version":
+                line, version = payload
+                self.version = re.split(r" +", version)
                 self._shift = int(self.version[1:2] == ["es"])
                 self.text_lines.append(f"/* {line} */")
                 self.text_lines.insert(0, line)
                 self.text_lines.insert(1, f"#line {self._shift} 0")
-                continue
-            self.text_lines.append(line)
+
+
+def requestedFiles(fname: str, cache: IncludeCache | None = None) -> list[str]:
+    # `fname` and every file it includes, directly or not, including
+    # those that are missing or unreadable; what to watch for a shader
+    # that fails to preprocess.
+    cache = cache or _cache
+    result: list[str] = []
+    stack = [fname]
+    while stack:
+        f = stack.pop()
+        if f in result:
+            continue
+        result.append(f)
+        try:
+            source = cache.load(f)
+        except (OSError, UnicodeDecodeError):
+            continue
+        path = os.path.dirname(f)
+        if path != "":
+            path += "/"
+        stack += [
+            path + payload
+            for kind, _, payload in reversed(source.segments)
+            if kind == "include"
+        ]
+    return result
+
+
+def freezableUniforms(text: str) -> dict[str, str]:
+    # Uniforms freeze() can turn into constants, by name, with their type.
+    return {
+        m[2]: m[1]
+        for m in UNIFORM_RE.finditer(text)
+        if m[1] in FREEZABLE_TYPES
+    }
+
+
+def constLiteral(type_: str, value: FrozenValue) -> str:
+    if type_.startswith("vec"):
+        if not isinstance(value, tuple) or len(value) < int(type_[3]):
+            raise ValueError(f"{type_} needs {type_[3]} values, got {value}")
+        items = value[: int(type_[3])]
+        return f"{type_}({', '.join(constLiteral('float', v) for v in items)})"
+    if isinstance(value, tuple):
+        value = value[0]
+    if type_ == "bool":
+        return "true" if value else "false"
+    if type_ == "int":
+        return str(int(value))
+    if type_ == "uint":
+        return f"{int(value)}u"
+    if not math.isfinite(value):
+        raise ValueError(f"can't freeze {value} into a float constant")
+    return repr(float(value))
+
+
+def freeze(text: str, values: dict[str, FrozenValue]) -> str:
+    # `text` with the uniforms in `values` declared as constants instead,
+    # so the driver can unroll loops over them and drop dead branches.
+    # Line numbers stay the same. Raises ValueError for names without a
+    # single plain declaration of a supported type.
+    types = freezableUniforms(text)
+    for name in values:
+        if name not in types:
+            raise ValueError(f"can't freeze {name}, no plain uniform of it")
+
+    def const(m: re.Match) -> str:
+        type_, name = m[1], m[2]
+        if name not in values or type_ not in FREEZABLE_TYPES:
+            return m[0]
+        literal = constLiteral(type_, values[name])
+        return f"const {type_} {name} = {literal};" + "\n" * m[0].count("\n")
+
+    return UNIFORM_RE.sub(const, text)
 
 
 def main() -> None:
@@ -0,0 +1,193 @@
+import collections
+import contextlib
+import csv
+import json
+import time
+import typing
+import numpy as np
+from OpenGL import GL
+from OpenGL.raw.GL.VERSION import GL_3_3
+from resources import tracker
+
+# Per-frame timings. GPU sections are bracketed by GL_TIMESTAMP queries
+# (they nest, unlike GL_TIME_ELAPSED) whose results are collected a few
+# frames later, once available, so profiling never waits for the GPU.
+# CPU sections use perf_counter_ns. Section names get a "gpu." or "cpu."
+# prefix; a section entered several times in a frame is summed.
+
+_NULL = contextlib.nullcontext()
+
+
+class _Frame:
+    def __init__(self, number: int) -> None:
+        self.number = number
+        self.cpu: dict[str, float] = collections.defaultdict(float)
+        self.gpu: list[tuple[str, int, int]] = []
+
+
+class Profiler:
+    def __init__(self, history: int = 240, depth: int = 4) -> None:
+        # `history` frames are kept for stats and traces, results of at
+        # most `depth` frames may be in flight before the oldest is
+        # given up on.
+        self.enabled = False
+        self.depth = depth
+        self.frames: collections.deque[dict[str, float]] = collections.deque(
+            maxlen=history
+        )
+        self.lost = 0
+        self._trace: collections.deque[dict[str, float]] | None = None
+        self._frame = _Frame(0)
+        self._pending: collections.deque[_Frame] = collections.deque()
+        self._queries: list[int] = []
+
+    def start(self, trace: bool = False, limit: int | None = None) -> None:
+        # With `trace`, every frame is kept for dump(), not just the
+        # last `history`, or the last `limit` frames if given.
+        self.enabled = True
+        self.frames.clear()
+        self._trace = collections.deque(maxlen=limit) if trace else None
+
+    def stop(self) -> None:
+        self.enabled = False
+        self._discard()
+
+    def _query(self) -> int:
+        if self._queries:
+            return self._queries.pop()
+        return tracker.track("query", GL.glGenQueries(1)[0])
+
+    def gpu(self, name: str) -> typing.ContextManager:
+        if not self.enabled:
+            return _NULL
+        return self._gpu(name)
+
+    @contextlib.contextmanager
+    def _gpu(self, name: str) -> typing.Iterator[None]:
+        begin = self._query()
+        GL.glQueryCounter(begin, GL.GL_TIMESTAMP)
+        try:
+            yield
+        finally:
+            end = self._query()
+            GL.glQueryCounter(end, GL.GL_TIMESTAMP)
+            self._frame.gpu.append(("gpu." + name, begin, end))
+
+    def cpu(self, name: str) -> typing.ContextManager:
+        if not self.enabled:
+            return _NULL
+        return self._cpu(name)
+
+    @contextlib.contextmanager
+    def _cpu(self, name: str) -> typing.Iterator[None]:
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            self._frame.cpu["cpu." + name] += elapsed / 1e6
+
+    def frame(self) -> None:
+        # Ends the current frame.
+        if not self.enabled:
+            return
+        self._pending.append(self._frame)
+        self._frame = _Frame(self._frame.number + 1)
+        self._collect()
+
+    def flush(self) -> None:
+        # Waits for the frames still in flight, at the end of a run.
+        if not self.enabled:
+            return
+        GL.glFinish()
+        self._collect()
+
+    def _available(self, query: int) -> bool:
+        return bool(GL.glGetQueryObjectiv(query, GL.GL_QUERY_RESULT_AVAILABLE))
+
+    def _result(self, query: int) -> int:
+        value = GL.GLuint64()
+        GL_3_3.glGetQueryObjectui64v(query, GL.GL_QUERY_RESULT, value)
+        return value.value
+
+    def _collect(self) -> None:
+        while self._pending:
+            frame = self._pending[0]
+            # queries complete in order, the last one decides
+            if frame.gpu and not self._available(frame.gpu[-1][2]):
+                if len(self._pending) <= self.depth:
+                    break
+                self._pending.popleft()
+                self._recycle(frame)
+                self.lost += 1
+                continue
+            self._pending.popleft()
+            record: dict[str, float] = {"frame": frame.number}
+            record.update(frame.cpu)
+            for name, begin, end in frame.gpu:
+                elapsed = (self._result(end) - self._result(begin)) / 1e6
+                record[name] = record.get(name, 0.0) + elapsed
+            self._recycle(frame)
+            self.frames.append(record)
+            if self._trace is not None:
+                self._trace.append(record)
+
+    def _recycle(self, frame: _Frame) -> None:
+        for _, begin, end in frame.gpu:
+            self._queries += (begin, end)
+        frame.gpu = []
+
+    def _discard(self) -> None:
+        for frame in self._pending:
+            self._recycle(frame)
+        self._pending.clear()
+        self._recycle(self._frame)
+        self._frame.cpu.clear()
+
+    def stats(self) -> dict[str, tuple[float, float, float]]:
+        # (min, avg, p99) in milliseconds per section
+        columns: dict[str, list[float]] = collections.defaultdict(list)
+        for record in self.frames:
+            for name, value in record.items():
+                if name != "frame":
+                    columns[name].append(value)
+        return {
+            name: (
+                min(values),
+                sum(values) / len(values),
+                float(np.percentile(values, 99)),
+            )
+            for name, values in sorted(columns.items())
+        }
+
+    def summary(self) -> str:
+        lines = [f"{'':16}{'min':>8}{'avg':>8}{'p99':>8} ms"]
+        for name, (lo, avg, p99) in self.stats().items():
+            lines.append(f"{name:16}{lo:8.2f}{avg:8.2f}{p99:8.2f}")
+        if self.lost:
+            lines.append(f"{self.lost} frames lost")
+        return "\n".join(lines)
+
+    def records(self) -> list[dict[str, float]]:
+        # Every traced frame, or the last `history` ones.
+        return list(self.frames if self._trace is None else self._trace)
+
+    def dump(self, fname: str) -> None:
+        # .csv gets one row per frame, anything else is written as JSON.
+        records = self.records()
+        if fname.endswith(".csv"):
+            names = sorted({k for r in records for k in r} - {"frame"})
+            with open(fname, "w", newline="") as f:
+                writer = csv.DictWriter(f, ["frame"] + names)
+                writer.writeheader()
+                writer.writerows(records)
+        else:
+            with open(fname, "w") as f:
+                json.dump(
+                    {"stats": self.stats(), "frames": records}, f, indent=1
+                )
+
+    def delete(self) -> None:
+        self._discard()
+        tracker.delete("query", *self._queries)
+        self._queries = []
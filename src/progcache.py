@@ -0,0 +1,178 @@
+import collections
+import ctypes
+import hashlib
+import os
+import struct
+import tempfile
+import numpy as np
+from OpenGL import GL
+from resources import tracker
+
+# Linked program binaries on disk, so that reopening a shader skips the
+# compiler. Entries are keyed by the sources and by the driver that built
+# them; a driver update changes the key, and a binary the driver rejects
+# anyway is deleted and the program is built from source again.
+
+_HEADER = struct.Struct("<4sI")  # magic, binary format
+_MAGIC = b"MCPB"
+
+DEFAULT_LIMIT = 64 << 20
+DEFAULT_LINKED = 8
+
+
+def cacheDirectory() -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "machuchu", "programs")
+
+
+class ProgramCache:
+    # Least recently used entries are evicted once the directory grows
+    # past `limit` bytes; file mtimes serve as the use times.
+
+    def __init__(
+        self, directory: str | None = None, limit: int = DEFAULT_LIMIT
+    ) -> None:
+        self.directory = directory or cacheDirectory()
+        self.limit = limit
+        self.hits = 0
+        self.misses = 0
+        self._driver: bytes | None = None
+
+    def supported(self) -> bool:
+        return GL.glGetIntegerv(GL.GL_NUM_PROGRAM_BINARY_FORMATS) > 0
+
+    def key(self, *sources: str) -> str:
+        if self._driver is None:
+            self._driver = b"\0".join(
+                GL.glGetString(name)
+                for name in (GL.GL_VENDOR, GL.GL_RENDERER, GL.GL_VERSION)
+            )
+        h = hashlib.sha256(self._driver)
+        for source in sources:
+            h.update(b"\0" + source.encode())
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".bin")
+
+    def load(self, key: str) -> int | None:
+        # A linked program, or None on a miss.
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        program = None
+        try:
+            magic, format = _HEADER.unpack_from(data)
+            if magic != _MAGIC:
+                raise ValueError("not a program binary")
+            binary = np.frombuffer(data, np.uint8, offset=_HEADER.size)
+            program = tracker.track("program", GL.glCreateProgram())
+            GL.glProgramBinary(
+                program,
+                format,
+                binary.ctypes.data_as(ctypes.c_void_p),
+                binary.size,
+            )
+            if not GL.glGetProgramiv(program, GL.GL_LINK_STATUS):
+                raise ValueError("binary rejected by the driver")
+        except (ValueError, struct.error, GL.GLError):
+            if program is not None:
+                tracker.delete("program", program)
+            self._remove(path)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return program
+
+    def store(self, key: str, program: int) -> None:
+        # `program` has to be linked with the retrievable hint set.
+        size = GL.glGetProgramiv(program, GL.GL_PROGRAM_BINARY_LENGTH)
+        if size <= 0:
+            return
+        binary = np.empty(size, np.uint8)
+        length = GL.GLsizei()
+        format = GL.GLenum()
+        GL.glGetProgramBinary(
+            program,
+            size,
+            ctypes.byref(length),
+            ctypes.byref(format),
+            binary.ctypes.data_as(ctypes.c_void_p),
+        )
+        data = _HEADER.pack(_MAGIC, format.value)
+        data += binary[: length.value].tobytes()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # other instances may be reading, replace atomically
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._path(key))
+            self._evict()
+        except OSError:
+            pass  # a read-only cache is as good as none
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def _evict(self) -> None:
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".bin"):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.limit:
+                break
+            self._remove(path)
+            total -= size
+
+
+def sourceKey(*sources: str) -> str:
+    # Identifies programs within a process, where the driver can't change.
+    h = hashlib.sha256()
+    for source in sources:
+        h.update(b"\0" + source.encode())
+    return h.hexdigest()
+
+
+class LinkedPrograms:
+    # The last `limit` programs a Renderer replaced, still linked and keyed
+    # by sourceKey(), so switching back to one, e.g. to the generic
+    # program or a variant with other frozen uniforms (see
+    # preprocessor.freeze()), is instant even without binary formats or a
+    # program cache. Evicted programs are deleted.
+
+    def __init__(self, limit: int = DEFAULT_LINKED) -> None:
+        self.limit = limit
+        self._programs: collections.OrderedDict[str, int]
+        self._programs = collections.OrderedDict()
+
+    def take(self, key: str) -> int | None:
+        # The caller owns the program returned.
+        return self._programs.pop(key, None)
+
+    def put(self, key: str, program: int) -> None:
+        old = self._programs.pop(key, None)
+        if old is not None and old != program:
+            tracker.delete("program", old)
+        self._programs[key] = program
+        while len(self._programs) > self.limit:
+            _, evicted = self._programs.popitem(last=False)
+            tracker.delete("program", evicted)
+
+    def delete(self) -> None:
+        tracker.delete("program", *self._programs.values())
+        self._programs.clear()
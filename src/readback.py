@@ -0,0 +1,142 @@
+import ctypes
+import time
+from concurrent.futures import Future
+import numpy as np
+from OpenGL import GL
+from OpenGL.raw.GL.VERSION import GL_1_0
+from output import FrameWriter
+from resources import tracker
+
+
+class _Slot:
+    def __init__(self, nbytes: int) -> None:
+        self.buffer = tracker.track("buffer", GL.glGenBuffers(1), nbytes)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, self.buffer)
+        GL.glBufferData(
+            GL.GL_PIXEL_PACK_BUFFER, nbytes, None, GL.GL_STREAM_READ
+        )
+        self.frame: int | None = None  # transfer queued, not mapped yet
+        self.fence = None
+        self.mapped = False  # handed out to the writer
+        self.future: Future | None = None
+
+
+class PixelReadback:
+    # Asynchronous glReadPixels through a ring of pixel buffer objects.
+    # read() queues a transfer and fences it; slots are mapped as soon as
+    # their fence signals, so frame N is mapped and encoded while frame
+    # N+1 renders. Mapped memory goes to the writer as a NumPy view and
+    # stays mapped until the writer is done with it and the ring wraps
+    # around to that slot again.
+
+    def __init__(
+        self,
+        size: tuple[int, int],
+        writer: FrameWriter,
+        depth: int | None = None,
+        dtype: type = np.uint8,
+    ) -> None:
+        self.size = size
+        self.writer = writer
+        self.dtype = np.dtype(dtype)
+        self._type = {
+            np.uint8: GL.GL_UNSIGNED_BYTE,
+            np.float32: GL.GL_FLOAT,
+        }[self.dtype.type]
+        self._nbytes = size[0] * size[1] * 4 * self.dtype.itemsize
+        depth = depth or writer.queue + 1
+        self._slots = [_Slot(self._nbytes) for _ in range(depth)]
+        self._next = 0
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+
+    def read(self, framebuffer: int, frame: int) -> bool:
+        # Returns False if the frame was dropped because the writer is
+        # still busy with the slot it would go to.
+        slot = self._slots[self._next]
+        if slot.frame is not None:
+            self._deliver(slot, wait=True)
+        if slot.future is not None and not slot.future.done():
+            stats = self.writer.stats
+            if self.writer.drop:
+                stats.dropped += 1
+                return False
+            stats.backpressure += 1
+            start = time.perf_counter()
+            slot.future.exception()
+            stats.waited += time.perf_counter() - start
+        self._release(slot)
+        self._next = (self._next + 1) % len(self._slots)
+
+        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, framebuffer)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, slot.buffer)
+        GL.glPixelStorei(GL.GL_PACK_ALIGNMENT, 1)
+        # the wrapped glReadPixels insists on allocating a client array
+        GL_1_0.glReadPixels(
+            0, 0, self.size[0], self.size[1], GL.GL_RGBA, self._type, None
+        )
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        slot.fence = GL.glFenceSync(GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        slot.frame = frame
+        GL.glFlush()
+        self.poll()
+        return True
+
+    def _ordered(self) -> list[_Slot]:
+        # oldest first
+        n = len(self._slots)
+        return [self._slots[(self._next + i) % n] for i in range(n)]
+
+    def poll(self) -> None:
+        # Hands out finished transfers without blocking, in frame order.
+        for slot in self._ordered():
+            if slot.frame is not None and not self._deliver(slot, False):
+                break
+
+    def _deliver(self, slot: _Slot, wait: bool) -> bool:
+        status = GL.glClientWaitSync(
+            slot.fence,
+            GL.GL_SYNC_FLUSH_COMMANDS_BIT,
+            GL.GL_TIMEOUT_IGNORED if wait else 0,
+        )
+        if status == GL.GL_TIMEOUT_EXPIRED:
+            return False
+        GL.glDeleteSync(slot.fence)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, slot.buffer)
+        ptr = GL.glMapBufferRange(
+            GL.GL_PIXEL_PACK_BUFFER, 0, self._nbytes, GL.GL_MAP_READ_BIT
+        )
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        slot.mapped = True
+        raw = (ctypes.c_ubyte * self._nbytes).from_address(ptr)
+        width, height = self.size
+        image = np.frombuffer(raw, self.dtype).reshape(height, width, 4)
+        image.flags.writeable = False
+        # GL rows go bottom-up, files expect top-down
+        slot.future = self.writer.submit(slot.frame, image[::-1])
+        slot.frame = slot.fence = None
+        return True
+
+    def _release(self, slot: _Slot) -> None:
+        if slot.future is not None:
+            slot.future.exception()  # errors are re-raised by the writer
+            slot.future = None
+        if slot.mapped:
+            GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, slot.buffer)
+            GL.glUnmapBuffer(GL.GL_PIXEL_PACK_BUFFER)
+            GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+            slot.mapped = False
+
+    def pending(self) -> int:
+        return sum(s.frame is not None or s.mapped for s in self._slots)
+
+    def flush(self) -> None:
+        # Delivers everything left and waits for the writer.
+        for slot in self._ordered():
+            if slot.frame is not None:
+                self._deliver(slot, wait=True)
+        for slot in self._slots:
+            self._release(slot)
+
+    def delete(self) -> None:
+        self.flush()
+        tracker.delete("buffer", *(s.buffer for s in self._slots))
@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+
+import headless  # must come before anything that imports OpenGL.GL
+
+import argparse
+import functools
+import math
+import os
+import sys
+import time
+import typing
+from decimal import Decimal
+from OpenGL import GL
+import MyGL
+import resources
+from accumulate import Accumulator
+from coord import CoordUniform
+from output import FORMATS, FileWriter, FrameWriter, PipeWriter
+from parallel import renderParallel
+from preprocessor import Preprocessor
+from progcache import ProgramCache
+from renderer import Renderer, Target, renderFrames
+from sweep import Axis, gridSamples, latinHypercube, renderSweep, writeSheet
+from tiled import TIFF_EXTENSIONS, maxTileSize, openImage, renderTiled
+from uniforms import UniformValue
+
+
+def parse_size(text: str) -> tuple[int, int]:
+    try:
+        width, height = map(int, text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WxH, got {text!r}")
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError(f"bad size {text!r}")
+    return width, height
+
+
+def parse_frames(text: str) -> range:
+    # A:B renders frames A..B-1, a single number renders just that frame
+    try:
+        if ":" in text:
+            start, stop = map(int, text.split(":"))
+        else:
+            start = int(text)
+            stop = start + 1
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected A:B, got {text!r}")
+    if stop <= start:
+        raise argparse.ArgumentTypeError(f"empty frame range {text!r}")
+    return range(start, stop)
+
+
+def parse_point(text: str) -> tuple[Decimal, Decimal]:
+    # Exact, for deep zooms.
+    try:
+        x, y = map(Decimal, text.split(","))
+    except (ValueError, ArithmeticError):
+        raise argparse.ArgumentTypeError(f"expected X,Y, got {text!r}")
+    if not (x.is_finite() and y.is_finite()):
+        raise argparse.ArgumentTypeError(f"expected X,Y, got {text!r}")
+    return x, y
+
+
+def parse_assignment(text: str) -> tuple[str, UniformValue]:
+    name, sep, value = text.partition("=")
+    if not sep or not name:
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE, got {text!r}")
+    try:
+        parts = tuple(map(float, value.split(",")))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"bad value {value!r}")
+    return name, parts if len(parts) > 1 else parts[0]
+
+
+def parse_axis(text: str) -> Axis:
+    name, sep, bounds = text.partition("=")
+    try:
+        lo, hi = map(float, bounds.split(":"))
+    except ValueError:
+        sep = ""
+    if not sep or not name:
+        raise argparse.ArgumentTypeError(
+            f"expected NAME=FROM:TO, got {text!r}"
+        )
+    return name, lo, hi
+
+
+def add_view_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--center",
+        type=parse_point,
+        default=(Decimal(0), Decimal(0)),
+        metavar="X,Y",
+        help="view center (default: 0,0)",
+    )
+    parser.add_argument(
+        "--zoom",
+        type=float,
+        default=1.0,
+        help="value of machuchu_z (default: 1)",
+    )
+    parser.add_argument(
+        "--set",
+        type=parse_assignment,
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="set a uniform, vectors are comma-separated",
+    )
+    parser.add_argument(
+        "--freeze",
+        type=parse_assignment,
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="compile a uniform in as a constant, which lets the driver "
+        "unroll loops and drop branches depending on it",
+    )
+
+
+def make_coord(args: argparse.Namespace) -> CoordUniform:
+    coord = CoordUniform()
+    coord.center_origin = args.center
+    coord.z = (math.log(args.zoom, 1.1), 0.0, 0.0)
+    return coord
+
+
+def make_writer(args: argparse.Namespace) -> FrameWriter:
+    if args.pipe:
+        return PipeWriter(args.pipe, args.size, args.fps, args.queue)
+    return FileWriter(
+        args.output, args.format, args.threads, args.queue, args.drop
+    )
+
+
+def load(args: argparse.Namespace) -> Renderer:
+    prep = Preprocessor(args.file)
+    renderer = Renderer(None if args.no_cache else ProgramCache())
+    text = prep.freeze(dict(args.freeze)) if args.freeze else prep.text
+    renderer.setFragmentShader(text, prep.version, os.path.dirname(args.file))
+    for name, value in args.set:
+        renderer.setUniform(name, value)
+    return renderer
+
+
+def make_accumulator(
+    args: argparse.Namespace, renderer: Renderer
+) -> Accumulator | None:
+    if not args.supersample and not args.samples:
+        return None
+    return Accumulator(
+        renderer, args.supersample or 1, args.samples, args.variance
+    )
+
+
+def render_frames(args: argparse.Namespace, renderer: Renderer) -> None:
+    # float targets keep EXR output free of 8-bit banding
+    internalFormat = GL.GL_RGBA32F if args.format == "exr" else GL.GL_RGBA8
+    target = Target(*args.size, internalFormat)
+    writer = make_writer(args)
+    accumulator = make_accumulator(args, renderer)
+    start = time.perf_counter()
+    try:
+        for frame in renderFrames(
+            renderer,
+            target,
+            make_coord(args),
+            args.frames,
+            args.fps,
+            writer,
+            accumulator.render if accumulator else None,
+        ):
+            print(
+                f"\r{frame - args.frames.start + 1}/{len(args.frames)}"
+                f" ({writer.stats})",
+                end="",
+                file=sys.stderr,
+            )
+    finally:
+        try:
+            writer.close()
+        finally:
+            target.delete()
+            if accumulator is not None:
+                accumulator.delete()
+    elapsed = time.perf_counter() - start
+    print(
+        f"\n{len(args.frames)} frames in {elapsed:.2f}s: {writer.stats}",
+        file=sys.stderr,
+    )
+
+
+def frame_worker(args: argparse.Namespace) -> typing.Callable[[range], int]:
+    # Set up in each --jobs worker process: a context, the shader and a
+    # target that live as long as the process. Frames are written by a
+    # single encoder thread unless --threads says otherwise, the other
+    # workers keep the cores busy.
+    context = headless.HeadlessContext()
+    renderer = load(args)  # errors are reported by the coordinator
+    internalFormat = GL.GL_RGBA32F if args.format == "exr" else GL.GL_RGBA8
+    target = Target(*args.size, internalFormat)
+    accumulator = make_accumulator(args, renderer)
+
+    def render(frames: range) -> int:
+        context.makeCurrent()
+        writer = FileWriter(
+            args.output, args.format, args.threads or 1, args.queue, args.drop
+        )
+        try:
+            for _ in renderFrames(
+                renderer,
+                target,
+                make_coord(args),
+                frames,
+                args.fps,
+                writer,
+                accumulator.render if accumulator else None,
+            ):
+                pass
+        finally:
+            writer.close()
+        return writer.stats.written
+
+    return render
+
+
+def render_parallel(args: argparse.Namespace) -> None:
+    start = time.perf_counter()
+
+    def progress(done: int, total: int) -> None:
+        print(f"\r{done}/{total}", end="", file=sys.stderr)
+
+    written = renderParallel(
+        functools.partial(frame_worker, args),
+        args.frames,
+        args.jobs,
+        args.chunk,
+        args.retries,
+        progress,
+        (MyGL.ShaderCompilationError,),
+    )
+    elapsed = time.perf_counter() - start
+    print(
+        f"\n{len(args.frames)} frames in {elapsed:.2f}s on {args.jobs} "
+        f"workers, {written} written",
+        file=sys.stderr,
+    )
+
+
+def render_sweep(args: argparse.Namespace, renderer: Renderer) -> None:
+    if args.lhs:
+        samples = latinHypercube(args.sweep, args.lhs, args.seed)
+    else:
+        samples = gridSamples(args.sweep, args.steps)
+    start = time.perf_counter()
+    image, index = renderSweep(
+        renderer,
+        make_coord(args),
+        samples,
+        args.size,
+        args.columns,
+        args.frames.start * 1000.0 / args.fps,
+    )
+    indexName = writeSheet(
+        args.sheet,
+        image,
+        index,
+        {
+            "shader": args.file,
+            "axes": [list(axis) for axis in args.sweep],
+            "sampling": f"lhs {args.lhs}"
+            if args.lhs
+            else f"grid {args.steps}",
+            "cell": list(args.size),
+        },
+    )
+    elapsed = time.perf_counter() - start
+    height, width, _ = image.shape
+    print(
+        f"{len(samples)} cells, {width}x{height} in {elapsed:.2f}s: "
+        f"{args.sheet}, {indexName}",
+        file=sys.stderr,
+    )
+
+
+def render_tiled(args: argparse.Namespace, renderer: Renderer) -> None:
+    if renderer.deepZoom is not None:
+        sys.exit("deep zoom shaders can't be rendered in tiles")
+    size = args.tile or min(2048, maxTileSize())
+    if os.path.splitext(args.tiled)[1].lower() in TIFF_EXTENSIONS:
+        size -= size % 16  # TIFF tiles come in multiples of 16
+    image = openImage(args.tiled, args.size, (size, size))
+    count = image.columns * image.rows
+    accumulator = make_accumulator(args, renderer)
+    start = time.perf_counter()
+    for index in renderTiled(
+        renderer,
+        make_coord(args),
+        args.frames.start * 1000.0 / args.fps,
+        image,
+        accumulator.render if accumulator else None,
+    ):
+        print(f"\rtile {index + 1}/{count}", end="", file=sys.stderr)
+    if accumulator is not None:
+        accumulator.delete()
+    elapsed = time.perf_counter() - start
+    print(
+        f"\n{args.size[0]}x{args.size[1]} in {count} {size}x{size} tiles, "
+        f"{elapsed:.2f}s",
+        file=sys.stderr,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="machuchu render",
+        description="Render a shader to PNG files without a window.",
+    )
+    parser.add_argument("file", help="fragment shader")
+    parser.add_argument(
+        "--size", type=parse_size, default=(800, 600), metavar="WxH"
+    )
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument(
+        "--frames", type=parse_frames, default=range(0, 1), metavar="A:B"
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default="render",
+        metavar="DIR",
+        help="output directory (default: ./render)",
+    )
+    parser.add_argument("--format", choices=FORMATS, default="png")
+    parser.add_argument(
+        "--pipe",
+        metavar="COMMAND",
+        help="write raw RGBA frames to COMMAND's stdin instead of files, "
+        "{width}, {height} and {fps} are substituted",
+    )
+    parser.add_argument(
+        "--threads", type=int, default=None, help="encoder threads"
+    )
+    parser.add_argument(
+        "--queue", type=int, default=None, help="frames in flight"
+    )
+    parser.add_argument(
+        "--drop",
+        action="store_true",
+        help="drop frames instead of waiting when encoders fall behind",
+    )
+    parser.add_argument(
+        "--tiled",
+        metavar="FILE",
+        help="render frame A as one still into FILE (.tif, .npy or .raw) "
+        "tile by tile, for sizes beyond the GL limits",
+    )
+    parser.add_argument(
+        "--tile", type=int, default=None, help="tile size for --tiled"
+    )
+    parser.add_argument(
+        "--supersample",
+        type=int,
+        default=None,
+        metavar="N",
+        help="average N*N jittered samples per pixel",
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=None,
+        help="samples per pixel (default: N*N)",
+    )
+    parser.add_argument(
+        "--variance",
+        type=float,
+        default=None,
+        help="stop sampling once the mean per-pixel variance is below this",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="don't use or fill the program binary cache",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="write per-frame CPU and GPU timings to FILE (.json or .csv)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="render frames in N worker processes, each with its own "
+        "context (file output only)",
+    )
+    parser.add_argument(
+        "--chunk",
+        type=int,
+        default=None,
+        help="frames per work item with --jobs",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=2,
+        help="times a failed chunk is rendered again with --jobs",
+    )
+    parser.add_argument(
+        "--sweep",
+        type=parse_axis,
+        action="append",
+        metavar="NAME=FROM:TO",
+        help="render frame A once per uniform setting into the cells of a "
+        "contact sheet of --size cells, repeatable",
+    )
+    parser.add_argument(
+        "--steps", type=int, default=5, help="grid values per --sweep axis"
+    )
+    parser.add_argument(
+        "--lhs",
+        type=int,
+        default=None,
+        metavar="N",
+        help="N Latin hypercube samples instead of a grid",
+    )
+    parser.add_argument("--seed", type=int, default=None, help="for --lhs")
+    parser.add_argument(
+        "--columns", type=int, default=None, help="cells per sheet row"
+    )
+    parser.add_argument(
+        "--sheet",
+        default="sweep.png",
+        metavar="FILE",
+        help="contact sheet for --sweep, the index goes next to it as .json",
+    )
+    add_view_arguments(parser)
+    args = parser.parse_args()
+    if args.jobs > 1 and (args.pipe or args.tiled or args.profile):
+        parser.error("--jobs can't be used with --pipe, --tiled or --profile")
+    if args.tile is not None and args.tile < 16:
+        parser.error("--tile must be at least 16")
+
+    if not args.pipe and not args.tiled and not args.sweep:
+        os.makedirs(args.output, exist_ok=True)
+    if args.jobs > 1:
+        # compile errors and missing includes fail here once, rather
+        # than in every worker
+        context = headless.HeadlessContext()
+        try:
+            renderer = load(args)
+            feedback = renderer.usesFeedback()
+            renderer.delete()
+        except MyGL.ShaderCompilationError as e:
+            print(e.text, file=sys.stderr)
+            sys.exit(1)
+        except (OSError, ValueError) as e:
+            sys.exit(str(e))
+        finally:
+            context.destroy()
+        if feedback:
+            # every chunk would start over from a black machuchu_tex
+            parser.error("--jobs can't render feedback shaders")
+        try:
+            render_parallel(args)
+        except MyGL.ShaderCompilationError as e:
+            print(e.text, file=sys.stderr)
+            sys.exit(1)
+        except RuntimeError as e:
+            sys.exit(str(e))
+        return
+    context = headless.HeadlessContext()
+    print(context.describe(), file=sys.stderr)
+    try:
+        try:
+            renderer = load(args)
+        except MyGL.ShaderCompilationError as e:
+            print(e.text, file=sys.stderr)
+            sys.exit(1)
+        except (OSError, ValueError) as e:  # bad pragma or texture
+            sys.exit(str(e))
+        if args.profile:
+            renderer.profiler.start(trace=True)
+        if args.sweep:
+            try:
+                render_sweep(args, renderer)
+            except ValueError as e:
+                sys.exit(str(e))
+        elif args.tiled:
+            render_tiled(args, renderer)
+        else:
+            render_frames(args, renderer)
+        if args.profile:
+            renderer.profiler.flush()
+            renderer.profiler.dump(args.profile)
+            print(renderer.profiler.summary(), file=sys.stderr)
+        renderer.delete()
+        print(f"GL objects left: {resources.tracker}", file=sys.stderr)
+    finally:
+        context.destroy()
+
+
+if __name__ == "__main__":
+    main()
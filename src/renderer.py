@@ -0,0 +1,721 @@
+import re
+import typing
+import numpy as np
+from OpenGL import GL
+import MyGL
+from coord import CoordUniform
+from deepzoom import DeepZoom
+from graph import FILTERS, FORMATS, PassSpec, RenderGraph, parseGraph
+from output import FrameWriter
+from profiler import Profiler
+from progcache import LinkedPrograms, ProgramCache, sourceKey
+from resources import textureBytes, tracker
+from readback import PixelReadback
+from textures import TextureCache, TextureRequest, TextureSpec, parseTextures
+from uniforms import UniformStore, UniformValue, ViewBlock
+
+# Shared between the Qt viewer and the offscreen renderer. Nothing in this
+# module depends on Qt, the caller only has to make a GL context current.
+
+vertexShaderData = """
+    // #version 150 / #version 300 es
+    in vec2 machuchu_position;
+    out vec2 p;
+    out vec2 machuchu_pos;
+
+    layout(std140) uniform machuchu_view {
+        float machuchu_x;
+        float machuchu_y;
+        float machuchu_z;
+        float machuchu_aspect;
+    };
+
+    void main() {
+        gl_Position = vec4(machuchu_position, 0., 1.);
+        machuchu_pos = machuchu_position * 0.5 + vec2(0.5);
+
+        p = machuchu_position;
+        p.x *= machuchu_aspect;
+        p /= machuchu_z;
+        p.x += machuchu_x;
+        p.y += machuchu_y;
+    }
+"""
+
+POSITION_LOCATION = 0
+
+_QUAD = np.array([-1, -1, 1, -1, -1, 1, 1, 1], np.float32)
+
+
+# `#pragma machuchu feedback FORMAT [FILTER]` picks the format of the
+# textures behind machuchu_tex, e.g. rgba32f for simulation state, and how
+# they are sampled.
+_FEEDBACK_PRAGMA = re.compile(
+    r"^\s*#\s*pragma\s+machuchu\s+feedback\b(.*)$", re.M
+)
+
+FeedbackFormat = tuple[int, int]  # internal format, filter
+DEFAULT_FEEDBACK: FeedbackFormat = (GL.GL_RGBA8, GL.GL_NEAREST)
+
+
+def feedbackFormat(shader: str) -> FeedbackFormat:
+    m = _FEEDBACK_PRAGMA.search(shader)
+    if m is None:
+        return DEFAULT_FEEDBACK
+    params = m[1].lower().split() + ["nearest"]
+    if len(params) > 3 or params[0] not in FORMATS:
+        raise ValueError(f"bad pragma: {m[0].strip()}")
+    if params[1] not in FILTERS:
+        raise ValueError(f"bad pragma: {m[0].strip()}")
+    return FORMATS[params[0]], FILTERS[params[1]]
+
+
+def vertexShaderSource(version: list[str] | None) -> str:
+    if version is not None and version[1:2] == ["es"]:
+        return "#version 300 es\n" + vertexShaderData
+    return "#version 150\n" + vertexShaderData
+
+
+class PendingProgram:
+    # A program whose compile and link were issued but may still be
+    # running in the driver's threads.
+
+    def __init__(
+        self,
+        shaders: list[int],
+        program: int,
+        parallel: bool,
+        cache: ProgramCache | None = None,
+        key: str | None = None,
+        source: str = "",
+    ) -> None:
+        self.shaders = shaders
+        self.program = program
+        self.parallel = parallel
+        self.feedback = DEFAULT_FEEDBACK
+        # the other passes of a multi-pass shader, see graph.py; specs
+        # has the output pass last
+        self.specs: list[PassSpec] = []
+        self.passes: list[PendingProgram] = []
+        self.passPrograms: list[int] = []
+        self.passKeys: list[str] = []
+        # images of `#pragma machuchu texture`, decoding meanwhile
+        self.textures: list[tuple[TextureSpec, TextureRequest]] = []
+        self._cache = cache
+        self._key = key
+        self.sourceKey = source  # see LinkedPrograms
+
+    def ready(self) -> bool:
+        # Without parallel compilation there's no way to tell, result()
+        # will block.
+        if not all(pending.ready() for pending in self.passes):
+            return False
+        if not all(request.done() for _, request in self.textures):
+            return False
+        return not self.parallel or MyGL.completed(self.program)
+
+    def result(self) -> int:
+        # The linked program, those of the other passes go to
+        # passPrograms. Raises ShaderCompilationError with the log of the
+        # first failing pass, leaving nothing behind.
+        programs: list[int] = []
+        try:
+            for pending in self.passes:
+                programs.append(pending.result())
+        except BaseException:
+            tracker.delete("program", *programs)
+            for pending in self.passes[len(programs) + 1 :]:
+                pending.delete()
+            self.passes = []
+            self._deleteShaders()
+            tracker.delete("program", self.program)
+            raise
+        try:
+            program = self._result()
+        except BaseException:
+            tracker.delete("program", *programs)
+            raise
+        finally:
+            self.passKeys = [pending.sourceKey for pending in self.passes]
+            self.passes = []
+        self.passPrograms = programs
+        return program
+
+    def _result(self) -> int:
+        try:
+            for shader in self.shaders:
+                MyGL.checkShader(shader)
+        except MyGL.ShaderCompilationError:
+            tracker.delete("program", self.program)
+            raise
+        finally:
+            self._deleteShaders()
+        program = MyGL.checkProgram(self.program)
+        if self._cache is not None and self._key is not None:
+            self._cache.store(self._key, program)
+        return program
+
+    def delete(self) -> None:
+        for pending in self.passes:
+            pending.delete()
+        self.passes = []
+        self._deleteShaders()
+        tracker.delete("program", self.program)
+
+    def _deleteShaders(self) -> None:
+        tracker.delete("shader", *self.shaders)
+        self.shaders = []
+
+
+def startProgram(
+    shader: str,
+    version: list[str] | None,
+    cache: ProgramCache | None = None,
+    parallel: bool = False,
+    linked: LinkedPrograms | None = None,
+) -> PendingProgram:
+    vertexSource = vertexShaderSource(version)
+    source = sourceKey(vertexSource, shader)
+    program = linked.take(source) if linked is not None else None
+    if program is not None:
+        return PendingProgram([], program, False, source=source)
+    key = None
+    if cache is not None and cache.supported():
+        key = cache.key(vertexSource, shader)
+        program = cache.load(key)
+        if program is not None:
+            return PendingProgram([], program, False, source=source)
+    shaders = [
+        MyGL.startShader(vertexSource, GL.GL_VERTEX_SHADER),
+        MyGL.startShader(shader, GL.GL_FRAGMENT_SHADER),
+    ]
+    program = MyGL.startLink(
+        *shaders,
+        attributes={"machuchu_position": POSITION_LOCATION},
+        retrievable=key is not None,
+    )
+    return PendingProgram(shaders, program, parallel, cache, key, source)
+
+
+def buildProgram(
+    shader: str,
+    version: list[str] | None,
+    cache: ProgramCache | None = None,
+) -> int:
+    return startProgram(shader, version, cache).result()
+
+
+_passVertexShader = """
+    #version 150
+    in vec2 machuchu_position;
+    void main() {
+        gl_Position = vec4(machuchu_position, 0., 1.);
+    }
+"""
+
+
+def buildPassProgram(shader: str, outputs: list[str]) -> int:
+    # Programs for internal full-screen passes, drawn with drawQuad().
+    shaders: list[int] = []
+    try:
+        shaders.append(
+            MyGL.compileShader(_passVertexShader, GL.GL_VERTEX_SHADER)
+        )
+        shaders.append(MyGL.compileShader(shader, GL.GL_FRAGMENT_SHADER))
+        return MyGL.linkProgram(
+            *shaders,
+            attributes={"machuchu_position": POSITION_LOCATION},
+            outputs={name: i for i, name in enumerate(outputs)},
+        )
+    finally:
+        tracker.delete("shader", *shaders)
+
+
+class Target:
+    # Offscreen color target, used for rendering to files.
+
+    def __init__(
+        self, width: int, height: int, internalFormat: int = GL.GL_RGBA8
+    ) -> None:
+        self.size = (width, height)
+        self.dtype: type = np.uint8
+        if internalFormat in (GL.GL_RGBA16F, GL.GL_RGBA32F):
+            self.dtype = np.float32
+        self.fbo = tracker.track("framebuffer", GL.glGenFramebuffers(1))
+        self.texture = tracker.track(
+            "texture",
+            GL.glGenTextures(1),
+            textureBytes(self.size, internalFormat),
+        )
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture)
+        for param in (GL.GL_TEXTURE_MIN_FILTER, GL.GL_TEXTURE_MAG_FILTER):
+            GL.glTexParameteri(GL.GL_TEXTURE_2D, param, GL.GL_NEAREST)
+        GL.glTexImage2D(
+            GL.GL_TEXTURE_2D,
+            0,
+            internalFormat,
+            width,
+            height,
+            0,
+            GL.GL_RGBA,
+            GL.GL_UNSIGNED_BYTE,
+            None,
+        )
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self.fbo)
+        GL.glFramebufferTexture2D(
+            GL.GL_FRAMEBUFFER,
+            GL.GL_COLOR_ATTACHMENT0,
+            GL.GL_TEXTURE_2D,
+            self.texture,
+            0,
+        )
+        status = GL.glCheckFramebufferStatus(GL.GL_FRAMEBUFFER)
+        if status != GL.GL_FRAMEBUFFER_COMPLETE:
+            self.delete()
+            raise RuntimeError(
+                f"Can't create a {width}x{height} framebuffer ({status})"
+            )
+
+    def read(self) -> np.ndarray:
+        # Returns top-down RGBA rows, like image files expect them.
+        width, height = self.size
+        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, self.fbo)
+        GL.glPixelStorei(GL.GL_PACK_ALIGNMENT, 1)
+        data = GL.glReadPixels(
+            0, 0, width, height, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE
+        )
+        image = np.frombuffer(data, np.uint8).reshape(height, width, 4)
+        return image[::-1]
+
+    def delete(self) -> None:
+        tracker.delete("framebuffer", self.fbo)
+        tracker.delete("texture", self.texture)
+
+
+class Renderer:
+    # Owns everything needed to draw a machuchu fragment shader: the
+    # program, its uniforms, the view block, the quad and the feedback
+    # textures behind machuchu_tex.
+    #
+    # Feedback shaders ping-pong between two textures: each frame samples
+    # the previous one through machuchu_tex and renders into the other,
+    # which is then blitted to the caller's framebuffer. The state keeps
+    # the textures' format instead of the target's.
+
+    def __init__(self, programCache: ProgramCache | None = None) -> None:
+        self.programCache = programCache
+        self.parallel = MyGL.parallelCompile()
+        self.profiler = Profiler()
+        self.program: int | None = None
+        self.programKey = ""
+        # replaced programs, for switching back without compiling
+        self.linked = LinkedPrograms()
+        self.uniformStore: UniformStore | None = None
+        self.viewBlock = ViewBlock()
+        self.graph: RenderGraph | None = None
+        self.textureCache = TextureCache()
+        # uniform, texture unit, texture, sampler
+        self.textures: list[tuple[str, int, int, int]] = []
+        # kept across programs, so reloads don't recompute the orbit
+        self.deepZoom: DeepZoom | None = None
+        self.size = (1, 1)
+
+        # one static quad for the lifetime of the renderer, every program
+        # binds machuchu_position to the same location
+        self._vao = tracker.track("vertexarray", GL.glGenVertexArrays(1))
+        GL.glBindVertexArray(self._vao)
+        self._vbo = tracker.track("buffer", GL.glGenBuffers(1), _QUAD.nbytes)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self._vbo)
+        GL.glBufferData(
+            GL.GL_ARRAY_BUFFER, _QUAD.nbytes, _QUAD, GL.GL_STATIC_DRAW
+        )
+        GL.glEnableVertexAttribArray(POSITION_LOCATION)
+        GL.glVertexAttribPointer(
+            POSITION_LOCATION, 2, GL.GL_FLOAT, GL.GL_FALSE, 0, None
+        )
+        GL.glBindVertexArray(0)
+
+        self.feedback = DEFAULT_FEEDBACK
+        self._current = 0  # the texture the next frame renders into
+        self._createFeedback()
+        self._clearFeedback()
+
+    def resize(self, width: int, height: int, resample: bool = False) -> None:
+        # Feedback starts over from black, unless `resample`: then the
+        # old frames are stretched to the new size, for changes of the
+        # rendering scale rather than the window.
+        oldSize = self.size
+        self.size = (width, height)
+        if resample and oldSize != self.size:
+            fbos, textures = self._fbos, self._textures
+            self._createFeedback()
+            for source, target in zip(fbos, self._fbos):
+                MyGL.resample(source, oldSize, target, self.size)
+            tracker.delete("framebuffer", *fbos)
+            tracker.delete("texture", *textures)
+        else:
+            self._allocateFeedback()
+            self._clearFeedback()
+        if self.graph is not None:
+            self.graph.resize(self.size, resample)
+
+    def setFeedbackFormat(self, feedback: FeedbackFormat) -> None:
+        if feedback != self.feedback:
+            self.feedback = feedback
+            self._allocateFeedback()
+            self._clearFeedback()
+
+    def _createFeedback(self) -> None:
+        self._fbos = [
+            tracker.track("framebuffer", fbo)
+            for fbo in GL.glGenFramebuffers(2)
+        ]
+        self._textures = [
+            tracker.track("texture", texture)
+            for texture in GL.glGenTextures(2)
+        ]
+        for texture in self._textures:
+            GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
+            for param in (GL.GL_TEXTURE_WRAP_S, GL.GL_TEXTURE_WRAP_T):
+                GL.glTexParameteri(GL.GL_TEXTURE_2D, param, GL.GL_REPEAT)
+        self._allocateFeedback()
+        for fbo, texture in zip(self._fbos, self._textures):
+            GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, fbo)
+            GL.glFramebufferTexture2D(
+                GL.GL_FRAMEBUFFER,
+                GL.GL_COLOR_ATTACHMENT0,
+                GL.GL_TEXTURE_2D,
+                texture,
+                0,
+            )
+
+    def _allocateFeedback(self) -> None:
+        internalFormat, filter = self.feedback
+        float_ = internalFormat != GL.GL_RGBA8
+        for texture in self._textures:
+            tracker.track(
+                "texture", texture, textureBytes(self.size, internalFormat)
+            )
+            GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
+            for param in (GL.GL_TEXTURE_MIN_FILTER, GL.GL_TEXTURE_MAG_FILTER):
+                GL.glTexParameteri(GL.GL_TEXTURE_2D, param, filter)
+            GL.glTexImage2D(
+                GL.GL_TEXTURE_2D,
+                0,
+                internalFormat,
+                *self.size,
+                0,
+                GL.GL_RGBA,
+                GL.GL_FLOAT if float_ else GL.GL_UNSIGNED_BYTE,
+                None,
+            )
+
+    def _clearFeedback(self) -> None:
+        GL.glClearColor(0.0, 0.0, 0.0, 0.0)
+        for fbo in self._fbos:
+            GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, fbo)
+            GL.glClear(GL.GL_COLOR_BUFFER_BIT)
+
+    def startFragmentShader(
+        self, shader: str, version: list[str] | None, directory: str = ""
+    ) -> PendingProgram:
+        # The current program keeps drawing until finishProgram() is
+        # called with the result. Texture paths are relative to
+        # `directory`, the shader file's.
+        feedback = feedbackFormat(shader)
+        textures = parseTextures(shader, directory)
+        requests = [self.textureCache.request(t.path) for t in textures]
+        specs = parseGraph(shader)
+        if specs:
+            shader = specs[-1].source
+        pending = startProgram(
+            shader, version, self.programCache, self.parallel, self.linked
+        )
+        pending.feedback = feedback
+        pending.textures = list(zip(textures, requests))
+        pending.specs = specs
+        pending.passes = [
+            startProgram(
+                spec.source,
+                version,
+                self.programCache,
+                self.parallel,
+                self.linked,
+            )
+            for spec in specs[:-1]
+        ]
+        return pending
+
+    def setFragmentShader(
+        self, shader: str, version: list[str] | None, directory: str = ""
+    ) -> None:
+        self.finishProgram(
+            self.startFragmentShader(shader, version, directory)
+        )
+
+    def finishProgram(self, pending: PendingProgram) -> None:
+        # Raises ShaderCompilationError, or OSError and ValueError for
+        # unreadable textures; the current program stays then.
+        textures: list[int] = []
+        try:
+            for spec, request in pending.textures:
+                textures.append(
+                    self.textureCache.acquire(request, spec.mipmap)
+                )
+        except BaseException:
+            pending.delete()
+            for texture in textures:
+                self.textureCache.release(texture)
+            raise
+        try:
+            program = pending.result()
+        except BaseException:
+            for texture in textures:
+                self.textureCache.release(texture)
+            raise
+        self.setProgram(program, pending.feedback, pending.sourceKey)
+        if pending.specs:
+            self.setGraph(
+                RenderGraph(
+                    pending.specs, pending.passPrograms, pending.passKeys
+                )
+            )
+            self.graph.bindOutput(self.uniformStore)  # type: ignore
+        # units after those of the passes' bindings
+        first = 1 + max((len(s.bindings) for s in pending.specs), default=0)
+        for unit, ((spec, _), texture) in enumerate(
+            zip(pending.textures, textures), first
+        ):
+            self.textures.append((spec.name, unit, texture, spec.sampler()))
+            for store in self.stores():
+                store.set(spec.name, unit)
+        assert self.uniformStore is not None
+        if "machuchu_orbit" in self.uniformStore:
+            if self.deepZoom is None:
+                self.deepZoom = DeepZoom()
+            self.deepZoom.unit = first + len(self.textures)
+            self.uniformStore.set("machuchu_orbit", self.deepZoom.unit)
+        elif self.deepZoom is not None:
+            self.deepZoom.delete()
+            self.deepZoom = None
+
+    def setGraph(self, graph: RenderGraph | None) -> None:
+        # Takes ownership of `graph`, the previous one is deleted.
+        if self.graph is not None:
+            self.graph.delete(self.linked)
+        self.graph = graph
+        if graph is not None:
+            graph.resize(self.size)
+
+    def setProgram(
+        self,
+        program: int,
+        feedback: FeedbackFormat = DEFAULT_FEEDBACK,
+        source: str = "",
+    ) -> None:
+        # Takes ownership of `program`, the previous one is deleted
+        # along with its passes and textures. Programs with a `source`
+        # key go to self.linked instead.
+        self.setFeedbackFormat(feedback)
+        self.setGraph(None)
+        self.releaseTextures()
+        GL.glUseProgram(program)
+        if self.program is not None and self.program != program:
+            if self.programKey:
+                self.linked.put(self.programKey, self.program)
+            else:
+                tracker.delete("program", self.program)
+        self.program = program
+        self.programKey = source
+        self.uniformStore = UniformStore(program)
+        ViewBlock.attach(program)
+        if "machuchu_tex" in self.uniformStore:
+            self.uniformStore.set("machuchu_tex", 0)
+
+    def releaseTextures(self) -> None:
+        # They stay in the cache for the next shader.
+        for _, _, texture, sampler in self.textures:
+            self.textureCache.release(texture)
+            tracker.delete("sampler", sampler)
+        self.textures = []
+
+    def setUniform(self, name: str, value: UniformValue) -> None:
+        # Only updates the shadow copies, uploads happen once per frame
+        # in draw().
+        if name in self.viewBlock:
+            self.viewBlock.set(name, value)
+            return
+        if self.uniformStore is not None:
+            self.uniformStore.set(name, value)
+        if self.graph is not None:
+            self.graph.setUniform(name, value)
+
+    def setView(self, coord: CoordUniform, wait: bool = True) -> None:
+        # The view uniforms, and for deep zoom shaders the reference
+        # orbit, which without `wait` may lag behind while it is
+        # computed.
+        for name, value in coord.items():
+            self.setUniform(name, value)
+        if self.deepZoom is not None and self.uniformStore is not None:
+            self.deepZoom.setView(coord, self.uniformStore, wait)
+
+    def stores(self) -> list[UniformStore]:
+        # Those of all passes, the output pass first.
+        stores = [self.uniformStore] if self.uniformStore else []
+        if self.graph is not None:
+            stores += self.graph.stores()
+        return stores
+
+    def boundSamplers(self) -> set[str]:
+        # Sampler uniforms set by the renderer rather than the user.
+        names = {name for name, _, _, _ in self.textures}
+        if self.graph is not None:
+            names.update(name for name, _, _ in self.graph.outputBindings)
+            for p in self.graph.passes:
+                names.update(name for name, _ in p.spec.bindings)
+        return names
+
+    def stateKey(self) -> tuple:
+        # Equal keys mean the same image, unless the shader reads
+        # machuchu_tex.
+        store = self.uniformStore
+        return (
+            self.program,
+            self.size,
+            self.viewBlock.key(),
+            store.key() if store is not None else None,
+            self.graph.key() if self.graph is not None else None,
+            tuple(self.textures),
+        )
+
+    def delete(self) -> None:
+        self.setGraph(None)
+        self.releaseTextures()
+        self.textureCache.delete()
+        if self.deepZoom is not None:
+            self.deepZoom.delete()
+            self.deepZoom = None
+        if self.program is not None:
+            tracker.delete("program", self.program)
+            self.program = None
+            self.uniformStore = None
+        self.linked.delete()
+        self.viewBlock.delete()
+        self.profiler.delete()
+        tracker.delete("vertexarray", self._vao)
+        tracker.delete("buffer", self._vbo)
+        tracker.delete("framebuffer", *self._fbos)
+        tracker.delete("texture", *self._textures)
+
+    def drawQuad(self) -> None:
+        GL.glBindVertexArray(self._vao)
+        GL.glDrawArrays(GL.GL_TRIANGLE_STRIP, 0, 4)
+
+    def animated(self) -> bool:
+        # Whether the picture can change with nothing but time passing.
+        return self.usesFeedback() or any(
+            "time" in store for store in self.stores()
+        )
+
+    def usesFeedback(self) -> bool:
+        # Whether frames depend on earlier ones.
+        return (
+            self.uniformStore is not None
+            and "machuchu_tex" in self.uniformStore
+        ) or (self.graph is not None and self.graph.feedback)
+
+    def draw(self, framebuffer: int, origin: tuple[int, int] = (0, 0)) -> None:
+        # `origin` places the picture inside a larger framebuffer.
+        if self.program is None:
+            return
+        assert self.uniformStore is not None
+
+        GL.glUseProgram(self.program)
+        with self.profiler.cpu("uniforms"):
+            self.uniformStore.flush()
+            self.viewBlock.flush()
+        for _, unit, texture, sampler in self.textures:
+            GL.glActiveTexture(GL.GL_TEXTURE0 + unit)
+            GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
+            GL.glBindSampler(unit, sampler)
+        GL.glActiveTexture(GL.GL_TEXTURE0)
+        try:
+            self._draw(framebuffer, origin)
+        finally:
+            # the units are free for others between frames, e.g. the
+            # accumulator's, which sample with their textures' parameters
+            for _, unit, _, _ in self.textures:
+                GL.glBindSampler(unit, 0)
+
+    def _draw(self, framebuffer: int, origin: tuple[int, int]) -> None:
+        assert self.uniformStore is not None
+        if self.deepZoom is not None:
+            self.deepZoom.bind()
+        if self.graph is not None:
+            self.graph.run(self.viewBlock, self.drawQuad, self.profiler)
+            GL.glUseProgram(self.program)
+        if "machuchu_tex" not in self.uniformStore:
+            GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, framebuffer)
+            GL.glViewport(*origin, *self.size)
+            with self.profiler.gpu("draw"):
+                self.drawQuad()
+            return
+
+        previous = self._textures[1 - self._current]
+        fbo = self._fbos[self._current]
+        GL.glActiveTexture(GL.GL_TEXTURE0)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, previous)
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, fbo)
+        GL.glViewport(0, 0, *self.size)
+        with self.profiler.gpu("draw"):
+            self.drawQuad()
+        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, fbo)
+        GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, framebuffer)
+        with self.profiler.gpu("present"):
+            width, height = self.size
+            GL.glBlitFramebuffer(
+                0,
+                0,
+                width,
+                height,
+                origin[0],
+                origin[1],
+                origin[0] + width,
+                origin[1] + height,
+                GL.GL_COLOR_BUFFER_BIT,
+                GL.GL_NEAREST,
+            )
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, framebuffer)
+        self._current = 1 - self._current
+
+
+def renderFrames(
+    renderer: Renderer,
+    target: Target,
+    coord: CoordUniform,
+    frames: range,
+    fps: float,
+    writer: FrameWriter,
+    draw: typing.Callable[[int], None] | None = None,
+) -> typing.Iterator[int]:
+    # Frame N is rendered at time N / fps, everything else stays put.
+    # Yields after queueing each frame, so callers can interleave other
+    # work; the caller owns the writer and closes it. `draw` replaces
+    # renderer.draw, e.g. with Accumulator.render for supersampling.
+    draw = draw or renderer.draw
+    oldSize = renderer.size
+    renderer.resize(*target.size)
+    coord.size = target.size
+    readback = PixelReadback(target.size, writer, dtype=target.dtype)
+    try:
+        for frame in frames:
+            renderer.setUniform("time", frame * 1000.0 / fps)
+            renderer.setView(coord)
+            draw(target.fbo)
+            with renderer.profiler.cpu("readback"):
+                readback.read(target.fbo, frame)
+            renderer.profiler.frame()
+            yield frame
+    finally:
+        readback.delete()
+        renderer.resize(*oldSize)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+import headless  # must come before anything that imports OpenGL.GL
+
+import argparse
+import os
+import sys
+import time
+from OpenGL import GL
+import MyGL
+import resources
+from coord import CoordUniform
+from output import FORMATS, FileWriter
+from preprocessor import Preprocessor
+from progcache import ProgramCache
+from readback import PixelReadback
+from renderer import Renderer, Target
+from session import Replayer, Session
+
+# Replays a session recorded in the viewer with F5, step by step as it
+# was recorded, e.g. to profile the same pans and zooms after changing a
+# shader, or to render them as frames at a higher resolution.
+
+
+def scaled(size: tuple[int, int], scale: float) -> tuple[int, int]:
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="machuchu replay",
+        description="Replay a recorded viewer session without a window.",
+    )
+    parser.add_argument("session", help="session file (.jsonl)")
+    parser.add_argument(
+        "--shader",
+        metavar="FILE",
+        help="replay with this shader instead of the recorded one",
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="render at this multiple of the recorded window size",
+    )
+    parser.add_argument(
+        "--every",
+        type=int,
+        default=1,
+        metavar="N",
+        help="draw every Nth step (default: every step, 15 ms apart)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=None,
+        metavar="DIR",
+        help="write the frames drawn to DIR (default: don't write any)",
+    )
+    parser.add_argument("--format", choices=FORMATS, default="png")
+    parser.add_argument(
+        "--threads", type=int, default=None, help="encoder threads"
+    )
+    parser.add_argument(
+        "--queue", type=int, default=None, help="frames in flight"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="don't use or fill the program binary cache",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="write per-frame CPU and GPU timings to FILE (.json or .csv)",
+    )
+    args = parser.parse_args()
+    if args.scale <= 0 or args.every <= 0:
+        parser.error("--scale and --every must be positive")
+
+    try:
+        replayer = Replayer(args.session)
+    except (OSError, ValueError) as e:
+        sys.exit(str(e))
+    fname = args.shader or replayer.header["shader"]
+    if args.output is not None:
+        os.makedirs(args.output, exist_ok=True)
+    context = headless.HeadlessContext()
+    print(context.describe(), file=sys.stderr)
+    try:
+        try:
+            prep = Preprocessor(fname)
+            renderer = Renderer(None if args.no_cache else ProgramCache())
+            renderer.setFragmentShader(
+                prep.text, prep.version, os.path.dirname(fname)
+            )
+        except MyGL.ShaderCompilationError as e:
+            print(e.text, file=sys.stderr)
+            sys.exit(1)
+        except (OSError, ValueError) as e:  # bad pragma or texture
+            sys.exit(str(e))
+        replay(args, replayer, renderer)
+        renderer.delete()
+        print(f"GL objects left: {resources.tracker}", file=sys.stderr)
+    finally:
+        context.destroy()
+
+
+def replay(
+    args: argparse.Namespace, replayer: Replayer, renderer: Renderer
+) -> None:
+    # The view keeps the recorded window size, which is what its pixel
+    # moves are relative to; only the renderer and the target are scaled.
+    coord = CoordUniform()
+    session = Session(coord, renderer.setUniform)
+    replayer.start(session)
+    internalFormat = GL.GL_RGBA32F if args.format == "exr" else GL.GL_RGBA8
+    writer = None
+    if args.output is not None:
+        writer = FileWriter(args.output, args.format, args.threads, args.queue)
+    target: Target | None = None
+    readback: PixelReadback | None = None
+    drawn = 0
+    if args.profile:
+        renderer.profiler.start(trace=True)
+    start = time.perf_counter()
+    try:
+        while not replayer.done(session):
+            replayer.step(session)
+            if session.steps % args.every != 0:
+                continue
+            size = scaled(coord.size, args.scale)
+            if target is None or target.size != size:  # recorded resize
+                if readback is not None:
+                    readback.delete()
+                if target is not None:
+                    target.delete()
+                target = Target(*size, internalFormat)
+                renderer.resize(*size)
+                if writer is not None:
+                    readback = PixelReadback(size, writer, dtype=target.dtype)
+            renderer.setView(coord)
+            renderer.draw(target.fbo)
+            if readback is not None:
+                with renderer.profiler.cpu("readback"):
+                    readback.read(target.fbo, drawn)
+            renderer.profiler.frame()
+            drawn += 1
+            print(
+                f"\rstep {session.steps}/{replayer.length}",
+                end="",
+                file=sys.stderr,
+            )
+    finally:
+        try:
+            if readback is not None:
+                readback.delete()
+            if writer is not None:
+                writer.close()
+        finally:
+            if target is not None:
+                target.delete()
+    elapsed = time.perf_counter() - start
+    stats = f": {writer.stats}" if writer is not None else ""
+    print(
+        f"\n{session.steps} steps, {drawn} frames in {elapsed:.2f}s{stats}",
+        file=sys.stderr,
+    )
+    if args.profile:
+        renderer.profiler.flush()
+        renderer.profiler.dump(args.profile)
+        print(renderer.profiler.summary(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import collections
+from OpenGL import GL
+
+# Bookkeeping of the GL objects we create, so that leaks show up as
+# growing numbers instead of slowly growing driver memory. Everything that
+# creates an object tracks it here and releases it through delete().
+# Sizes are estimates from dimensions and formats, drivers add padding.
+
+_BYTES_PER_PIXEL = {
+    GL.GL_RGBA: 4,
+    GL.GL_RGBA8: 4,
+    GL.GL_R32F: 4,
+    GL.GL_RG32F: 8,
+    GL.GL_RGBA16F: 8,
+    GL.GL_RGBA32F: 16,
+}
+
+_DELETE = {
+    "program": lambda names: [GL.glDeleteProgram(n) for n in names],
+    "shader": lambda names: [GL.glDeleteShader(n) for n in names],
+    "texture": lambda names: GL.glDeleteTextures(len(names), names),
+    "buffer": lambda names: GL.glDeleteBuffers(len(names), names),
+    "framebuffer": lambda names: GL.glDeleteFramebuffers(len(names), names),
+    "vertexarray": lambda names: GL.glDeleteVertexArrays(len(names), names),
+    "query": lambda names: GL.glDeleteQueries(len(names), names),
+    "sampler": lambda names: GL.glDeleteSamplers(len(names), names),
+}
+
+
+def textureBytes(
+    size: tuple[int, int], internalFormat: int, mipmaps: bool = False
+) -> int:
+    nbytes = size[0] * size[1] * _BYTES_PER_PIXEL.get(internalFormat, 4)
+    return nbytes * 4 // 3 if mipmaps else nbytes
+
+
+class ResourceTracker:
+    def __init__(self) -> None:
+        self._objects: dict[tuple[str, int], int] = {}
+
+    def track(self, kind: str, name: int, nbytes: int = 0) -> int:
+        # Also used to update the size of an object already tracked.
+        self._objects[kind, int(name)] = nbytes
+        return name
+
+    def untrack(self, kind: str, name: int) -> None:
+        self._objects.pop((kind, int(name)), None)
+
+    def delete(self, kind: str, *names: int) -> None:
+        names = tuple(n for n in names if n)
+        if not names:
+            return
+        _DELETE[kind](list(names))
+        for name in names:
+            self.untrack(kind, name)
+
+    def counts(self) -> dict[str, int]:
+        return dict(collections.Counter(kind for kind, _ in self._objects))
+
+    def memory(self) -> int:
+        return sum(self._objects.values())
+
+    def __str__(self) -> str:
+        counts = ", ".join(
+            f"{n} {kind}s" for kind, n in sorted(self.counts().items())
+        )
+        return f"{counts or 'nothing'}, {self.memory() / (1 << 20):.1f} MiB"
+
+
+# One per process: the viewer's contexts share their objects, the
+# offscreen renderer has a single context.
+tracker = ResourceTracker()
@@ -0,0 +1,236 @@
+import json
+import typing
+from decimal import Decimal
+from coord import CoordUniform
+from uniforms import UniformValue
+
+# Recorded viewer sessions, to run the same pans, zooms and uniform edits
+# again, e.g. while profiling or to render them offline at a higher
+# resolution. A session file is JSON lines: a header with the shader and
+# the state at the start, then one compact event per input,
+#
+#     [STEP, KIND, ARGS...]
+#
+# and [STEP, "end"] last. STEP counts the view's fixed steps (see
+# CoordUniform.update()) before the input, which is all the view depends
+# on, so replays apply each event before the same step and come out the
+# same however fast either run drew its frames. Time advances by one
+# step per step in replays; in the viewer it follows the clock, replays
+# match recordings made with fixed-step view motion on.
+
+FORMAT_VERSION = 1
+STEP = 15_000_000  # ns, as FixedStep's
+
+
+class Session:
+    # Everything the viewer does to its view, the time uniform and the
+    # shader's uniforms goes through here, so that it can be recorded;
+    # replays take the same path.
+
+    def __init__(
+        self,
+        coord: CoordUniform,
+        setUniform: typing.Callable[[str, UniformValue], None],
+        step: int = STEP,
+    ) -> None:
+        self.coord = coord
+        self.setUniform = setUniform
+        self.step = step  # ns
+        self.steps = 0
+        self.time = 0  # ns
+        self.paused = False
+        self.recording: typing.TextIO | None = None
+        self._kinds: dict[str, typing.Callable[..., None]] = {
+            "add": self.add,
+            "move": self.move,
+            "zoom": self.zoom,
+            "origin": self.origin,
+            "zoom_reset": self.zoomReset,
+            "mouse_down": self.mouseDown,
+            "mouse_move": self.mouseMove,
+            "mouse_up": self.mouseUp,
+            "resize": self.resize,
+            "uniform": self.uniform,
+            "pause": self.pause,
+            "reset_time": self.resetTime,
+        }
+
+    def state(self) -> dict:
+        coord = self.coord
+        x, y = coord.center()
+        return {
+            "step": self.step,
+            "center": [str(x), str(y)],
+            "x": [0.0, *coord.x[1:]],
+            "y": [0.0, *coord.y[1:]],
+            "z": list(coord.z),
+            "size": list(coord.size),
+            "time": self.time,
+            "paused": self.paused,
+        }
+
+    def restore(self, state: dict) -> None:
+        coord = self.coord
+        coord.center_origin = (
+            Decimal(state["center"][0]),
+            Decimal(state["center"][1]),
+        )
+        coord.x = tuple(map(float, state["x"]))  # type: ignore
+        coord.y = tuple(map(float, state["y"]))  # type: ignore
+        coord.z = tuple(map(float, state["z"]))  # type: ignore
+        coord.size = tuple(state["size"])  # type: ignore
+        coord.mouse_pressed = False
+        coord.mouse_i = None
+        coord.mouse_f = coord.mouse_f_start = (float("nan"), float("nan"))
+        self.step = state["step"]
+        self.steps = 0
+        self.paused = state["paused"]
+        self.time = state["time"]
+        self.setUniform("time", self.time / 1e6)
+
+    def startRecording(
+        self, fname: str, shader: str, uniforms: dict[str, UniformValue]
+    ) -> None:
+        # `uniforms` are the values the shader starts with.
+        self.stopRecording()
+        f = open(fname, "w", buffering=1)  # lines survive crashes
+        header = {
+            "machuchu_session": FORMAT_VERSION,
+            "shader": shader,
+            **self.state(),
+            "uniforms": uniforms,
+        }
+        f.write(json.dumps(header) + "\n")
+        self.recording = f
+        self.steps = 0
+
+    def stopRecording(self) -> None:
+        if self.recording is None:
+            return
+        self._record("end")
+        self.recording.close()
+        self.recording = None
+
+    def _record(self, kind: str, *args: typing.Any) -> None:
+        if self.recording is not None:
+            event = json.dumps(
+                [self.steps, kind, *args], separators=(",", ":")
+            )
+            self.recording.write(event + "\n")
+
+    def apply(self, kind: str, *args: typing.Any) -> None:
+        method = self._kinds.get(kind)
+        if method is None:
+            raise ValueError(f"unknown session event {kind!r}")
+        method(*args)
+
+    def add(self, x: float = 0.0, y: float = 0.0, z: float = 0.0) -> None:
+        self._record("add", x, y, z)
+        self.coord.add(x, y, z)
+
+    def move(self, x: float, y: float) -> None:
+        self._record("move", x, y)
+        self.coord.move(x, y)
+
+    def zoom(
+        self, z: float, origin: None | tuple[float, float] = None
+    ) -> None:
+        self._record("zoom", z, origin)
+        self.coord.zoom(z, tuple(origin) if origin else None)  # type: ignore
+
+    def origin(self) -> None:
+        self._record("origin")
+        self.coord.origin()
+
+    def zoomReset(self) -> None:
+        self._record("zoom_reset")
+        self.coord.zoom_reset()
+
+    def mouseDown(self, x: int, y: int) -> None:
+        self._record("mouse_down", x, y)
+        self.coord.mouse_down(x, y)
+
+    def mouseMove(self, x: int, y: int) -> None:
+        self._record("mouse_move", x, y)
+        self.coord.mouse_move(x, y)
+
+    def mouseUp(self) -> None:
+        self._record("mouse_up")
+        self.coord.mouse_up()
+
+    def resize(self, width: int, height: int) -> None:
+        self._record("resize", width, height)
+        self.coord.size = (width, height)
+
+    def uniform(self, name: str, value: UniformValue) -> None:
+        if isinstance(value, list):  # from JSON
+            value = tuple(value)
+        self._record("uniform", name, value)
+        self.setUniform(name, value)
+
+    def pause(self, paused: bool) -> None:
+        self._record("pause", paused)
+        self.paused = paused
+
+    def resetTime(self) -> None:
+        self._record("reset_time")
+        self.time = 0
+        self.setUniform("time", 0.0)
+
+    def advance(self, ns: int) -> None:
+        if not self.paused:
+            self.time += ns
+        self.setUniform("time", self.time / 1e6)
+
+    def update(self) -> None:
+        self.coord.update()
+        self.steps += 1
+
+
+class Replayer:
+    # Feeds a recorded session to a Session one step at a time.
+
+    def __init__(self, fname: str) -> None:
+        # Raises OSError, or ValueError for anything but a session file.
+        with open(fname) as f:
+            lines = f.read().splitlines()
+        try:
+            self.header = json.loads(lines[0])
+            self.events = [json.loads(line) for line in lines[1:] if line]
+        except (IndexError, json.JSONDecodeError):
+            raise ValueError(f"{fname} is not a session")
+        if not isinstance(self.header, dict):
+            raise ValueError(f"{fname} is not a session")
+        version = self.header.get("machuchu_session")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"{fname}: unsupported session version")
+        # a session cut short, e.g. by a crash, ends after its last event
+        self.length = max((event[0] for event in self.events), default=0)
+        self._next = 0
+
+    def start(self, session: Session) -> None:
+        # The state the recording started from; the shader has to be
+        # loaded already.
+        session.restore(self.header)
+        for name, value in self.header["uniforms"].items():
+            session.setUniform(
+                name, tuple(value) if isinstance(value, list) else value
+            )
+        self._next = 0
+
+    def done(self, session: Session) -> bool:
+        return session.steps >= self.length
+
+    def step(self, session: Session) -> None:
+        # Applies the events before the session's next step, then takes
+        # it.
+        while (
+            self._next < len(self.events)
+            and self.events[self._next][0] <= session.steps
+        ):
+            _, kind, *args = self.events[self._next]
+            self._next += 1
+            if kind != "end":
+                session.apply(kind, *args)
+        session.advance(session.step)
+        session.update()
@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+
+import argparse
+import concurrent.futures
+import datetime
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import typing
+import urllib.request
+
+# Shadertoy shaders as machuchu shaders. Shaders come from JSON, either
+# exports or dumps of many shaders at once or the site's API, and are
+# written as wrappers around shader/shadertoy.h: buffers become passes
+# (see graph.py), the image pass is the output. A SQLite catalog next to
+# the files records every imported shader with its author, passes, inputs
+# and hashes, so that re-imports only rewrite what changed and shaders
+# are found by ID or by full-text search over names, authors and tags.
+
+SHADER_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "shader",
+    "shadertoy",
+)
+CATALOG = "catalog.sqlite"
+API = "https://www.shadertoy.com/api/v1/shaders/{id}?key={key}"
+API_KEY = "Bt8K4N"
+
+_ID = re.compile(r"^(?:(?:https?://)?(?:www\.)?shadertoy\.com/view/)?(\w+)/?$")
+
+Shader = dict[str, typing.Any]  # the "Shader" object of the API
+Fetcher = typing.Callable[[str], Shader]
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS shaders (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        author TEXT NOT NULL,
+        date INTEGER,
+        passes INTEGER NOT NULL,
+        inputs TEXT NOT NULL,      -- used input types, comma-separated
+        source_hash TEXT NOT NULL, -- of the shader's JSON
+        file TEXT NOT NULL,        -- relative to the catalog
+        file_hash TEXT NOT NULL    -- of the file as written
+    );
+    CREATE VIRTUAL TABLE IF NOT EXISTS search
+        USING fts5(id UNINDEXED, name, author, tags, description);
+"""
+
+
+def parse_id(text: str) -> str:
+    # An ID or a shadertoy.com/view/ URL.
+    m = _ID.match(text.strip())
+    if m is None:
+        raise argparse.ArgumentTypeError(f"not a shader ID or URL: {text!r}")
+    return m[1]
+
+
+def _hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_name(shader: Shader) -> str:
+    info = shader["info"]
+    name = f"{info['id']}_{info['username']}_{info['name']}"
+    return re.sub(r"[\s/\\:]", "_", name) + ".frag"
+
+
+def _inputs(renderpass: dict) -> list[dict]:
+    # Exports call it "type", the API "ctype".
+    return [
+        {**i, "type": i.get("type") or i.get("ctype")}
+        for i in renderpass.get("inputs", [])
+    ]
+
+
+def used_inputs(shader: Shader) -> list[str]:
+    return sorted(
+        {i["type"] for rp in shader["renderpass"] for i in _inputs(rp)}
+    )
+
+
+def convert(shader: Shader) -> str:
+    # The machuchu shader: common code first, then one pass per buffer
+    # reading the others through `bind`, the image pass last. Inputs
+    # machuchu can't provide are listed in comments.
+    info = shader["info"]
+    passes = shader["renderpass"]
+    date = datetime.datetime.fromtimestamp(
+        int(info.get("date") or 0), datetime.timezone.utc
+    )
+    lines = [
+        f"// Created by {info['username']} in {date.date().isoformat()}",
+        f"// https://www.shadertoy.com/view/{info['id']}",
+        '#include "../shadertoy.h"',
+        "",
+    ]
+    buffers = [rp for rp in passes if rp["type"] == "buffer"]
+    names = {
+        str(out["id"]): re.sub(r"\s", "", rp["name"]).lower()
+        for rp in buffers
+        for out in rp.get("outputs", [])[:1]
+    }
+
+    def channels(rp: dict) -> list[str]:
+        result = []
+        for i in sorted(_inputs(rp), key=lambda i: i["channel"]):
+            name = names.get(str(i["id"]))
+            if i["type"] == "buffer" and name is not None:
+                result.append(
+                    f"#pragma machuchu bind iChannel{i['channel']} {name}"
+                )
+            else:
+                source = i.get("filepath") or i.get("src") or i["id"]
+                result.append(
+                    f"// iChannel{i['channel']}: {i['type']} {source} "
+                    "(not supported)"
+                )
+        return result
+
+    for rp in passes:
+        if rp["type"] == "common":
+            lines.append(rp["code"])
+    for rp in passes:
+        if rp["type"] not in ("common", "buffer", "image"):
+            lines.append(f"// {rp['name']}: {rp['type']} (not supported)")
+    image = next(rp for rp in passes if rp["type"] == "image")
+    if not buffers:
+        lines += channels(image)
+        lines.append(image["code"])
+        return "\n".join(lines) + "\n"
+    for rp in buffers + [image]:
+        name = names.get(str(rp.get("outputs", [{}])[0].get("id")))
+        if rp is image:
+            lines.append("#pragma machuchu pass image")
+        else:
+            lines.append(
+                f"#pragma machuchu pass {name} format=rgba32f filter=linear"
+            )
+        lines += channels(rp)
+        lines.append(rp["code"])
+    return "\n".join(lines) + "\n"
+
+
+def read_export(fname: str) -> list[Shader]:
+    # A single shader, an API response, a list of either, or a dump with
+    # a "Shaders" list; a directory is read file by file.
+    if os.path.isdir(fname):
+        return [
+            shader
+            for entry in sorted(os.listdir(fname))
+            if entry.endswith(".json")
+            for shader in read_export(os.path.join(fname, entry))
+        ]
+    with open(fname, encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("Shaders", [data])
+    shaders = []
+    for item in data:
+        shader = item.get("Shader", item)
+        if "info" not in shader or "renderpass" not in shader:
+            raise ValueError(f"{fname}: not a Shadertoy shader")
+        shaders.append(shader)
+    return shaders
+
+
+def http_fetcher(template: str) -> Fetcher:
+    # `template` has {id} and optionally {key}, e.g. the API's URL or a
+    # local server with one JSON file per shader.
+    def fetch(id: str) -> Shader:
+        url = template.format(id=id, key=API_KEY)
+        with urllib.request.urlopen(url, timeout=30) as response:
+            data = json.load(response)
+        if "Error" in data:
+            raise ValueError(f"{id}: {data['Error']}")
+        return data.get("Shader", data)
+
+    return fetch
+
+
+def directory_fetcher(directory: str) -> Fetcher:
+    # Reads ID.json files, like those of a local mirror.
+    def fetch(id: str) -> Shader:
+        return read_export(os.path.join(directory, id + ".json"))[0]
+
+    return fetch
+
+
+def make_fetcher(source: str | None) -> Fetcher:
+    if source is None:
+        return http_fetcher(API)
+    if os.path.isdir(source):
+        return directory_fetcher(source)
+    return http_fetcher(source)
+
+
+class Catalog:
+    def __init__(self, directory: str = SHADER_DIR) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(directory, CATALOG))
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def get(self, id: str) -> sqlite3.Row | None:
+        return self.db.execute(
+            "SELECT * FROM shaders WHERE id = ?", (id,)
+        ).fetchone()
+
+    def path(self, row: sqlite3.Row) -> str:
+        return os.path.join(self.directory, row["file"])
+
+    def search(self, query: str, limit: int = 20) -> list[sqlite3.Row]:
+        # FTS5 query syntax; plain words must all match, "author: x" etc.
+        # restrict the columns.
+        return self.db.execute(
+            "SELECT shaders.* FROM search JOIN shaders USING (id) "
+            "WHERE search MATCH ? ORDER BY rank LIMIT ?",
+            (query, limit),
+        ).fetchall()
+
+    def _file_hash(self, fname: str) -> str | None:
+        try:
+            with open(os.path.join(self.directory, fname), "rb") as f:
+                return _hash(f.read())
+        except FileNotFoundError:
+            return None
+
+    def add(self, shaders: list[Shader], force: bool = False) -> dict:
+        # Writes what changed in one transaction, returns counts. Files
+        # edited since they were written are kept unless `force`.
+        counts = dict(added=0, updated=0, unchanged=0, kept=0, failed=0)
+        with self.db:
+            for shader in shaders:
+                key = "failed"
+                try:
+                    key = self._add(shader, force)
+                except (KeyError, TypeError, ValueError, StopIteration) as e:
+                    id = shader.get("info", {}).get("id", "?")
+                    print(f"{id}: can't convert ({e!r})", file=sys.stderr)
+                counts[key] += 1
+        return counts
+
+    def _add(self, shader: Shader, force: bool) -> str:
+        info = shader["info"]
+        source_hash = _hash(json.dumps(shader, sort_keys=True).encode())
+        row = self.get(info["id"])
+        fname = file_name(shader)
+        if row is not None:
+            current = self._file_hash(row["file"])
+            edited = current is not None and current != row["file_hash"]
+            if edited and not force:
+                return "kept"
+            if row["source_hash"] == source_hash and current is not None:
+                return "unchanged"
+            if row["file"] != fname and current is not None:
+                os.remove(self.path(row))  # renamed on Shadertoy
+        text = convert(shader).encode()
+        with open(os.path.join(self.directory, fname), "wb") as f:
+            f.write(text)
+        self.db.execute(
+            "INSERT OR REPLACE INTO shaders "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                info["id"],
+                info["name"],
+                info["username"],
+                int(info.get("date") or 0),
+                len(shader["renderpass"]),
+                ",".join(used_inputs(shader)),
+                source_hash,
+                fname,
+                _hash(text),
+            ),
+        )
+        self.db.execute("DELETE FROM search WHERE id = ?", (info["id"],))
+        self.db.execute(
+            "INSERT INTO search VALUES (?, ?, ?, ?, ?)",
+            (
+                info["id"],
+                info["name"],
+                info["username"],
+                " ".join(info.get("tags", [])),
+                info.get("description", ""),
+            ),
+        )
+        return "added" if row is None else "updated"
+
+
+def fetch_all(
+    fetcher: Fetcher, ids: list[str], jobs: int
+) -> tuple[list[Shader], int]:
+    # The shaders that could be fetched and the number of failures.
+    shaders, failed = [], 0
+    with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+        futures = {pool.submit(fetcher, id): id for id in ids}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                shaders.append(future.result())
+            except (OSError, ValueError, IndexError) as e:
+                print(f"{futures[future]}: {e}", file=sys.stderr)
+                failed += 1
+    return shaders, failed
+
+
+def format_row(row: sqlite3.Row) -> str:
+    inputs = f" [{row['inputs']}]" if row["inputs"] else ""
+    return (
+        f"{row['id']}  {row['name']} by {row['author']}, "
+        f"{row['passes']} passes{inputs}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="machuchu shadertoy",
+        description="Import Shadertoy shaders into a local catalog.",
+    )
+    parser.add_argument(
+        "--dir",
+        default=SHADER_DIR,
+        help="where shaders and the catalog go (default: shader/shadertoy)",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser(
+        "import", help="import JSON exports or dumps"
+    )
+    import_parser.add_argument("files", nargs="+", metavar="FILE|DIR")
+    import_parser.add_argument(
+        "--force", action="store_true", help="overwrite edited files"
+    )
+
+    source_help = (
+        "URL template with {id} and {key}, or a directory of ID.json "
+        "files (default: the Shadertoy API)"
+    )
+    fetch_parser = commands.add_parser("fetch", help="download shaders")
+    fetch_parser.add_argument("ids", nargs="+", type=parse_id, metavar="ID")
+    fetch_parser.add_argument("--source", help=source_help)
+    fetch_parser.add_argument("--jobs", type=int, default=4)
+    fetch_parser.add_argument(
+        "--force", action="store_true", help="overwrite edited files"
+    )
+
+    get_parser = commands.add_parser(
+        "get", help="print a shader's file, fetching it if needed"
+    )
+    get_parser.add_argument("id", type=parse_id, metavar="ID|URL")
+    get_parser.add_argument("--source", help=source_help)
+
+    search_parser = commands.add_parser(
+        "search", help="find shaders by name, author, tags or description"
+    )
+    search_parser.add_argument("query", help="FTS5 query, e.g. 'author:iq'")
+    search_parser.add_argument("--limit", type=int, default=20)
+
+    args = parser.parse_args()
+    catalog = Catalog(args.dir)
+    try:
+        if args.command == "import":
+            try:
+                shaders = [s for f in args.files for s in read_export(f)]
+            except (OSError, ValueError) as e:
+                sys.exit(str(e))
+            print(catalog.add(shaders, args.force), file=sys.stderr)
+        elif args.command == "fetch":
+            fetcher = make_fetcher(args.source)
+            shaders, failed = fetch_all(fetcher, args.ids, args.jobs)
+            counts = catalog.add(shaders, args.force)
+            counts["failed"] += failed
+            print(counts, file=sys.stderr)
+        elif args.command == "get":
+            row = catalog.get(args.id)
+            if row is None or not os.path.exists(catalog.path(row)):
+                try:
+                    shader = make_fetcher(args.source)(args.id)
+                except (OSError, ValueError, IndexError) as e:
+                    sys.exit(f"{args.id}: {e}")
+                catalog.add([shader])
+                row = catalog.get(args.id)
+                if row is None:
+                    sys.exit(f"{args.id}: can't import")
+            print(catalog.path(row))
+        else:
+            try:
+                rows = catalog.search(args.query, args.limit)
+            except sqlite3.OperationalError as e:
+                sys.exit(f"bad query: {e}")
+            for row in rows:
+                print(format_row(row))
+    finally:
+        catalog.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import itertools
+import json
+import math
+import os
+import random
+import numpy as np
+from OpenGL import GL
+from coord import CoordUniform
+from font_builder import glyph_rows
+from images import write_png
+from renderer import Renderer, Target
+from uniforms import UniformValue
+
+# Parameter sweeps: one shader rendered for many uniform settings into the
+# cells of a contact sheet. Each cell is drawn into its own viewport of a
+# single framebuffer that is read back once, and only uniforms change
+# between cells, nothing is recompiled. Below every cell a strip shows its
+# number and values in axis order, in the digit font of shader/text.h;
+# the JSON index next to the image maps them to uniform names.
+
+Axis = tuple[str, float, float]  # uniform, from, to
+Sample = dict[str, float]
+
+LABEL_SCALE = 2
+_LINE = 8  # glyph height plus spacing, in font pixels
+_GLYPHS = {
+    char: np.array([[c == "#" for c in row] for row in rows])
+    for char, rows in glyph_rows().items()
+}
+
+
+def gridSamples(axes: list[Axis], steps: int) -> list[Sample]:
+    # Every combination of `steps` evenly spaced values per axis.
+    names = [name for name, _, _ in axes]
+    values = [
+        np.linspace(lo, hi, steps) if steps > 1 else [(lo + hi) / 2]
+        for _, lo, hi in axes
+    ]
+    return [
+        dict(zip(names, map(float, combination)))
+        for combination in itertools.product(*values)
+    ]
+
+
+def latinHypercube(
+    axes: list[Axis], count: int, seed: int | None = None
+) -> list[Sample]:
+    # `count` samples; each axis is cut into `count` strata and every
+    # stratum is hit exactly once, at a random point inside it.
+    rng = random.Random(seed)
+    names = [name for name, _, _ in axes]
+    columns = []
+    for _, lo, hi in axes:
+        strata = list(range(count))
+        rng.shuffle(strata)
+        columns.append(
+            [lo + (hi - lo) * (s + rng.random()) / count for s in strata]
+        )
+    return [dict(zip(names, values)) for values in zip(*columns)]
+
+
+def formatValue(value: UniformValue) -> str:
+    # Only characters the label font has.
+    if isinstance(value, (bool, int)):
+        return str(int(value))
+    assert isinstance(value, float)
+    text = f"{value:.4f}".rstrip("0").rstrip(".")
+    return "0" if text in ("", "-0") else text
+
+
+def drawText(image: np.ndarray, x: int, y: int, text: str) -> None:
+    # White text into a top-down RGBA image, clipped at its edges;
+    # characters the font doesn't have are left blank.
+    for i, char in enumerate(text):
+        glyph = _GLYPHS.get(char)
+        if glyph is None:
+            continue
+        block = np.kron(glyph, np.ones((LABEL_SCALE, LABEL_SCALE), bool))
+        left = x + i * 6 * LABEL_SCALE
+        region = image[y : y + block.shape[0], left : left + block.shape[1]]
+        region[block[: region.shape[0], : region.shape[1]]] = 255
+
+
+def _current(renderer: Renderer, name: str) -> UniformValue | None:
+    if name in renderer.viewBlock:
+        return renderer.viewBlock.get(name)
+    for store in renderer.stores():
+        if name in store:
+            return store.get(name)
+    return None
+
+
+def renderSweep(
+    renderer: Renderer,
+    coord: CoordUniform,
+    samples: list[Sample],
+    cell: tuple[int, int],
+    columns: int | None = None,
+    time: float = 0.0,
+) -> tuple[np.ndarray, list[dict]]:
+    # Returns the sheet as top-down RGBA rows and one index entry per
+    # cell: its values after conversion to the uniforms' types and its
+    # rectangle [x, y, width, height] in the image. Uniforms get their
+    # previous values back afterwards.
+    if renderer.usesFeedback():
+        raise ValueError("shaders reading machuchu_tex can't be swept")
+    names = list(samples[0]) if samples else []
+    for name in names:
+        if _current(renderer, name) is None:
+            raise ValueError(f"{name} is not an active uniform")
+        if isinstance(_current(renderer, name), tuple):
+            raise ValueError(f"{name} is a vector, only scalars are swept")
+
+    columns = columns or math.ceil(math.sqrt(len(samples)))
+    rows = math.ceil(len(samples) / columns)
+    pitch = (cell[0], cell[1] + (1 + len(names)) * _LINE * LABEL_SCALE)
+    size = (columns * pitch[0], rows * pitch[1])
+    limit = min(
+        GL.glGetIntegerv(GL.GL_MAX_TEXTURE_SIZE),
+        *GL.glGetIntegerv(GL.GL_MAX_VIEWPORT_DIMS),
+    )
+    if max(size) > limit:
+        raise ValueError(
+            f"a {size[0]}x{size[1]} sheet is over the GL limit of {limit}, "
+            "use fewer or smaller cells"
+        )
+
+    previous = {name: _current(renderer, name) for name in names}
+    oldSize = renderer.size
+    renderer.resize(*cell)
+    coord.size = cell
+    target = Target(*size)
+    index = []
+    try:
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, target.fbo)
+        GL.glClearColor(0.0, 0.0, 0.0, 1.0)
+        GL.glClear(GL.GL_COLOR_BUFFER_BIT)
+        renderer.setUniform("time", time)
+        renderer.setView(coord)
+        for i, sample in enumerate(samples):
+            for name, value in sample.items():
+                if isinstance(previous[name], int):
+                    value = round(value)  # not truncated
+                renderer.setUniform(name, value)
+            x = i % columns * pitch[0]
+            y = i // columns * pitch[1]
+            renderer.draw(target.fbo, (x, size[1] - y - cell[1]))
+            index.append(
+                {
+                    "cell": i,
+                    "values": {n: _current(renderer, n) for n in names},
+                    "rect": [x, y, *cell],
+                }
+            )
+        image = target.read().copy()
+    finally:
+        target.delete()
+        renderer.resize(*oldSize)
+        for name, value in previous.items():
+            renderer.setUniform(name, value)
+
+    for entry in index:
+        x, y = entry["rect"][:2]
+        lines = [str(entry["cell"])]
+        lines += [formatValue(v) for v in entry["values"].values()]
+        for n, line in enumerate(lines):
+            top = y + cell[1] + (n * _LINE + 1) * LABEL_SCALE
+            drawText(image, x + LABEL_SCALE, top, line)
+    return image, index
+
+
+def writeSheet(
+    fname: str, image: np.ndarray, index: list[dict], info: dict
+) -> str:
+    # Writes the PNG and its index next to it, returns the index's name.
+    write_png(fname, image)
+    indexName = os.path.splitext(fname)[0] + ".json"
+    with open(indexName, "w") as f:
+        json.dump(
+            {"image": os.path.basename(fname), **info, "cells": index},
+            f,
+            indent=1,
+        )
+    return indexName
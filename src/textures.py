@@ -0,0 +1,277 @@
+import collections
+import ctypes
+import os
+import re
+import shlex
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+from OpenGL import GL
+from OpenGL.raw.GL.VERSION import GL_1_0
+from qtpy.QtGui import QImage
+from resources import textureBytes, tracker
+
+# Image files as sampler2D uniforms:
+#
+#     #pragma machuchu texture NAME PATH [nearest|linear]
+#                                        [repeat|clamp|mirror] [mipmap]
+#
+# PATH is relative to the shader file and may be quoted; anything QImage
+# reads works, .npy arrays become float textures. Images are decoded on a
+# thread pool while the shader compiles, uploaded through a pixel buffer
+# object and kept on the GPU in a cache shared by every shader the
+# renderer loads, so reloading a shader doesn't decode its images again
+# unless the files changed.
+
+_PRAGMA = re.compile(r"^\s*#\s*pragma\s+machuchu\s+texture\b(.*)$", re.M)
+_FILTERS = {"nearest": GL.GL_NEAREST, "linear": GL.GL_LINEAR}
+_MIPMAP_FILTERS = {
+    GL.GL_NEAREST: GL.GL_NEAREST_MIPMAP_NEAREST,
+    GL.GL_LINEAR: GL.GL_LINEAR_MIPMAP_LINEAR,
+}
+_WRAPS = {
+    "repeat": GL.GL_REPEAT,
+    "clamp": GL.GL_CLAMP_TO_EDGE,
+    "mirror": GL.GL_MIRRORED_REPEAT,
+}
+
+DEFAULT_LIMIT = 512 << 20
+
+_Key = tuple[str, int, int]  # real path, mtime, size
+
+
+class TextureSpec:
+    def __init__(self, line: str, params: list[str], directory: str) -> None:
+        if len(params) < 2:
+            raise ValueError(f"expected NAME PATH: {line}")
+        self.name = params[0]
+        self.path = os.path.join(directory, params[1])
+        self.filter = GL.GL_LINEAR
+        self.wrap = GL.GL_REPEAT
+        self.mipmap = False
+        for param in params[2:]:
+            if param in _FILTERS:
+                self.filter = _FILTERS[param]
+            elif param in _WRAPS:
+                self.wrap = _WRAPS[param]
+            elif param == "mipmap":
+                self.mipmap = True
+            else:
+                raise ValueError(f"bad texture option {param!r}: {line}")
+
+    def sampler(self) -> int:
+        # A sampler object with the sampling parameters, rather than
+        # setting them on the texture, which is shared with other specs
+        # of the same file.
+        minFilter = self.filter
+        if self.mipmap:
+            minFilter = _MIPMAP_FILTERS[self.filter]
+        sampler = tracker.track("sampler", GL.glGenSamplers(1))
+        GL.glSamplerParameteri(sampler, GL.GL_TEXTURE_MIN_FILTER, minFilter)
+        GL.glSamplerParameteri(sampler, GL.GL_TEXTURE_MAG_FILTER, self.filter)
+        for param in (GL.GL_TEXTURE_WRAP_S, GL.GL_TEXTURE_WRAP_T):
+            GL.glSamplerParameteri(sampler, param, self.wrap)
+        return sampler
+
+
+def parseTextures(shader: str, directory: str) -> list[TextureSpec]:
+    specs = []
+    for m in _PRAGMA.finditer(shader):
+        line = m[0].strip()
+        try:
+            params = shlex.split(m[1])
+        except ValueError:
+            raise ValueError(f"bad quoting: {line}")
+        specs.append(TextureSpec(line, params, directory))
+    names = [spec.name for spec in specs]
+    if len(set(names)) != len(names):
+        raise ValueError("texture names must be unique")
+    return specs
+
+
+def decodeImage(path: str) -> np.ndarray:
+    # Bottom-up RGBA rows, like GL expects them: uint8 from image files,
+    # float32 from .npy arrays of shape (H, W) or (H, W, 1-4). Missing
+    # channels are 0, missing alpha is 1. Thread-safe.
+    if path.lower().endswith(".npy"):
+        array = np.load(path)
+        if array.ndim == 2:
+            array = array[:, :, None]
+        if array.ndim != 3 or not 1 <= array.shape[2] <= 4:
+            raise ValueError(f"{path}: expected (H, W, 1-4), {array.shape}")
+        dtype = np.uint8 if array.dtype == np.uint8 else np.float32
+        image = np.zeros((*array.shape[:2], 4), dtype)
+        image[:, :, 3] = 255 if dtype == np.uint8 else 1.0
+        image[:, :, : array.shape[2]] = array
+        return image[::-1].copy()
+    qimage = QImage(path)
+    if qimage.isNull():
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"no such image: {path}")
+        raise ValueError(f"can't decode {path}")
+    qimage = qimage.convertToFormat(QImage.Format_RGBA8888)
+    bits = qimage.constBits()
+    if hasattr(bits, "setsize"):  # PyQt's voidptr
+        bits.setsize(qimage.sizeInBytes())
+    width, height = qimage.width(), qimage.height()
+    rows = np.frombuffer(bits, np.uint8).reshape(height, -1)
+    image = rows[:, : width * 4].reshape(height, width, 4)
+    return image[::-1].copy()  # also detaches it from the QImage
+
+
+class TextureRequest:
+    # A texture about to be used: either on the GPU already, or being
+    # decoded.
+
+    def __init__(self, key: _Key, future: Future | None) -> None:
+        self.key = key
+        self.future = future
+
+    def done(self) -> bool:
+        return self.future is None or self.future.done()
+
+
+class _Entry:
+    def __init__(self, texture: int, nbytes: int) -> None:
+        self.texture = texture
+        self.nbytes = nbytes
+        self.mipmaps = False
+        self.users = 0
+
+
+class TextureCache:
+    # Least recently used textures are deleted once the cache holds more
+    # than `limit` bytes, except those in use. Entries are keyed by file
+    # and modification time, an edited image is decoded again.
+
+    def __init__(self, limit: int = DEFAULT_LIMIT, threads: int = 4) -> None:
+        self.limit = limit
+        self.hits = 0
+        self.misses = 0
+        self._entries: collections.OrderedDict[_Key, _Entry]
+        self._entries = collections.OrderedDict()
+        self._byTexture: dict[int, _Key] = {}
+        # decodes stay shared while any request holds them
+        self._decoding: weakref.WeakValueDictionary[_Key, Future]
+        self._decoding = weakref.WeakValueDictionary()
+        self._pool = ThreadPoolExecutor(threads, "texture-decode")
+
+    @staticmethod
+    def _key(path: str) -> _Key:
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        return path, st.st_mtime_ns, st.st_size
+
+    def request(self, path: str) -> TextureRequest:
+        # Starts decoding unless the file is on the GPU already. Raises
+        # OSError for missing files.
+        key = self._key(path)
+        if key in self._entries:
+            return TextureRequest(key, None)
+        future = self._decoding.get(key)
+        if future is None:
+            future = self._pool.submit(decodeImage, key[0])
+            self._decoding[key] = future
+        return TextureRequest(key, future)
+
+    def acquire(self, request: TextureRequest, mipmap: bool = False) -> int:
+        # The texture, counted as used until release(). Waits for the
+        # decode and re-raises its errors.
+        entry = self._entries.get(request.key)
+        if entry is None:
+            future = request.future
+            if future is None:  # evicted since the request
+                future = self._pool.submit(decodeImage, request.key[0])
+            entry = self._upload(request.key, future.result())
+            self.misses += 1
+        else:
+            self._entries.move_to_end(request.key)
+            self.hits += 1
+        if mipmap and not entry.mipmaps:
+            GL.glBindTexture(GL.GL_TEXTURE_2D, entry.texture)
+            GL.glGenerateMipmap(GL.GL_TEXTURE_2D)
+            entry.mipmaps = True
+            entry.nbytes = entry.nbytes * 4 // 3
+            tracker.track("texture", entry.texture, entry.nbytes)
+        entry.users += 1
+        self._evict()
+        return entry.texture
+
+    def release(self, texture: int) -> None:
+        key = self._byTexture.get(texture)
+        if key is not None:
+            self._entries[key].users -= 1
+            self._evict()
+
+    def _upload(self, key: _Key, image: np.ndarray) -> _Entry:
+        height, width, _ = image.shape
+        limit = GL.glGetIntegerv(GL.GL_MAX_TEXTURE_SIZE)
+        if max(width, height) > limit:
+            raise ValueError(
+                f"{key[0]} is {width}x{height}, over the GL limit of {limit}"
+            )
+        float_ = image.dtype == np.float32
+        internalFormat = GL.GL_RGBA32F if float_ else GL.GL_RGBA8
+        nbytes = textureBytes((width, height), internalFormat)
+        texture = tracker.track("texture", GL.glGenTextures(1), nbytes)
+
+        # Copy into a pixel buffer, the driver transfers from there
+        # without stalling us on the texture.
+        buffer = tracker.track("buffer", GL.glGenBuffers(1), image.nbytes)
+        GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, buffer)
+        GL.glBufferData(
+            GL.GL_PIXEL_UNPACK_BUFFER, image.nbytes, None, GL.GL_STREAM_DRAW
+        )
+        ptr = GL.glMapBufferRange(
+            GL.GL_PIXEL_UNPACK_BUFFER,
+            0,
+            image.nbytes,
+            GL.GL_MAP_WRITE_BIT | GL.GL_MAP_INVALIDATE_BUFFER_BIT,
+        )
+        ctypes.memmove(ptr, image.ctypes.data, image.nbytes)
+        GL.glUnmapBuffer(GL.GL_PIXEL_UNPACK_BUFFER)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
+        # the wrapped glTexImage2D would take None for no data at all
+        GL_1_0.glTexImage2D(
+            GL.GL_TEXTURE_2D,
+            0,
+            internalFormat,
+            width,
+            height,
+            0,
+            GL.GL_RGBA,
+            GL.GL_FLOAT if float_ else GL.GL_UNSIGNED_BYTE,
+            ctypes.c_void_p(0),
+        )
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 4)
+        GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, 0)
+        tracker.delete("buffer", buffer)  # freed once the copy is done
+
+        # older versions of the file are of no use anymore
+        for old in [k for k in self._entries if k[0] == key[0]]:
+            if not self._entries[old].users:
+                self._remove(old)
+        entry = self._entries[key] = _Entry(texture, nbytes)
+        self._byTexture[texture] = key
+        return entry
+
+    def _remove(self, key: _Key) -> None:
+        entry = self._entries.pop(key)
+        del self._byTexture[entry.texture]
+        tracker.delete("texture", entry.texture)
+
+    def _evict(self) -> None:
+        for key in list(self._entries):
+            if self.memory() <= self.limit:
+                break
+            if not self._entries[key].users:
+                self._remove(key)
+
+    def memory(self) -> int:
+        return sum(entry.nbytes for entry in self._entries.values())
+
+    def delete(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        for key in list(self._entries):
+            self._remove(key)
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+
+if __name__ == "__main__":
+    # a worker, see below
+    import headless  # noqa: F401, must come before anything imports GL
+
+import hashlib
+import json
+import os
+import select
+import subprocess
+import sys
+import threading
+from preprocessor import IncludeCache, Preprocessor
+from textures import parseTextures
+
+# Small previews of shaders for the library browser, rendered offscreen by
+# worker processes and kept on disk. A thumbnail's key hashes everything
+# its picture depends on: the preprocessed source, the contents of every
+# file it includes and the textures it loads, so editing a header makes
+# all shaders including it render again and untouched ones never do.
+#
+# Workers are separate processes running this file, not multiprocessing
+# children: those would re-import the viewer's main module, and each
+# needs its own headless context anyway. They read one JSON request per
+# line and answer likewise.
+
+FORMAT_VERSION = 1
+SIZE = (160, 90)
+TIME = 1000.0  # ms, many shaders are blank at 0
+TIMEOUT = 30.0  # seconds a worker gets per shader
+DEFAULT_LIMIT = 32 << 20
+
+_WORKER = os.path.abspath(__file__)
+
+
+def cacheDirectory() -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "machuchu", "thumbnails")
+
+
+class ThumbnailCache:
+    # PNGs named by key, plus .err files with the error of shaders that
+    # don't compile, so they aren't retried until they change. Least
+    # recently used files go first once there are more than `limit` bytes.
+
+    def __init__(
+        self,
+        directory: str | None = None,
+        size: tuple[int, int] = SIZE,
+        limit: int = DEFAULT_LIMIT,
+    ) -> None:
+        self.directory = directory or cacheDirectory()
+        self.size = size
+        self.limit = limit
+        self.includeCache = IncludeCache()
+
+    def key(self, fname: str) -> tuple[str, list[str], list[str]]:
+        # The key, the files it includes and the textures it loads.
+        # Raises for shaders that can't be preprocessed, e.g. missing
+        # includes.
+        prep = Preprocessor(fname, self.includeCache)
+        directory = os.path.dirname(fname)
+        h = hashlib.sha256(f"{FORMAT_VERSION} {self.size} {TIME}".encode())
+        h.update(prep.text.encode())
+        textures = []
+        for spec in parseTextures(prep.text, directory):
+            textures.append(spec.path)
+            try:
+                st = os.stat(spec.path)
+                h.update(f"{spec.path} {st.st_mtime_ns} {st.st_size}".encode())
+            except OSError:
+                h.update(f"{spec.path} missing".encode())
+        return h.hexdigest(), list(prep.fnames), textures
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".png")
+
+    def lookup(self, key: str) -> tuple[str | None, str | None]:
+        # (thumbnail, None), (None, error) or (None, None) if unknown.
+        for fname, isError in (
+            (self.path(key), False),
+            (self._err(key), True),
+        ):
+            try:
+                os.utime(fname)
+            except OSError:
+                continue
+            if not isError:
+                return fname, None
+            with open(fname) as f:
+                return None, f.read()
+        return None, None
+
+    def _err(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".err")
+
+    def storeError(self, key: str, error: str) -> None:
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._err(key), "w") as f:
+                f.write(error)
+        except OSError:
+            pass
+
+    def evict(self) -> None:
+        try:
+            entries = [
+                (st.st_mtime, st.st_size, entry.path)
+                for entry in os.scandir(self.directory)
+                if entry.name.endswith((".png", ".err"))
+                for st in (entry.stat(),)
+            ]
+        except OSError:
+            return
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.limit:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class _Worker:
+    def __init__(self, size: tuple[int, int]) -> None:
+        self.process = subprocess.Popen(
+            [sys.executable, "-B", _WORKER, f"{size[0]}x{size[1]}"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+
+    def render(self, fname: str, out: str) -> str | None:
+        # The error, if any. Raises TimeoutError or EOFError when the
+        # process hangs or dies, it is of no use after that.
+        assert self.process.stdin and self.process.stdout
+        request = json.dumps({"file": fname, "out": out})
+        self.process.stdin.write(request + "\n")
+        self.process.stdin.flush()
+        ready, _, _ = select.select([self.process.stdout], [], [], TIMEOUT)
+        if not ready:
+            raise TimeoutError(f"no thumbnail after {TIMEOUT:.0f} s")
+        line = self.process.stdout.readline()
+        if not line:
+            raise EOFError("thumbnail worker died")
+        return json.loads(line)["error"]
+
+    def close(self) -> None:
+        self.process.kill()
+        self.process.wait()
+
+
+Result = tuple[str, str, str | None, str | None]  # file, key, png, error
+
+
+class ThumbnailWorkers:
+    # Renders requested thumbnails on `jobs` worker processes, started on
+    # demand. The latest requests are served first, they are what the
+    # user looks at now. Results are collected with poll(), from any
+    # thread.
+
+    def __init__(self, cache: ThumbnailCache, jobs: int = 2) -> None:
+        self.cache = cache
+        self.jobs = jobs
+        self._lock = threading.Condition()
+        self._todo: dict[str, str] = {}  # key -> file, oldest first
+        self._busy: set[str] = set()
+        self._results: list[Result] = []
+        self._threads: list[threading.Thread] = []
+        self._workers: set[_Worker] = set()
+        self._closed = False
+
+    def request(self, fname: str, key: str) -> None:
+        with self._lock:
+            if key in self._busy:
+                return
+            self._todo.pop(key, None)
+            self._todo[key] = fname
+            if len(self._threads) < self.jobs:
+                thread = threading.Thread(
+                    target=self._run, name="machuchu-thumbnails", daemon=True
+                )
+                self._threads.append(thread)
+                thread.start()
+            self._lock.notify()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._todo) + len(self._busy)
+
+    def poll(self) -> list[Result]:
+        with self._lock:
+            results, self._results = self._results, []
+        return results
+
+    def _run(self) -> None:
+        worker: _Worker | None = None
+        try:
+            while True:
+                with self._lock:
+                    while not self._todo and not self._closed:
+                        self._lock.wait()
+                    if self._closed:
+                        return
+                    key, fname = self._todo.popitem()
+                    self._busy.add(key)
+                if worker is None:
+                    worker = _Worker(self.cache.size)
+                    with self._lock:
+                        self._workers.add(worker)
+                try:
+                    error = worker.render(fname, self.cache.path(key))
+                except (OSError, TimeoutError, EOFError, ValueError) as e:
+                    with self._lock:
+                        self._workers.discard(worker)
+                    worker.close()
+                    worker = None
+                    if self._closed:
+                        return  # killed by close()
+                    error = str(e)
+                png = None
+                if error is None:
+                    png = self.cache.path(key)
+                else:
+                    self.cache.storeError(key, error)
+                with self._lock:
+                    self._busy.discard(key)
+                    self._results.append((fname, key, png, error))
+        finally:
+            if worker is not None:
+                worker.close()
+
+    def close(self) -> None:
+        # Workers in the middle of a shader are killed, not waited for.
+        with self._lock:
+            self._closed = True
+            self._todo.clear()
+            self._lock.notify_all()
+            for worker in self._workers:
+                worker.process.kill()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self.cache.evict()
+
+
+def worker_main(size: tuple[int, int]) -> None:
+    # Answers go to the original stdout; anything else printing there,
+    # down to the driver, ends up on stderr.
+    answers = os.fdopen(os.dup(1), "w")
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+
+    import headless
+
+    from coord import CoordUniform
+    from images import write_png
+    import MyGL
+    from progcache import ProgramCache
+    from renderer import Renderer, Target
+
+    context = headless.HeadlessContext()
+    renderer = Renderer(ProgramCache())
+    renderer.resize(*size)
+    target = Target(*size)
+    coord = CoordUniform()
+    coord.size = size
+    includeCache = IncludeCache()
+    for line in sys.stdin:
+        request = json.loads(line)
+        error = None
+        try:
+            prep = Preprocessor(request["file"], includeCache)
+            renderer.setFragmentShader(
+                prep.text, prep.version, os.path.dirname(request["file"])
+            )
+            renderer.setUniform("time", TIME)
+            renderer.setView(coord)
+            renderer.draw(target.fbo)
+            os.makedirs(os.path.dirname(request["out"]), exist_ok=True)
+            # only one worker renders a key at a time
+            tmp = request["out"] + ".tmp"
+            write_png(tmp, target.read())
+            os.replace(tmp, request["out"])
+        except MyGL.ShaderCompilationError as e:
+            error = e.text
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        answers.write(json.dumps({"error": error}) + "\n")
+        answers.flush()
+    target.delete()
+    renderer.delete()
+    context.destroy()
+
+
+if __name__ == "__main__":
+    width, height = map(int, sys.argv[1].split("x"))
+    worker_main((width, height))
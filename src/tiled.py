@@ -0,0 +1,250 @@
+import abc
+import os
+import struct
+import typing
+import numpy as np
+from OpenGL import GL
+from coord import CoordUniform
+from output import FrameWriter
+from readback import PixelReadback
+from renderer import Renderer, Target
+
+# Stills larger than any framebuffer the driver allows. The image is cut
+# into tiles, each tile is rendered with its own view so that `p` runs on
+# continuously across the seams, and tiles are written straight into a
+# memory-mapped output file.
+
+TIFF_EXTENSIONS = (".tif", ".tiff")
+EXTENSIONS = TIFF_EXTENSIONS + (".npy", ".raw")
+
+
+def tileView(
+    coord: CoordUniform,
+    size: tuple[int, int],
+    origin: tuple[int, int],
+    tile: tuple[int, int],
+) -> dict[str, float]:
+    # `origin` is the tile's lower left corner in GL pixel coordinates of
+    # the full image (it may go negative for padded edge tiles).
+    view = dict(coord.items())
+    width, height = size
+    aspect = width / height
+    z = view["machuchu_z"]
+    assert isinstance(z, float)
+    x = view["machuchu_x"]
+    y = view["machuchu_y"]
+    assert isinstance(x, float) and isinstance(y, float)
+    return {
+        "machuchu_x": x + ((2 * origin[0] + tile[0]) / width - 1) * aspect / z,
+        "machuchu_y": y + ((2 * origin[1] + tile[1]) / height - 1) / z,
+        "machuchu_z": z * height / tile[1],
+        "machuchu_aspect": tile[0] / tile[1],
+    }
+
+
+class TiledImage(abc.ABC):
+    # Top-down RGBA8 image on disk, written tile by tile.
+
+    def __init__(self, size: tuple[int, int], tile: tuple[int, int]) -> None:
+        self.size = size
+        self.tile = tile
+        self.columns = -(-size[0] // tile[0])
+        self.rows = -(-size[1] // tile[1])
+
+    def tiles(self) -> typing.Iterator[tuple[int, int]]:
+        # Top-left pixel of each tile, row-major from the top.
+        for row in range(self.rows):
+            for column in range(self.columns):
+                yield column * self.tile[0], row * self.tile[1]
+
+    @abc.abstractmethod
+    def write(self, index: int, image: np.ndarray) -> None:
+        pass
+
+    @abc.abstractmethod
+    def close(self) -> None:
+        pass
+
+
+class ArrayImage(TiledImage):
+    # .npy (with a header numpy can load) or .raw (bare RGBA bytes).
+
+    def __init__(
+        self, fname: str, size: tuple[int, int], tile: tuple[int, int]
+    ) -> None:
+        super().__init__(size, tile)
+        shape = (size[1], size[0], 4)
+        self._data: np.memmap
+        if fname.endswith(".npy"):
+            self._data = np.lib.format.open_memmap(
+                fname, mode="w+", dtype=np.uint8, shape=shape
+            )
+        else:
+            self._data = np.memmap(fname, np.uint8, "w+", shape=shape)
+
+    def write(self, index: int, image: np.ndarray) -> None:
+        row, column = divmod(index, self.columns)
+        x, y = column * self.tile[0], row * self.tile[1]
+        w = min(self.tile[0], self.size[0] - x)
+        h = min(self.tile[1], self.size[1] - y)
+        self._data[y : y + h, x : x + w] = image[:h, :w]
+
+    def close(self) -> None:
+        self._data.flush()
+        del self._data
+
+
+class TiffImage(TiledImage):
+    # Uncompressed tiled TIFF, BigTIFF when offsets don't fit in 32 bits.
+    # Each tile is one contiguous block in the file, edge tiles are padded
+    # as the format requires.
+
+    def __init__(
+        self, fname: str, size: tuple[int, int], tile: tuple[int, int]
+    ) -> None:
+        if tile[0] % 16 or tile[1] % 16:
+            raise ValueError("TIFF tile sizes must be multiples of 16")
+        super().__init__(size, tile)
+        count = self.columns * self.rows
+        tileBytes = tile[0] * tile[1] * 4
+        big = count * tileBytes + (count + 1) * 16 + 4096 >= 1 << 32
+        if big:
+            header = struct.pack("<2sHHHQ", b"II", 43, 8, 0, 16)
+            entry, inline, offsetType = "<HHQ", 8, (16, "<u8")  # LONG8
+        else:
+            header = struct.pack("<2sHI", b"II", 42, 8)
+            entry, inline, offsetType = "<HHI", 4, (4, "<u4")  # LONG
+        short, long_ = (3, "<u2"), (4, "<u4")
+
+        # IFD right after the header, values that don't fit into an entry
+        # after the IFD, then the tiles
+        nfields = 12
+        countSize = 8 if big else 2
+        extraAt = len(header) + countSize + nfields * (4 + 2 * inline) + inline
+        dataAt = -(-(extraAt + 16 + 2 * count * inline) // 4096) * 4096
+        offsets = dataAt + np.arange(count, dtype=np.uint64) * tileBytes
+        extra = bytearray()
+
+        def field(
+            tag: int,
+            type_: tuple[int, str],
+            values: typing.Sequence[int] | np.ndarray,
+        ) -> bytes:
+            data = np.asarray(values, dtype=type_[1]).tobytes()
+            n = len(data) // np.dtype(type_[1]).itemsize
+            if len(data) <= inline:
+                value = data.ljust(inline, b"\0")
+            else:
+                at = extraAt + len(extra)
+                extra.extend(data)
+                extra.extend(b"\0" * (len(data) % 2))
+                value = at.to_bytes(inline, "little")
+            return struct.pack(entry, tag, type_[0], n) + value
+
+        fields = [
+            field(256, long_, [size[0]]),
+            field(257, long_, [size[1]]),
+            field(258, short, [8, 8, 8, 8]),
+            field(259, short, [1]),  # no compression
+            field(262, short, [2]),  # RGB
+            field(277, short, [4]),
+            field(284, short, [1]),  # chunky
+            field(322, long_, [tile[0]]),
+            field(323, long_, [tile[1]]),
+            field(324, offsetType, offsets),
+            field(325, offsetType, np.full(count, tileBytes)),
+            field(338, short, [2]),  # unassociated alpha
+        ]
+        assert len(fields) == nfields
+        ifd = len(fields).to_bytes(countSize, "little")
+        ifd += b"".join(fields) + b"\0" * inline
+        assert len(header) + len(ifd) == extraAt
+        assert extraAt + len(extra) <= dataAt
+
+        with open(fname, "wb") as f:
+            f.write(header + ifd + extra)
+            f.truncate(dataAt + count * tileBytes)
+        self._data = np.memmap(
+            fname,
+            np.uint8,
+            "r+",
+            offset=dataAt,
+            shape=(count, tile[1], tile[0], 4),
+        )
+
+    def write(self, index: int, image: np.ndarray) -> None:
+        self._data[index] = image
+
+    def close(self) -> None:
+        self._data.flush()
+        del self._data
+
+
+def openImage(
+    fname: str, size: tuple[int, int], tile: tuple[int, int]
+) -> TiledImage:
+    ext = os.path.splitext(fname)[1].lower()
+    if ext in TIFF_EXTENSIONS:
+        return TiffImage(fname, size, tile)
+    if ext in (".npy", ".raw"):
+        return ArrayImage(fname, size, tile)
+    raise ValueError(f"tiled output must be one of {', '.join(EXTENSIONS)}")
+
+
+def maxTileSize() -> int:
+    dims = GL.glGetIntegerv(GL.GL_MAX_VIEWPORT_DIMS)
+    return int(
+        min(
+            *dims,
+            GL.glGetIntegerv(GL.GL_MAX_TEXTURE_SIZE),
+            GL.glGetIntegerv(GL.GL_MAX_RENDERBUFFER_SIZE),
+        )
+    )
+
+
+class _TileWriter(FrameWriter):
+    def __init__(self, image: TiledImage) -> None:
+        super().__init__(queue=2)
+        self.image = image
+
+    def write(self, frame: int, image: np.ndarray) -> None:
+        self.image.write(frame, image)
+
+
+def renderTiled(
+    renderer: Renderer,
+    coord: CoordUniform,
+    time: float,
+    image: TiledImage,
+    draw: typing.Callable[[int], None] | None = None,
+) -> typing.Iterator[int]:
+    # Yields the index of each tile queued. Peak memory is a few tiles:
+    # the readback ring plus whatever the page cache holds of the output.
+    draw = draw or renderer.draw
+    tile = image.tile
+    full = (image.size[0], image.size[1])
+    coord.size = full
+    oldSize = renderer.size
+    renderer.resize(*tile)
+    target = Target(*tile)
+    writer = _TileWriter(image)
+    readback = PixelReadback(tile, writer)
+    try:
+        renderer.setUniform("time", time)
+        for name, value in coord.items():
+            renderer.setUniform(name, value)
+        for index, (x, y) in enumerate(image.tiles()):
+            origin = (x, full[1] - y - tile[1])
+            for name, value in tileView(coord, full, origin, tile).items():
+                renderer.setUniform(name, value)
+            draw(target.fbo)
+            readback.read(target.fbo, index)
+            yield index
+    finally:
+        try:
+            readback.delete()
+            writer.close()
+        finally:
+            target.delete()
+            renderer.resize(*oldSize)
+            image.close()
@@ -0,0 +1,193 @@
+import math
+import typing
+import numpy as np
+from OpenGL import GL
+from resources import tracker
+
+UniformValue = int | bool | float | tuple[float, ...]
+
+# Binding point of the machuchu_view uniform block. Its layout must match
+# the std140 block declared in the vertex shader.
+VIEW_BLOCK = "machuchu_view"
+VIEW_BINDING = 0
+VIEW_FIELDS = ("machuchu_x", "machuchu_y", "machuchu_z", "machuchu_aspect")
+
+_Upload = typing.Callable[[int, UniformValue], None]
+
+_INT_TYPES = {
+    GL.GL_INT,
+    GL.GL_BOOL,
+    GL.GL_UNSIGNED_INT,
+    GL.GL_SAMPLER_2D,
+}
+_VEC_TYPES = {
+    GL.GL_FLOAT_VEC2: 2,
+    GL.GL_FLOAT_VEC3: 3,
+    GL.GL_FLOAT_VEC4: 4,
+}
+_UPLOAD: dict[int, _Upload] = {
+    GL.GL_FLOAT: lambda loc, v: GL.glUniform1f(loc, v),
+    GL.GL_INT: lambda loc, v: GL.glUniform1i(loc, v),
+    GL.GL_BOOL: lambda loc, v: GL.glUniform1i(loc, v),
+    GL.GL_UNSIGNED_INT: lambda loc, v: GL.glUniform1ui(loc, v),
+    GL.GL_SAMPLER_2D: lambda loc, v: GL.glUniform1i(loc, v),
+    GL.GL_FLOAT_VEC2: lambda loc, v: GL.glUniform2f(loc, *v),
+    GL.GL_FLOAT_VEC3: lambda loc, v: GL.glUniform3f(loc, *v),
+    GL.GL_FLOAT_VEC4: lambda loc, v: GL.glUniform4f(loc, *v),
+}
+
+
+def _same(a: UniformValue, b: UniformValue) -> bool:
+    if isinstance(a, tuple) and isinstance(b, tuple):
+        return len(a) == len(b) and all(map(_same, a, b))
+    if a == b:
+        return True
+    # NaN is a legit value here (e.g. machuchu_mouse before any click)
+    return (
+        isinstance(a, float)
+        and isinstance(b, float)
+        and math.isnan(a)
+        and math.isnan(b)
+    )
+
+
+class _Slot:
+    __slots__ = ("location", "type", "value", "dirty")
+
+    def __init__(self, location: int, type_: int, value: UniformValue):
+        self.location = location
+        self.type = type_
+        self.value = value
+        self.dirty = False
+
+
+class UniformStore:
+    # Shadow copy of the default-block uniforms of a linked program.
+    # Locations are resolved once; set() only touches Python state and
+    # flush() uploads what actually changed.
+
+    def __init__(self, program: int) -> None:
+        self.program = program
+        self.slots: dict[str, _Slot] = {}
+        self._dirty: list[_Slot] = []
+
+        count = GL.glGetProgramiv(program, GL.GL_ACTIVE_UNIFORMS)
+        for i in range(count):
+            name, _, type_ = GL.glGetActiveUniform(program, i)
+            name = name.decode("utf-8")
+            if type_ not in _UPLOAD or name.endswith("]"):
+                continue
+            loc = GL.glGetUniformLocation(program, name)
+            if loc == -1:
+                continue  # uniform block member
+            self.slots[name] = _Slot(loc, int(type_), self._read(loc, type_))
+
+    def _read(self, loc: int, type_: int) -> UniformValue:
+        if type_ in _INT_TYPES:
+            if type_ == GL.GL_UNSIGNED_INT:
+                value = np.zeros(1, np.uint32)
+                GL.glGetUniformuiv(self.program, loc, value)
+            else:
+                value = np.zeros(1, np.int32)
+                GL.glGetUniformiv(self.program, loc, value)
+            return int(value[0])
+        value = np.zeros(4, np.float32)
+        GL.glGetUniformfv(self.program, loc, value)
+        if type_ == GL.GL_FLOAT:
+            return float(value[0])
+        return tuple(map(float, value[: _VEC_TYPES[type_]]))
+
+    @staticmethod
+    def coerce(type_: int, value: UniformValue) -> UniformValue:
+        if type_ in _VEC_TYPES:
+            assert isinstance(value, tuple)
+            return tuple(map(float, value[: _VEC_TYPES[type_]]))
+        if isinstance(value, tuple):
+            value = value[0]
+        if type_ in _INT_TYPES:
+            return int(value)
+        return float(value)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.slots
+
+    def get(self, name: str) -> UniformValue:
+        return self.slots[name].value
+
+    def key(self) -> tuple[UniformValue, ...]:
+        # Changes whenever any uniform value does.
+        return tuple(slot.value for slot in self.slots.values())
+
+    def set(self, name: str, value: UniformValue) -> None:
+        slot = self.slots.get(name)
+        if slot is None:
+            return  # not active in this program
+        value = self.coerce(slot.type, value)
+        if _same(slot.value, value):
+            return
+        slot.value = value
+        if not slot.dirty:
+            slot.dirty = True
+            self._dirty.append(slot)
+
+    def flush(self) -> None:
+        # The program must be current.
+        for slot in self._dirty:
+            _UPLOAD[slot.type](slot.location, slot.value)
+            slot.dirty = False
+        self._dirty.clear()
+
+
+class ViewBlock:
+    # Uniform buffer backing the std140 machuchu_view block. Four floats
+    # pack tightly under std140, so the whole block is one 16-byte update.
+
+    def __init__(self) -> None:
+        self._data = np.zeros(len(VIEW_FIELDS), np.float32)
+        self._data[VIEW_FIELDS.index("machuchu_z")] = 1.0
+        self._data[VIEW_FIELDS.index("machuchu_aspect")] = 1.0
+        self._index = {name: i for i, name in enumerate(VIEW_FIELDS)}
+        self._dirty = True
+
+        self.buffer = tracker.track("buffer", GL.glGenBuffers(1), 16)
+        GL.glBindBuffer(GL.GL_UNIFORM_BUFFER, self.buffer)
+        GL.glBufferData(
+            GL.GL_UNIFORM_BUFFER,
+            self._data.nbytes,
+            None,
+            GL.GL_DYNAMIC_DRAW,
+        )
+        GL.glBindBuffer(GL.GL_UNIFORM_BUFFER, 0)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._index
+
+    @staticmethod
+    def attach(program: int) -> None:
+        index = GL.glGetUniformBlockIndex(program, VIEW_BLOCK)
+        if index != GL.GL_INVALID_INDEX:
+            GL.glUniformBlockBinding(program, index, VIEW_BINDING)
+
+    def get(self, name: str) -> float:
+        return float(self._data[self._index[name]])
+
+    def delete(self) -> None:
+        tracker.delete("buffer", self.buffer)
+
+    def key(self) -> bytes:
+        return self._data.tobytes()
+
+    def set(self, name: str, value: UniformValue) -> None:
+        i = self._index[name]
+        value = np.float32(value)
+        if self._data[i] != value:
+            self._data[i] = value
+            self._dirty = True
+
+    def flush(self) -> None:
+        GL.glBindBufferBase(GL.GL_UNIFORM_BUFFER, VIEW_BINDING, self.buffer)
+        if self._dirty:
+            GL.glBufferSubData(
+                GL.GL_UNIFORM_BUFFER, 0, self._data.nbytes, self._data
+            )
+            self._dirty = False
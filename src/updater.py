@@ -1,21 +1,246 @@
-import posix
+import ctypes
+import ctypes.util
 import errno
+import os
+import select
+import struct
+import threading
+import time
+
+# Tells the GUI when any of the shader's files changed. On Linux a thread
+# sleeps on inotify and check() only looks at a flag; elsewhere check()
+# falls back to stat()ing every file.
+#
+# Directories are watched rather than the files themselves: editors often
+# save by writing a temporary file and renaming it over the original, which
+# would silently orphan a watch on the old inode.
+
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_CLOEXEC = 0o2000000
+_IN_NONBLOCK = 0o4000
+
+_MASK = (
+    _IN_MODIFY
+    | _IN_ATTRIB
+    | _IN_CLOSE_WRITE
+    | _IN_MOVED_FROM
+    | _IN_MOVED_TO
+    | _IN_CREATE
+    | _IN_DELETE
+    | _IN_ONLYDIR
+)
+_EVENT = struct.Struct("iIII")
+
+DEBOUNCE = 0.05  # seconds of quiet before a burst of events counts as one
+POLL_INTERVAL = 0.25  # seconds between stat() rounds without inotify
+
+
+def _libc() -> ctypes.CDLL | None:
+    name = ctypes.util.find_library("c")
+    try:
+        libc = ctypes.CDLL(name, use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class _Inotify:
+    def __init__(self, libc: ctypes.CDLL) -> None:
+        self._libc = libc
+        self.fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+
+    def add(self, directory: str) -> int | None:
+        wd = self._libc.inotify_add_watch(
+            self.fd, os.fsencode(directory), _MASK
+        )
+        if wd < 0:
+            e = ctypes.get_errno()
+            if e in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                return None
+            raise OSError(e, os.strerror(e), directory)
+        return wd
+
+    def remove(self, wd: int) -> None:
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self) -> list[tuple[int, int, str]]:
+        # (wd, mask, name) of every queued event
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        at = 0
+        while at < len(data):
+            wd, mask, _, size = _EVENT.unpack_from(data, at)
+            at += _EVENT.size
+            name = data[at : at + size].rstrip(b"\0")
+            at += size
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def _stamp(fname: str) -> tuple[int, int] | None:
+    # Inode and ctime, so that a file replaced by rename shows up even if
+    # the clock didn't move. None for missing files.
+    try:
+        st = os.stat(fname)
+    except OSError as e:
+        if e.errno in (errno.ENOENT, errno.ENOTDIR):
+            return None
+        raise
+    return st.st_ino, st.st_ctime_ns
 
 
 class Updater:
-    def __init__(self, files: list[str]) -> None:
-        self.files = {f: posix.stat(f).st_ctime for f in files}
+    def __init__(self, files: list[str], watch: bool = True) -> None:
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        self._files: dict[str, tuple[int, int] | None] = {}
+        self._names: dict[str, set[str]] = {}  # directory -> basenames
+        self._watches: dict[str, int] = {}  # directory -> wd
+        self._directories: dict[int, str] = {}  # wd -> directory
+        self._inotify: _Inotify | None = None
+        self._thread: threading.Thread | None = None
+        self._polled = 0.0
 
-    def check(self) -> bool:
-        res = False
-        for f, old in self.files.items():
+        libc = _libc() if watch else None
+        if libc is not None:
             try:
-                new = posix.stat(f).st_ctime
+                self._inotify = _Inotify(libc)
+            except OSError:
+                self._inotify = None
+        if self._inotify is not None:
+            self._wake_r, self._wake_w = os.pipe()
+            self._thread = threading.Thread(
+                target=self._run, name="machuchu-updater", daemon=True
+            )
+            self._thread.start()
+        self.set_files(files)
+
+    def watching(self) -> bool:
+        return self._inotify is not None
+
+    def set_files(self, files: list[str]) -> None:
+        # Replaces the watched set, e.g. after an #include was added.
+        paths = {os.path.abspath(f) for f in files}
+        for path in list(paths):
+            paths.add(os.path.realpath(path))  # edits to symlink targets
+        names: dict[str, set[str]] = {}
+        for path in paths:
+            directory, name = os.path.split(path)
+            names.setdefault(directory, set()).add(name)
+
+        with self._lock:
+            self._files = {
+                f: self._files[f] if f in self._files else _stamp(f)
+                for f in paths
+            }
+            self._names = names
+            if self._inotify is None:
+                return
+            for directory in set(self._watches) - set(names):
+                wd = self._watches.pop(directory)
+                self._directories.pop(wd, None)  # its IN_IGNORED is ours
+                self._inotify.remove(wd)
+            for directory in set(names) - set(self._watches):
+                wd = self._inotify.add(directory)
+                if wd is not None:
+                    self._watches[directory] = wd
+                    self._directories[wd] = directory
+
+    def _relevant(self, wd: int, mask: int, name: str) -> bool:
+        if mask & _IN_Q_OVERFLOW:
+            return True  # events were lost, assume the worst
+        with self._lock:
+            directory = self._directories.get(wd)
+            if mask & _IN_IGNORED:
+                self._directories.pop(wd, None)
+                if directory is not None:
+                    self._watches.pop(directory, None)
+                    return True  # the directory itself went away
+                return False
+            return directory is not None and name in self._names.get(
+                directory, ()
+            )
+
+    def _run(self) -> None:
+        assert self._inotify is not None
+        fds = [self._inotify.fd, self._wake_r]
+        while True:
+            ready, _, _ = select.select(fds, [], [])
+            if self._wake_r in ready:
+                return
+            # keep reading until the burst is over, so that an editor's
+            # write + rename + chmod becomes a single reload
+            dirty = False
+            while True:
+                for wd, mask, name in self._inotify.read():
+                    dirty |= self._relevant(wd, mask, name)
+                ready, _, _ = select.select(fds, [], [], DEBOUNCE)
+                if self._wake_r in ready:
+                    return
+                if not ready:
+                    break
+            if dirty:
+                self._changed.set()
+
+    def _poll(self) -> bool:
+        now = time.monotonic()
+        if now - self._polled < POLL_INTERVAL:
+            return False
+        self._polled = now
+        res = False
+        with self._lock:
+            for f, old in self._files.items():
+                new = _stamp(f)
                 if old != new:
-                    self.files[f] = new
-                    res = True
-            except OSError as e:
-                if e.errno == errno.ENOENT:
-                    return False
-                raise e
+                    self._files[f] = new
+                    # a file that just disappeared is most likely being
+                    # replaced, wait until it's back
+                    res |= new is not None
         return res
+
+    def check(self) -> bool:
+        # Non-blocking, true once per change.
+        if self._inotify is None:
+            return self._poll()
+        if not self._changed.is_set():
+            return False
+        self._changed.clear()
+        # Don't reload into a half-replaced tree, the file coming back
+        # will be another event. Files missing from the start, e.g.
+        # includes yet to be written, don't hold reloads back.
+        with self._lock:
+            return all(
+                os.path.exists(f)
+                for f, stamp in self._files.items()
+                if stamp is not None
+            )
+
+    def close(self) -> None:
+        if self._thread is None:
+            return
+        os.write(self._wake_w, b"\0")
+        self._thread.join()
+        self._thread = None
+        assert self._inotify is not None
+        self._inotify.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)